@@ -0,0 +1,211 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import copy
+import logging
+from typing import AsyncGenerator, List, Optional
+from config import CLAUDE_MODEL, AGENT_MAX_STEPS, AGENT_TOKEN_BUDGET, PROMPT_CACHING, async_anthropic_client
+from tools import tools
+from tool_scheduler import execute_tools
+from history_manager import ConversationHistory
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Tool definitions with a cache breakpoint on the last one, built once so the
+# serialized prefix stays byte-identical between requests
+_cached_tools = None
+
+
+def cached_tools() -> List[dict]:
+    global _cached_tools
+    if _cached_tools is None:
+        _cached_tools = copy.deepcopy(tools)
+        if _cached_tools:
+            _cached_tools[-1]["cache_control"] = CACHE_CONTROL
+    return _cached_tools
+
+
+def build_request(system: str, messages: List[dict], project_snapshot: Optional[str] = None, **params) -> dict:
+    """
+    Assemble Messages API parameters. The request prefix is tools, then the
+    system prompt, then the project snapshot; each gets a cache breakpoint so
+    repeated turns read it from the prompt cache. A fourth breakpoint on the
+    newest message lets the next agent step reuse the conversation so far.
+    """
+    if not PROMPT_CACHING:
+        if project_snapshot:
+            system = f"{system}\n\n{project_snapshot}"
+        return dict(system=system, messages=messages, tools=tools, **params)
+
+    system_blocks = [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}]
+    if project_snapshot:
+        system_blocks.append({"type": "text", "text": project_snapshot, "cache_control": CACHE_CONTROL})
+
+    request_messages = messages
+    if messages:
+        last = messages[-1]
+        content = last["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}] if content else []
+        if content:
+            # Copy so the breakpoint never ends up in the stored history
+            content = [dict(block) for block in content]
+            content[-1]["cache_control"] = CACHE_CONTROL
+            request_messages = messages[:-1] + [{**last, "content": content}]
+
+    return dict(system=system_blocks, messages=request_messages, tools=cached_tools(), **params)
+
+
+def record_usage(usage, totals: dict):
+    """
+    Add one response's token usage (including prompt cache reads and writes)
+    to totals and to the metrics registry.
+    """
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    totals["input_tokens"] += usage.input_tokens
+    totals["output_tokens"] += usage.output_tokens
+    totals["cache_read_input_tokens"] += cache_read
+    totals["cache_creation_input_tokens"] += cache_write
+    metrics.increment("input_tokens", usage.input_tokens)
+    metrics.increment("output_tokens", usage.output_tokens)
+    metrics.increment("cache_read_input_tokens", cache_read)
+    metrics.increment("cache_creation_input_tokens", cache_write)
+    logger.info(
+        f"Model usage: input={usage.input_tokens} output={usage.output_tokens} "
+        f"cache_read={cache_read} cache_write={cache_write}"
+    )
+
+
+def serialize_block(block) -> dict:
+    """
+    Turn a response content block into the plain dict form accepted in messages.
+    """
+    if block.type == 'text':
+        return {"type": "text", "text": block.text}
+    if block.type == 'tool_use':
+        return {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+    return block.model_dump(exclude_none=True)
+
+
+def tool_result_block(tool_use_id: str, tool_result: dict) -> dict:
+    if tool_result['success']:
+        result = tool_result['result']
+        content = result if isinstance(result, str) else json.dumps(result, default=str)
+    else:
+        content = tool_result['error']
+    return {
+        "type": "tool_result",
+        "tool_use_id": tool_use_id,
+        "content": content,
+        "is_error": not tool_result['success']
+    }
+
+
+def format_tool_summary(name: str, tool_result: dict) -> str:
+    """
+    Human readable line for a tool call, as shown in the chat UI.
+    """
+    if tool_result['success']:
+        return f"\nTool used: {name}\nTool result: {tool_result['result']}\n"
+    return f"\nTool used: {name}\nTool error: {tool_result['error']}\n"
+
+
+async def run_agent_loop(
+    system: str,
+    messages: List[dict],
+    project_snapshot: Optional[str] = None,
+    max_steps: int = AGENT_MAX_STEPS,
+    token_budget: int = AGENT_TOKEN_BUDGET,
+    stream: bool = False,
+    max_tokens: int = 4096,
+    model: Optional[str] = None
+) -> AsyncGenerator[dict, None]:
+    """
+    Call the model, execute the tools it asks for and send the results back as
+    tool_result blocks until it ends its turn. messages is extended in place with
+    the assistant turns and tool results, and compacted before every step when
+    it is a ConversationHistory. project_snapshot is sent as a separately cached
+    system block after the system prompt.
+
+    Yields events:
+      {"type": "text", "text": ...}                           text deltas (stream=True only)
+      {"type": "tool_start", "id", "name", "input"}
+      {"type": "tool_result", "id", "name", "result"}
+      {"type": "step", "step", "text", "tools", "usage"}      after each model response
+      {"type": "stop", "reason", "steps", "usage"}            always last
+    """
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+    reason = "max_steps"
+    step = 0
+    while step < max_steps:
+        step += 1
+        if isinstance(messages, ConversationHistory):
+            await messages.compact()
+        params = build_request(system, messages, project_snapshot, model=model or CLAUDE_MODEL, max_tokens=max_tokens)
+        if stream:
+            async with async_anthropic_client.messages.stream(**params) as response_stream:
+                async for event in response_stream:
+                    if event.type == 'text':
+                        yield {"type": "text", "text": event.text}
+                response = await response_stream.get_final_message()
+        else:
+            response = await async_anthropic_client.messages.create(**params)
+
+        record_usage(response.usage, usage)
+        metrics.increment("agent_steps")
+        tool_uses = [block for block in response.content if block.type == 'tool_use']
+        text = "".join(block.text for block in response.content if block.type == 'text')
+        run_tools = response.stop_reason == 'tool_use' and tool_uses
+
+        content = [serialize_block(block) for block in response.content]
+        if not run_tools:
+            # A tool_use cut off by max_tokens or a stop sequence gets no tool_result, and the
+            # API rejects any later request whose history holds an unanswered tool_use
+            content = [block for block in content if block["type"] != "tool_use"]
+            if not content:
+                content = [{"type": "text", "text": f"[Response stopped: {response.stop_reason}]"}]
+        messages.append({"role": "assistant", "content": content})
+
+        step_tools = []
+        if run_tools:
+            for block in tool_uses:
+                yield {"type": "tool_start", "id": block.id, "name": block.name, "input": block.input}
+            results = await execute_tools([(block.name, block.input) for block in tool_uses])
+            for block, result in zip(tool_uses, results):
+                step_tools.append({"id": block.id, "name": block.name, "input": block.input, "result": result})
+                yield {"type": "tool_result", "id": block.id, "name": block.name, "result": result}
+            messages.append({
+                "role": "user",
+                "content": [tool_result_block(block.id, result) for block, result in zip(tool_uses, results)]
+            })
+
+        yield {"type": "step", "step": step, "text": text, "tools": step_tools, "usage": dict(usage)}
+
+        if not run_tools:
+            reason = response.stop_reason
+            break
+        total_input = usage["input_tokens"] + usage["cache_read_input_tokens"] + usage["cache_creation_input_tokens"]
+        if total_input + usage["output_tokens"] >= token_budget:
+            reason = "token_budget"
+            logger.info(f"Agent loop stopped after {step} steps: token budget of {token_budget} reached")
+            break
+
+    metrics.observe("agent_loop_steps", step)
+    yield {"type": "stop", "reason": reason, "steps": step, "usage": usage}
@@ -19,9 +19,11 @@ import logging
 from typing import AsyncGenerator
 from pydantic import BaseModel
 from fastapi import HTTPException
-from config import CLAUDE_MODEL, anthropic_client
-from tools import tools, execute_tool
-from project_state import sync_project_state_with_fs, save_state_to_file, project_state
+from agent_loop import run_agent_loop
+from history_manager import ConversationHistory
+from project_state import sync_project_state_with_fs, project_state
+from shared_utils import current_project_root
+from sessions import Session, session_store
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -30,18 +32,17 @@ logger = logging.getLogger(__name__)
 SEARCH_PROVIDER = os.getenv("SEARCH_PROVIDER", "SEARXNG")
 MAX_ITERATIONS = int(os.getenv("MAX_ITERATIONS", "5"))
 
-# Global state for automode
-automode_progress = 0
-automode_messages = []
-
 class AutomodeRequest(BaseModel):
     message: str
 
-async def start_automode_logic(request: AutomodeRequest) -> AsyncGenerator[str, None]:
-    global automode_progress, automode_messages, project_state
+async def start_automode_logic(request: AutomodeRequest, session: Session) -> AsyncGenerator[str, None]:
+    # Progress and messages live on the session so concurrent runs do not mix
+    current_project_root.set(session.project_root)
+    session.automode_running = True
     try:
-        automode_progress = 0
-        automode_messages = []
+        session.reset_automode()
+        session.automode_status = "running"
+        await session_store.save_automode(session)
         
         # Synchronize project state at the start
         await sync_project_state_with_fs()
@@ -63,10 +64,12 @@ async def start_automode_logic(request: AutomodeRequest) -> AsyncGenerator[str,
         1. create_folder(path): Create a new folder
         2. create_file(path, content=""): Create a new file with optional content
         3. write_to_file(path, content): Write content to an existing file
-        4. read_file(path): Read the contents of a file
-        5. list_files(path): List all files and directories in the specified path
-        6. search(query): Perform a web search using {SEARCH_PROVIDER}
-        7. delete_file(path): Delete a file or folder
+        4. edit_file(path, edits or patch): Change part of an existing file with search/replace edits or a unified diff
+        5. batch_write(folders, files): Create several folders and files in one call
+        6. read_file(path): Read the contents of a file
+        7. list_files(path): List all files and directories in the specified path
+        8. search(query): Perform a web search using {SEARCH_PROVIDER}
+        9. delete_file(path): Delete a file or folder
 
         File Operation Guidelines:
         1. The 'projects' directory is your root directory. All file operations occur within this directory.
@@ -90,60 +93,60 @@ async def start_automode_logic(request: AutomodeRequest) -> AsyncGenerator[str,
         # sync_project_state_with_fs()
         # logger.debug(f"Initial project state: {project_state}")
 
-        conversation_history = [
+        conversation_history = ConversationHistory([
             {"role": "user", "content": request.message}
-        ]
-
-        for i in range(MAX_ITERATIONS):
-            logger.debug(f"Automode iteration {i + 1}/{MAX_ITERATIONS}")
-            
-            response = anthropic_client.messages.create(
-                model=CLAUDE_MODEL,
-                max_tokens=4096,
-                system=system_message,
-                messages=conversation_history,
-                tools=tools
-            )
-
-            assistant_response = ""
-            for content in response.content:
-                if content.type == 'text':
-                    assistant_response += content.text + "\n"
-                elif content.type == 'tool_use':
-                    tool_name = content.name
-                    tool_input = content.input
-                    logger.debug(f"Using tool: {tool_name} with input: {tool_input}")
-                    tool_result = await execute_tool(tool_name, tool_input)
-                    assistant_response += f"Used tool: {tool_name}\nResult: {tool_result}\n\n"
-                    # Log and save project state after each tool use
-                    logger.debug(f"Project state after {tool_name}: {project_state}")
-                    await save_state_to_file(project_state)
-
-            automode_messages.append({"role": "assistant", "content": assistant_response})
-            automode_progress = (i + 1) / MAX_ITERATIONS * 100
-
-            logger.debug(f"Progress: {automode_progress}, Messages: {automode_messages}")
-
-            yield f"data: {json.dumps({'event': 'message', 'content': assistant_response})}\n\n"
-            await asyncio.sleep(0.1)  # Add a small delay to ensure the event is sent
-
-            if "AUTOMODE_COMPLETE" in assistant_response:
-                break
-
-            conversation_history.append({"role": "assistant", "content": assistant_response})
-            conversation_history.append({"role": "user", "content": "Continue with the next step if necessary or reply with AUTOMODE_COMPLETE if finished."})
+        ])
+
+        # Each iteration is one model response; tool results go back to the model as
+        # tool_result blocks inside the agent loop instead of flattened text.
+        iteration = 0
+        complete = False
+        while iteration < MAX_ITERATIONS and not complete:
+            stop_reason = None
+            async for event in run_agent_loop(system_message, conversation_history, max_steps=MAX_ITERATIONS - iteration):
+                if event["type"] == "step":
+                    iteration += 1
+                    logger.debug(f"Automode iteration {iteration}/{MAX_ITERATIONS}")
+                    assistant_response = event["text"] + "\n" if event["text"] else ""
+                    for tool in event["tools"]:
+                        assistant_response += f"Used tool: {tool['name']}\nResult: {tool['result']}\n\n"
+
+                    session.add_automode_message({"role": "assistant", "content": assistant_response})
+                    session.automode_progress = iteration / MAX_ITERATIONS * 100
+                    session.touch()
+                    await session_store.save_automode(session)
+                    logger.debug(f"Session {session.id} progress: {session.automode_progress}")
+
+                    yield f"data: {json.dumps({'event': 'message', 'content': assistant_response})}\n\n"
+                    await asyncio.sleep(0.1)  # Add a small delay to ensure the event is sent
+
+                    if "AUTOMODE_COMPLETE" in event["text"]:
+                        complete = True
+                elif event["type"] == "stop":
+                    stop_reason = event["reason"]
 
             await sync_project_state_with_fs()
             logger.debug(f"Project state after syncing: {project_state}")
 
+            if complete or stop_reason == "token_budget":
+                break
+            if conversation_history[-1]["role"] == "assistant":
+                conversation_history.append({"role": "user", "content": "Continue with the next step if necessary or reply with AUTOMODE_COMPLETE if finished."})
 
-        automode_progress = 100
+        session.automode_progress = 100
+        session.automode_status = "completed"
+        await session_store.save_automode(session)
         yield f"data: {json.dumps({'event': 'end'})}\n\n"
-        logger.debug(f"Final Progress: {automode_progress}, Messages: {automode_messages}")
+        logger.debug(f"Session {session.id} automode finished, messages: {session.automode_messages}")
 
     except Exception as e:
         logger.error(f"Error in automode: {str(e)}", exc_info=True)
-        automode_messages.append({"role": "system", "content": f"Error: {str(e)}"})
-        automode_progress = 100
+        session.add_automode_message({"role": "system", "content": f"Error: {str(e)}"})
+        session.automode_progress = 100
+        session.automode_status = "error"
+        await session_store.save_automode(session)
         yield f"data: {json.dumps({'event': 'error', 'content': str(e)})}\n\n"
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        session.automode_running = False
+        session.touch()
\ No newline at end of file
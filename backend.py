@@ -13,6 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
 import os
+import json
+import base64
+import mimetypes
+import time
 import logging
 import asyncio
 from typing import Optional, List, Callable
@@ -21,25 +25,39 @@ from functools import wraps
 import subprocess
 import platform
 import shutil
-import tempfile
 from pathlib import Path
-from starlette.background import BackgroundTask
+from datetime import datetime
 import uvicorn
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request, Query
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from automode_logic import AutomodeRequest, start_automode_logic, automode_messages, automode_progress
-from tools import tools, execute_tool 
+from automode_logic import AutomodeRequest, start_automode_logic
+from agent_loop import run_agent_loop, format_tool_summary
+from project_map import render_project_map, IgnoreRules
 from project_state import (
     sync_project_state_with_fs, clear_state_file, refresh_project_state,
-    initialize_project_state, project_state, save_state_to_file
+    initialize_project_state, project_state,
+    start_project_state_watcher, stop_project_state_watcher, flush_project_state,
+    project_state_view, update_project_state
 )
-from config import PROJECTS_DIR, UPLOADS_DIR, CLAUDE_MODEL, anthropic_client
+from sessions import Session, get_session, session_store, evict_sessions_periodically
+from state_backend import state_backend
+from config import (
+    PROJECTS_DIR, UPLOADS_DIR, CLAUDE_MODEL, async_anthropic_client, search_http_client,
+    IMAGE_MAX_UPLOAD_BYTES, IMAGE_ANALYSIS_CACHE_TTL, IMAGE_ANALYSIS_CACHE_MAX_ENTRIES,
+    UPLOAD_MAX_BYTES, UPLOAD_CHUNK_BYTES, DOWNLOAD_COMPRESSION_LEVEL
+)
+from zip_export import iter_export_entries, stream_zip
+from file_reader import iter_file
+from uploads import store_upload, prune_blobs, UploadTooLarge
+from image_pipeline import prepare_image_async, content_hash_async
+import metrics
 from shared_utils import (
-    system_prompt, perform_search, encode_image_to_base64, create_folder, create_file,
-    read_file, list_files, delete_file, write_to_file, get_safe_path
+    system_prompt, search_results, SearchError, create_folder, create_file,
+    read_file_slice, list_directory, format_listing_entry, delete_file, write_to_file, batch_write, get_safe_path, get_project_root,
+    to_state_path, current_project_root, search_cache, SearchCache, sync_filesystem
 )
 
 load_dotenv()
@@ -53,8 +71,15 @@ api_router = APIRouter()
 async def lifespan(app: FastAPI):
     # Startup
     await initialize_project_state()
+    pruned = await asyncio.to_thread(prune_blobs)
+    if pruned:
+        logger.info(f"Removed {pruned} unreferenced upload contents")
+    await start_project_state_watcher()
     await sync_project_state_with_fs()
     logger.info("Project state synchronized with file system")
+    eviction_task = asyncio.create_task(evict_sessions_periodically())
+    # Picks up sessions, project state and automode jobs changed by other workers
+    state_watch_task = asyncio.create_task(state_backend.watch())
     logger.info("Available endpoints:")
     for route in app.routes:
         if hasattr(route, "methods"):
@@ -62,8 +87,16 @@ async def lifespan(app: FastAPI):
                 logger.info(f"{method} {route.path}")
     yield
     # Shutdown
+    eviction_task.cancel()
+    state_watch_task.cancel()
+    await stop_project_state_watcher()
+    await flush_project_state()
+    state_backend.close()
+    await async_anthropic_client.close()
+    await search_http_client.aclose()
 
-app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None)
+# Every request runs in a session, which also sets the project root for file operations
+app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, dependencies=[Depends(get_session)])
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -105,6 +138,16 @@ class FilePath(BaseModel):
     path: str
     content: Optional[str] = None
 
+class BatchFile(BaseModel):
+    path: str
+    content: str = ""
+    overwrite: Optional[bool] = None
+
+class BatchWriteRequest(BaseModel):
+    folders: List[str] = []
+    files: List[BatchFile] = []
+    overwrite: bool = False
+
 class CommandRequest(BaseModel):
     command: str
 
@@ -112,24 +155,34 @@ class DirectoryContents(BaseModel):
     path: str
     contents: List[str]
 
-# Conversation history
-conversation_history = []
-    
 @app.post("/automode")
-async def start_automode(request: Request):
-    automode_request = AutomodeRequest(**request.json())
-    sync_project_state_with_fs()  # Ensure state is synced before starting
-    return StreamingResponse(start_automode_logic(automode_request), media_type="text/event-stream")
+async def start_automode(request: Request, session: Session = Depends(get_session)):
+    automode_request = AutomodeRequest(**await request.json())
+    await sync_project_state_with_fs()  # Ensure state is synced before starting
+    return StreamingResponse(start_automode_logic(automode_request, session), media_type="text/event-stream")
 
 @app.get("/automode")
-async def start_automode_get(message: str):
+async def start_automode_get(message: str, session: Session = Depends(get_session)):
     automode_request = AutomodeRequest(message=message)
-    sync_project_state_with_fs()  # Ensure state is synced before starting
-    return StreamingResponse(start_automode_logic(automode_request), media_type="text/event-stream")
+    await sync_project_state_with_fs()  # Ensure state is synced before starting
+    return StreamingResponse(start_automode_logic(automode_request, session), media_type="text/event-stream")
 
 @app.get("/automode-status")
-async def get_automode_status():
-    return {"progress": automode_progress, "messages": automode_messages}
+async def get_automode_status(session: Session = Depends(get_session)):
+    return {"progress": session.automode_progress, "messages": session.automode_messages}
+
+@app.get("/session")
+async def get_session_info(session: Session = Depends(get_session)):
+    info = session.info()
+    info["project"] = project_state.stats(to_state_path(session.project_root))
+    return info
+
+@app.delete("/session")
+async def end_session(session: Session = Depends(get_session)):
+    if session.is_busy():
+        raise HTTPException(status_code=409, detail="Session has a request in progress")
+    await session_store.delete(session.id)
+    return {"message": f"Session {session.id} ended"}
 
 
 def is_safe_path(path: str) -> bool:
@@ -158,20 +211,22 @@ async def create_project(request: ProjectRequest, path: str):
         project_name = f"{request.template.lower()}_project"
         project_path = str(get_safe_path(path) / project_name).replace('\\', '/')
         os.makedirs(project_path, exist_ok=True)
+        # create_file expects paths relative to the project root
+        project_dir = os.path.relpath(project_path, get_project_root()).replace('\\', '/')
         
         if request.template == "react":
-            await create_file(os.path.join(project_path, "package.json").replace('\\', '/'), '{"name": "react-app", "version": "1.0.0"}')
-            await create_file(os.path.join(project_path, "src/App.js").replace('\\', '/'), 'import React from "react";\n\nfunction App() {\n  return <div>Hello, React!</div>;\n}\n\nexport default App;')
+            await create_file(os.path.join(project_dir, "package.json").replace('\\', '/'), '{"name": "react-app", "version": "1.0.0"}')
+            await create_file(os.path.join(project_dir, "src/App.js").replace('\\', '/'), 'import React from "react";\n\nfunction App() {\n  return <div>Hello, React!</div>;\n}\n\nexport default App;')
         elif request.template == "node":
-            await create_file(os.path.join(project_path, "package.json").replace('\\', '/'), '{"name": "node-app", "version": "1.0.0"}')
-            await create_file(os.path.join(project_path, "index.js").replace('\\', '/'), 'console.log("Hello, Node.js!");')
+            await create_file(os.path.join(project_dir, "package.json").replace('\\', '/'), '{"name": "node-app", "version": "1.0.0"}')
+            await create_file(os.path.join(project_dir, "index.js").replace('\\', '/'), 'console.log("Hello, Node.js!");')
         elif request.template == "python":
-            await create_file(os.path.join(project_path, "main.py").replace('\\', '/'), 'print("Hello, Python!")')
-            await create_file(os.path.join(project_path, "requirements.txt").replace('\\', '/'), '')
+            await create_file(os.path.join(project_dir, "main.py").replace('\\', '/'), 'print("Hello, Python!")')
+            await create_file(os.path.join(project_dir, "requirements.txt").replace('\\', '/'), '')
         else:
             raise ValueError(f"Unknown project template: {request.template}")
         
-        return {"message": f"{request.template} project created successfully at {os.path.relpath(project_path, PROJECTS_DIR).replace('\\', '/')}"}
+        return {"message": f"{request.template} project created successfully at {project_dir}"}
     except Exception as e:
         logger.error(f"Error creating project: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error creating project: {str(e)}")
@@ -200,14 +255,67 @@ async def create_file_endpoint(path: str = Query(...), content: str = ""):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/read_file")
-async def read_file_endpoint(path: str = Query(...)):
+async def read_file_endpoint(
+    path: str = Query(...),
+    offset: int = Query(0, ge=0, description="Byte offset to start reading at"),
+    limit: Optional[int] = Query(None, ge=0, description="Number of bytes to read"),
+    start_line: Optional[int] = Query(None, ge=1, description="First line to read, 1-based"),
+    end_line: Optional[int] = Query(None, ge=1, description="Last line to read, inclusive"),
+    raw: bool = Query(False, description="Stream the bytes from offset instead of returning JSON")
+):
+    if raw:
+        try:
+            full_path = get_safe_path(path)
+        except ValueError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        if not full_path.is_file():
+            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+        size = full_path.stat().st_size
+        length = max(0, size - offset) if limit is None else max(0, min(limit, size - offset))
+        media_type = mimetypes.guess_type(full_path.name)[0] or "application/octet-stream"
+        logger.info(f"Streaming {length} bytes of {full_path} from {offset}")
+        return StreamingResponse(
+            iter_file(str(full_path), offset, length),
+            media_type=media_type,
+            headers={"Content-Length": str(length), "Content-Disposition": f'inline; filename="{full_path.name}"'}
+        )
     try:
-        content = await read_file(path)
-        logger.info(f"File read: {path}")
-        return {"content": content}
+        file_slice = await read_file_slice(path, offset, limit, start_line, end_line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"Error reading file: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=404, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "content": file_slice.text,
+        "size": file_slice.size,
+        "start": file_slice.start,
+        "end": file_slice.end,
+        "start_line": file_slice.start_line,
+        "end_line": file_slice.end_line,
+        "total_lines": file_slice.total_lines,
+        "truncated": file_slice.truncated
+    }
+
+@app.post("/batch_write")
+async def batch_write_endpoint(request: BatchWriteRequest):
+    files = [item.model_dump(exclude_none=True) for item in request.files]
+    try:
+        results = await batch_write(request.folders, files, request.overwrite)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in batch write: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return {
+        "results": [{key: value for key, value in result._asdict().items() if value is not None} for result in results],
+        "counts": counts
+    }
 
 @app.post("/write_file")
 async def write_file_endpoint(request: Request, path: str = Query(...)):
@@ -234,14 +342,42 @@ async def write_file_endpoint(request: Request, path: str = Query(...)):
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/list_files")
-async def list_files_endpoint(path: str = Query(".")):
+async def list_files_endpoint(
+    path: str = Query("."),
+    sort: str = Query("name", description="name, size, modified or type"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    dirs_first: bool = Query(True),
+    pattern: Optional[str] = Query(None, description="Glob on the entry name, e.g. *.py"),
+    type: Optional[str] = Query(None, pattern="^(file|dir)$"),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    recursive: bool = Query(False),
+    max_depth: Optional[int] = Query(None, ge=1),
+    format: str = Query("full", pattern="^(full|compact)$")
+):
     try:
-        files = await list_files(path)
-        return {"files": files, "currentDirectory": path}
+        listing = await list_directory(
+            path, sort=sort, descending=order == "desc", dirs_first=dirs_first, pattern=pattern, kind=type,
+            offset=offset, limit=limit, recursive=recursive, max_depth=max_depth
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+    response = {"currentDirectory": path, "total": listing["total"], "offset": offset,
+                "limit": limit, "truncated": listing["truncated"]}
+    if format == "compact":
+        # One row per entry: [name, isDirectory, size (null for folders), mtime in epoch seconds]
+        response["columns"] = ["name", "isDirectory", "size", "mtime"]
+        response["rows"] = [[e.path, e.is_dir, e.size, int(e.mtime)] for e in listing["entries"]]
+    else:
+        response["files"] = [format_listing_entry(e) for e in listing["entries"]]
+    return response
+
 @app.delete("/delete_file")
 async def delete_file_endpoint(path: str = Query(...)):
     try:
@@ -253,67 +389,128 @@ async def delete_file_endpoint(path: str = Query(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _receive_upload(filename: Optional[str], chunks, content_type: Optional[str]) -> dict:
+    try:
+        stored = await store_upload(filename, chunks)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await sync_filesystem(UPLOADS_DIR)
+    state_path = to_state_path(stored.path)
+    await update_project_state(state_path, is_folder=False, size=stored.size, hash=stored.sha256)
+
+    name = os.path.basename(stored.path)
+    if stored.is_text:
+        file_contents = stored.preview
+        if stored.truncated:
+            file_contents += f"\n... [preview truncated, {stored.size} bytes in total]"
+    else:
+        file_contents = f"[Binary file {name}, {stored.size} bytes, SHA-256 {stored.sha256}]"
+    return {
+        "message": f"File {name} uploaded successfully to uploads directory",
+        "file_contents": file_contents,
+        "path": state_path,
+        "size": stored.size,
+        "sha256": stored.sha256,
+        "content_type": content_type,
+        "is_text": stored.is_text,
+        "truncated": stored.truncated,
+        "deduplicated": stored.deduplicated
+    }
+
+async def _upload_file_chunks(file: UploadFile):
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        yield chunk
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
-        file_path = os.path.join(UPLOADS_DIR, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(contents)
-        
-        # Read the file contents
-        with open(file_path, "r") as f:
-            file_contents = f.read()
-        
-        return {
-            "message": f"File {file.filename} uploaded successfully to uploads directory",
-            "file_contents": file_contents
-        }
+        if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload larger than {UPLOAD_MAX_BYTES} bytes")
+        return await _receive_upload(file.filename, _upload_file_chunks(file), file.content_type)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
+@app.put("/upload/{filename}")
+async def upload_file_stream(filename: str, request: Request):
+    """
+    Raw request body upload, written to disk as it arrives without multipart parsing.
+    """
+    try:
+        content_length = request.headers.get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload larger than {UPLOAD_MAX_BYTES} bytes")
+        return await _receive_upload(filename, request.stream(), request.headers.get("content-type"))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error uploading file: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+
+
+# Analyses by model and image content hash, so the same upload is only analysed once
+image_analysis_cache = SearchCache(
+    ttl=IMAGE_ANALYSIS_CACHE_TTL, max_entries=IMAGE_ANALYSIS_CACHE_MAX_ENTRIES,
+    backend=state_backend, namespace="image_analysis", metrics_prefix="image_analysis_cache"
+)
+
+async def _analyze_prepared_image(contents: bytes, content_type: Optional[str]) -> str:
+    try:
+        prepared = await prepare_image_async(contents, content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    encoded_image = await asyncio.to_thread(lambda: base64.b64encode(prepared.data).decode('utf-8'))
+    logger.debug(f"Image encoded, length: {len(encoded_image)}")
+
+    analysis_result = await async_anthropic_client.messages.create(
+        model=CLAUDE_MODEL,
+        max_tokens=1000,
+        system=system_prompt,
+        messages=[
+            {
+                "role": "user", 
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": prepared.media_type,
+                            "data": encoded_image
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": "Analyze this image and describe what you see."
+                    }
+                ]
+            }
+        ]
+    )
+    logger.debug("Analysis result received from Anthropic API")
+    return analysis_result.content[0].text
 
 @app.post("/analyze_image")
 async def analyze_image(file: UploadFile = File(...)):
     try:
         logger.debug(f"Received file: {file.filename}, content_type: {file.content_type}")
+        if file.size is not None and file.size > IMAGE_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image larger than {IMAGE_MAX_UPLOAD_BYTES} bytes")
         contents = await file.read()
         logger.debug(f"File contents read, length: {len(contents)} bytes")
+        if len(contents) > IMAGE_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image larger than {IMAGE_MAX_UPLOAD_BYTES} bytes")
 
-        encoded_image = await encode_image_to_base64(contents)
-        
-        if encoded_image.startswith("Error encoding image:"):
-            raise ValueError(encoded_image)
-
-        logger.debug(f"Image encoded, length: {len(encoded_image)}")
-
-        analysis_result = anthropic_client.messages.create(
-            model=CLAUDE_MODEL,
-            max_tokens=1000,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user", 
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": encoded_image
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": "Analyze this image and describe what you see."
-                        }
-                    ]
-                }
-            ]
+        key = f"{CLAUDE_MODEL}:{await content_hash_async(contents)}"
+        analysis = await image_analysis_cache.get_or_fetch(
+            key, lambda: _analyze_prepared_image(contents, file.content_type)
         )
-        logger.debug("Analysis result received from Anthropic API")
-        return {"analysis": analysis_result.content[0].text}
+        return {"analysis": analysis}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing image: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error analyzing image: {str(e)}")
@@ -321,9 +518,12 @@ async def analyze_image(file: UploadFile = File(...)):
 @app.post("/search")
 async def search(query: SearchQuery):
     try:
-        results = await perform_search(query.query)
-        logger.info(f"Search results: {results}")
-        return JSONResponse(content={"results": results})
+        results = await search_results(query.query)
+        logger.info(f"Search for '{query.query}' returned {len(results)} results")
+        return {"query": query.query, "results": [result.model_dump() for result in results]}
+    except SearchError as e:
+        logger.error(f"Error performing search: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Error performing search: {str(e)}")
     except Exception as e:
         logger.error(f"Error performing search: {str(e)}", exc_info=True)
         error_details = f"{type(e).__name__}: {str(e)}"
@@ -333,114 +533,182 @@ async def search(query: SearchQuery):
         raise HTTPException(status_code=500, detail=f"Error performing search: {error_details}")
 
 @app.post("/clear_state")
-async def clear_project_state():
+async def clear_project_state(session: Session = Depends(get_session)):
     try:
-        global project_state, conversation_history
+        global project_state
         project_state = await clear_state_file()
         await sync_project_state_with_fs()
-        conversation_history = []  # Clear the conversation history
+        session.history.clear()  # Clear the conversation history
+        await session_store.save(session)
         logger.info("Project state cleared and synced with file system")
         return {"message": "Project state and chat history cleared successfully"}
     except Exception as e:
         logger.error(f"Error clearing project state: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def build_project_snapshot(session: Session) -> str:
+    # Rendered in sorted order so the cached prompt prefix only changes when the project does
+    folders, files = await project_state_view(to_state_path(session.project_root))
+    rules = IgnoreRules.for_project(files, session.project_root)
+    return f"Current project state:\n{render_project_map(folders, files, rules=rules)}"
+
+def sse_event(event: str, **data) -> str:
+    return f"data: {json.dumps({'event': event, **data})}\n\n"
+
+async def chat_stream_events(message: str, session: Session):
+    current_project_root.set(session.project_root)
+    started = time.perf_counter()
+    first_token_at = None
+    try:
+        async with session.lock:
+            session.history.append({"role": "user", "content": message})
+            await sync_project_state_with_fs()
+            logger.info(f"Streaming message to AI: {message}")
+
+            response_content = ""
+            async for event in run_agent_loop(system_prompt, session.history, await build_project_snapshot(session), stream=True):
+                if event["type"] == "text":
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        ttft = first_token_at - started
+                        metrics.observe("chat_stream_ttft_seconds", ttft)
+                        logger.info(f"Chat stream time to first token: {ttft:.3f}s")
+                    response_content += event["text"]
+                    yield sse_event("text", content=event["text"])
+                elif event["type"] == "tool_start":
+                    yield sse_event("tool_start", id=event["id"], name=event["name"], input=event["input"])
+                elif event["type"] == "tool_result":
+                    response_content += format_tool_summary(event["name"], event["result"])
+                    yield sse_event("tool_result", id=event["id"], name=event["name"], **event["result"])
+                elif event["type"] == "stop":
+                    stop_reason, steps, usage = event["reason"], event["steps"], event["usage"]
+
+            await sync_project_state_with_fs()
+            await session_store.save(session)
+
+            total = time.perf_counter() - started
+            metrics.observe("chat_stream_total_seconds", total)
+            metrics.increment("chat_stream_requests")
+            yield sse_event(
+                "end", response=response_content, stop_reason=stop_reason, steps=steps, usage=usage,
+                ttft=None if first_token_at is None else first_token_at - started, total=total
+            )
+    except Exception as e:
+        metrics.increment("chat_stream_errors")
+        logger.error(f"Error in chat stream: {str(e)}", exc_info=True)
+        yield sse_event("error", content=str(e))
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, session: Session = Depends(get_session)):
+    return StreamingResponse(chat_stream_events(request.message, session), media_type="text/event-stream")
+
+@app.get("/chat/stream")
+async def chat_stream_get(message: str, session: Session = Depends(get_session)):
+    return StreamingResponse(chat_stream_events(message, session), media_type="text/event-stream")
+
+@app.get("/chat/history")
+async def get_chat_history_stats(session: Session = Depends(get_session)):
+    return session.history.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    return {**metrics.snapshot(), "sessions": session_store.stats(), "search_cache": search_cache.stats(),
+            "image_analysis_cache": image_analysis_cache.stats()}
+
 # Chat endpoint
 @app.post("/chat")
-async def chat(request: ChatRequest):
-    global conversation_history, project_state
+async def chat(request: ChatRequest, session: Session = Depends(get_session)):
+    global project_state
     try:
-        message = request.message
-        conversation_history.append({"role": "user", "content": message})
-        
-        # Sync project state before each interaction
-        project_state = await sync_project_state_with_fs()
-        
-        # Update system prompt with current project state
-        current_system_prompt = f"{system_prompt}\n\nCurrent project state:\nFolders: {', '.join(project_state['folders'])}\nFiles: {', '.join(project_state['files'])}"
-        
-        logger.info(f"Sending message to AI: {message}")
-        logger.debug(f"Current project state before AI response: {project_state}")
-        
-        # Use asyncio.to_thread to run the synchronous method in a separate thread
-        response = await asyncio.to_thread(
-            anthropic_client.messages.create,
-            model=CLAUDE_MODEL,
-            max_tokens=4096,
-            system=current_system_prompt,
-            messages=conversation_history,
-            tools=tools
-        )
-        
-        logger.info(f"AI response: {response.content}")
-        
-        response_content = ""
-        task_complete = False
-        for content in response.content:
-            if content.type == 'text':
-                logger.info(f"Text response: {content.text}")
-                response_content += content.text
-            elif content.type == 'tool_use':
-                tool_name = content.name
-                tool_input = content.input
-                logger.info(f"Tool used: {tool_name}, Input: {tool_input}")
-                tool_result = await execute_tool(tool_name, tool_input)
-                if tool_result['success']:
-                    response_content += f"\nTool used: {tool_name}\nTool result: {tool_result['result']}\n"
-                else:
-                    response_content += f"\nTool used: {tool_name}\nTool error: {tool_result['error']}\n"
-                logger.info(f"Tool result: {tool_result}")
-            elif content.type == 'task_complete':
-                task_complete = True
-
-        if task_complete:
-            response_content += "\nTask complete."
-
-        conversation_history.append({"role": "assistant", "content": response_content})
-        
-        # Sync project state after AI response
-        project_state = await sync_project_state_with_fs()
-        logger.debug(f"Current project state after AI response: {project_state}")
-        
+        async with session.lock:
+            message = request.message
+            session.history.append({"role": "user", "content": message})
+
+            # Sync project state before each interaction
+            project_state = await sync_project_state_with_fs()
+
+            # Project state is sent as its own cached block after the system prompt
+            project_snapshot = await build_project_snapshot(session)
+
+            logger.info(f"Sending message to AI (session {session.id}): {message}")
+            logger.debug(f"Current project state before AI response: {project_state}")
+
+            # Let the model work through its tool calls until it ends its turn
+            response_content = ""
+            async for event in run_agent_loop(system_prompt, session.history, project_snapshot):
+                if event["type"] == "step":
+                    logger.info(f"AI response step {event['step']}: {event['text']}")
+                    response_content += event["text"]
+                    for tool in event["tools"]:
+                        logger.info(f"Tool used: {tool['name']}, Input: {tool['input']}, Result: {tool['result']}")
+                        response_content += format_tool_summary(tool["name"], tool["result"])
+                elif event["type"] == "stop":
+                    logger.info(f"Agent loop finished after {event['steps']} steps ({event['reason']}), usage: {event['usage']}")
+
+            # Sync project state after AI response
+            project_state = await sync_project_state_with_fs()
+            logger.debug(f"Current project state after AI response: {project_state}")
+            await session_store.save(session)
+
         return {"response": response_content}
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
     
+def _parse_since(since: Optional[str]) -> Optional[float]:
+    if not since:
+        return None
+    try:
+        return float(since)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(since.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid since value '{since}', expected a Unix timestamp or ISO 8601 date")
+
 @api_router.get("/download_projects")
-async def download_projects():
-    if not os.path.exists(PROJECTS_DIR):
+async def download_projects(
+    path: str = Query("", description="Folder to export, relative to the project root"),
+    since: Optional[str] = Query(None, description="Only files modified after this Unix timestamp or ISO 8601 date"),
+    ignore: bool = Query(True, description="Leave out files matched by the ignore rules and .gitignore"),
+    compression: int = Query(DOWNLOAD_COMPRESSION_LEVEL, ge=0, le=9, description="0 stores files, 9 is smallest")
+):
+    """
+    Zip of the project root (or a folder in it), streamed while it is created.
+    The X-Export-Time header can be passed back as since for the next
+    incremental export.
+    """
+    project_root = get_project_root()
+    if not os.path.exists(project_root):
         raise HTTPException(status_code=404, detail="Projects directory not found")
-
-    temp_dir = tempfile.mkdtemp()
     try:
-        zip_filename = "projects.zip"
-        zip_path = os.path.join(temp_dir, zip_filename)
-        
-        shutil.make_archive(zip_path[:-4], 'zip', PROJECTS_DIR)
-        
-        return FileResponse(
-            path=zip_path,
-            filename=zip_filename,
-            media_type='application/zip',
-            background=BackgroundTask(cleanup, temp_dir)
-        )
-    except Exception as e:
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        raise HTTPException(status_code=500, detail=f"Error creating zip file: {str(e)}")
-
-async def cleanup(temp_dir: str):
-    shutil.rmtree(temp_dir, ignore_errors=True)
-
-current_working_directory = PROJECTS_DIR
+        export_dir = get_safe_path(path) if path else Path(project_root)
+    except ValueError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if not export_dir.is_dir():
+        raise HTTPException(status_code=404, detail=f"Folder not found: {path}")
+
+    export_time = time.time()
+    subpath = export_dir.resolve().relative_to(Path(project_root).resolve()).as_posix()
+    entries = iter_export_entries(project_root, "" if subpath == "." else subpath, _parse_since(since), ignore)
+    zip_filename = f"{export_dir.name if path else 'projects'}.zip"
+    logger.info(f"Streaming export of '{subpath}' (since: {since}, compression: {compression})")
+    return StreamingResponse(
+        stream_zip(entries, compression),
+        media_type='application/zip',
+        headers={
+            "Content-Disposition": f'attachment; filename="{zip_filename}"',
+            "X-Export-Time": str(export_time)
+        }
+    )
 
-async def get_relative_cwd():
-    global current_working_directory
-    return str(Path(current_working_directory).relative_to(PROJECTS_DIR))
+def get_relative_cwd(session: Session) -> str:
+    return session.cwd
 
 @api_router.get("/console/cwd")
-async def console_get_current_working_directory():
-    return {"cwd": await get_relative_cwd()}
+async def console_get_current_working_directory(session: Session = Depends(get_session)):
+    return {"cwd": get_relative_cwd(session)}
 
 async def execute_shell_command(command, cwd):
     shell = await get_shell()
@@ -467,81 +735,82 @@ async def get_shell():
     return "cmd.exe" if platform.system() == "Windows" else "/bin/bash"
 
 @api_router.post("/console/execute")
-async def console_execute_command(request: CommandRequest):
-    global current_working_directory
+async def console_execute_command(request: CommandRequest, session: Session = Depends(get_session)):
     try:
         command_parts = request.command.split()
         cmd = command_parts[0].lower()
+        # The working directory is kept per session, relative to its project root
+        cwd = session.cwd
 
         if cmd == "cd":
-            return await handle_cd(command_parts[1] if len(command_parts) > 1 else ".")
+            return await handle_cd(command_parts[1] if len(command_parts) > 1 else ".", session)
         elif cmd == "ls" or (cmd == "dir" and platform.system() == "Windows"):
-            return await handle_ls(current_working_directory)
+            return await handle_ls(cwd)
         elif cmd == "pwd":
-            return await handle_pwd(current_working_directory)
+            return await handle_pwd(cwd)
         elif cmd == "echo":
-            return await handle_echo(command_parts[1:], current_working_directory)
+            return await handle_echo(command_parts[1:], cwd)
         elif cmd == "cat" or cmd == "type":
-            return await handle_cat(command_parts[1] if len(command_parts) > 1 else "", current_working_directory)
+            return await handle_cat(command_parts[1] if len(command_parts) > 1 else "", cwd)
         elif cmd == "mkdir":
-            return await handle_mkdir(command_parts[1] if len(command_parts) > 1 else "", current_working_directory)
+            return await handle_mkdir(command_parts[1] if len(command_parts) > 1 else "", cwd)
         elif cmd == "touch" or cmd == "echo.":
-            return await handle_touch(command_parts[1] if len(command_parts) > 1 else "", current_working_directory)
+            return await handle_touch(command_parts[1] if len(command_parts) > 1 else "", cwd)
         else:
-            output = await execute_shell_command(request.command, current_working_directory)
-            return {"result": output, "cwd": await get_relative_cwd()}
+            output = await execute_shell_command(request.command, cwd)
+            return {"result": output, "cwd": cwd}
     except Exception as e:
         logger.error(f"Error in console_execute_command: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-async def handle_cd(path):
-    global current_working_directory
+async def handle_cd(path, session: Session):
     try:
-        new_path = get_safe_path(os.path.join(current_working_directory, path))
+        new_path = get_safe_path(os.path.join(session.cwd, path))
         if new_path.is_dir():
-            current_working_directory = str(new_path)
-            return {"result": f"Changed directory to: {await get_relative_cwd()}", "cwd": await get_relative_cwd()}
+            session.cwd = Path(os.path.relpath(new_path, Path(get_project_root()).resolve())).as_posix()
+            await session_store.save(session)
+            return {"result": f"Changed directory to: {session.cwd}", "cwd": session.cwd}
         else:
-            return {"result": f"Directory not found or access denied: {path}", "cwd": await get_relative_cwd()}
+            return {"result": f"Directory not found or access denied: {path}", "cwd": session.cwd}
     except Exception as e:
-        return {"result": f"Error changing directory: {str(e)}", "cwd": await get_relative_cwd()}
+        return {"result": f"Error changing directory: {str(e)}", "cwd": session.cwd}
 
 async def handle_ls(cwd):
     full_path = get_safe_path(cwd)
     items = os.listdir(full_path)
-    return {"result": "\n".join(items), "cwd": await get_relative_cwd()}
+    return {"result": "\n".join(items), "cwd": cwd}
 
 async def handle_pwd(cwd):
     full_path = get_safe_path(cwd)
-    return {"result": str(full_path), "cwd": await get_relative_cwd()}
+    return {"result": str(full_path), "cwd": cwd}
 
 async def handle_echo(args, cwd):
-    return {"result": " ".join(args), "cwd": await get_relative_cwd()}
+    return {"result": " ".join(args), "cwd": cwd}
 
 async def handle_cat(filename, cwd):
     try:
         full_path = get_safe_path(os.path.join(cwd, filename))
         with full_path.open('r') as file:
             content = file.read()
-        return {"result": content, "cwd": await get_relative_cwd()}
+        return {"result": content, "cwd": cwd}
     except Exception as e:
-        return {"result": f"Error reading file: {str(e)}", "cwd": await get_relative_cwd()}
+        return {"result": f"Error reading file: {str(e)}", "cwd": cwd}
 
 async def handle_mkdir(dirname, cwd):
     try:
         full_path = get_safe_path(os.path.join(cwd, dirname))
         full_path.mkdir(parents=True, exist_ok=True)
-        return {"result": f"Directory created: {dirname}", "cwd": await get_relative_cwd()}
+        return {"result": f"Directory created: {dirname}", "cwd": cwd}
     except Exception as e:
-        return {"result": f"Error creating directory: {str(e)}", "cwd": await get_relative_cwd()}
+        return {"result": f"Error creating directory: {str(e)}", "cwd": cwd}
 
 async def handle_touch(filename, cwd):
     try:
         full_path = get_safe_path(os.path.join(cwd, filename))
         full_path.touch()
-        return {"result": f"File touched: {filename}", "cwd": await get_relative_cwd()}
+        return {"result": f"File touched: {filename}", "cwd": cwd}
     except Exception as e:
-        return {"result": f"Error touching file: {str(e)}", "cwd": await get_relative_cwd()}
+        return {"result": f"Error touching file: {str(e)}", "cwd": cwd}
 
 
 @api_router.post("/run_python")
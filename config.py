@@ -1,6 +1,6 @@
 import os
-from anthropic import Anthropic
-from tavily import TavilyClient
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,20 +13,159 @@ CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20240620")
 
 SEARCH_RESULTS_LIMIT = int(os.getenv('SEARXNG_RESULTS', '5'))
 
+# Size of search results given to the model: estimated tokens for all results and characters per snippet
+SEARCH_RESULTS_TOKEN_BUDGET = int(os.getenv("SEARCH_RESULTS_TOKEN_BUDGET", "800"))
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "300"))
+
 
 SEARCH_PROVIDER = os.getenv("SEARCH_PROVIDER", "SEARXNG").upper()
 
+# Search result cache: seconds a result is reused (0 disables the cache), results kept
+# in memory and whether results are also stored in the state backend
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "256"))
+SEARCH_CACHE_PERSIST = os.getenv("SEARCH_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com").rstrip("/")
+
+# Seconds allowed for one request to each search provider
+SEARXNG_TIMEOUT = float(os.getenv("SEARXNG_TIMEOUT", "10"))
+TAVILY_TIMEOUT = float(os.getenv("TAVILY_TIMEOUT", "20"))
+
+# Hedged search: query every configured provider (SEARCH_PROVIDER first, the next one after
+# SEARCH_HEDGE_DELAY seconds or when it fails) and use the first usable result
+SEARCH_HEDGED = os.getenv("SEARCH_HEDGED", "false").lower() in ("1", "true", "yes")
+SEARCH_HEDGE_DELAY = float(os.getenv("SEARCH_HEDGE_DELAY", "1.0"))
+
+# How project_state follows the projects directory: auto (inotify, else polling), inotify, poll or off
+PROJECT_STATE_WATCHER = os.getenv("PROJECT_STATE_WATCHER", "auto").lower()
+
+PROJECT_STATE_POLL_INTERVAL = float(os.getenv("PROJECT_STATE_POLL_INTERVAL", "2.0"))
+
+# Seconds to coalesce project state changes before writing them to the project index (0 writes every change)
+PROJECT_STATE_FLUSH_DELAY = float(os.getenv("PROJECT_STATE_FLUSH_DELAY", "1.0"))
+
+# Limits for one agent loop (model call -> tools -> tool results -> model call ...)
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "10"))
+AGENT_TOKEN_BUDGET = int(os.getenv("AGENT_TOKEN_BUDGET", "200000"))
+
+# Size limits for the project tree sent with every chat request
+PROJECT_MAP_TOKEN_BUDGET = int(os.getenv("PROJECT_MAP_TOKEN_BUDGET", "2000"))
+PROJECT_MAP_MAX_ENTRIES = int(os.getenv("PROJECT_MAP_MAX_ENTRIES", "50"))
+
+# Extra .gitignore-style patterns hidden from the project map, comma separated
+PROJECT_MAP_IGNORE = [p.strip() for p in os.getenv("PROJECT_MAP_IGNORE", "").split(",") if p.strip()]
+
+# Parsed .gitignore files kept between agent turns, re-read when their mtime or size changes
+PROJECT_MAP_GITIGNORE_CACHE_ENTRIES = int(os.getenv("PROJECT_MAP_GITIGNORE_CACHE_ENTRIES", "256"))
+
+# Conversation history limits: total estimated tokens, newest tokens kept verbatim,
+# characters kept of old tool inputs/outputs and size of the rolling summary
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "60000"))
+HISTORY_KEEP_RECENT_TOKENS = int(os.getenv("HISTORY_KEEP_RECENT_TOKENS", "20000"))
+HISTORY_TOOL_OUTPUT_CHARS = int(os.getenv("HISTORY_TOOL_OUTPUT_CHARS", "2000"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "2000"))
+
+# How older turns are summarised: extractive (no API call) or model
+HISTORY_SUMMARIZER = os.getenv("HISTORY_SUMMARIZER", "extractive").lower()
+
+# Mark tools, system prompt and project snapshot as cacheable prompt prefix
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "true").lower() in ("1", "true", "yes")
 
-tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
+# Maximum number of independent tool calls from one response executed at the same time
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "8"))
+
+# How hard file operations push data to disk: none, fsync-file, fsync-file+dir or global (os.sync, host wide)
+DURABILITY_MODE = os.getenv("DURABILITY_MODE", "fsync-file").lower()
+if DURABILITY_MODE not in ("none", "fsync-file", "fsync-file+dir", "global"):
+    raise ValueError(f"Invalid DURABILITY_MODE '{DURABILITY_MODE}', expected none, fsync-file, fsync-file+dir or global")
+
+# Sessions: how many are kept in memory, seconds before an idle one is dropped,
+# estimated tokens held across all of them and automode messages kept per session
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "100"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "3600"))
+SESSION_MAX_TOTAL_TOKENS = int(os.getenv("SESSION_MAX_TOTAL_TOKENS", "2000000"))
+SESSION_MAX_AUTOMODE_MESSAGES = int(os.getenv("SESSION_MAX_AUTOMODE_MESSAGES", "200"))
+
+# shared: every session works in the projects directory, isolated: each session (also "default",
+# used without a session ID) gets projects/sessions/<id>
+SESSION_PROJECT_ROOTS = os.getenv("SESSION_PROJECT_ROOTS", "shared").lower()
+if SESSION_PROJECT_ROOTS not in ("shared", "isolated"):
+    raise ValueError(f"Invalid SESSION_PROJECT_ROOTS '{SESSION_PROJECT_ROOTS}', expected shared or isolated")
+
+# Where sessions, project state and automode jobs are kept: sqlite (shared by all
+# uvicorn workers on this host) or memory (single process, lost on restart)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_DB_PATH = os.path.abspath(os.getenv("STATE_DB_PATH", "state.db"))
+# Seconds between checks for changes made by other worker processes
+STATE_POLL_INTERVAL = float(os.getenv("STATE_POLL_INTERVAL", "0.5"))
 
-# Initialize Tavily client if needed
-if SEARCH_PROVIDER == "TAVILY":
-    from tavily import TavilyClient
-    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
 
 
 anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
+# Connection pool for the shared async client used by chat, automode and image analysis
+ANTHROPIC_MAX_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "100"))
+ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", "20"))
+ANTHROPIC_KEEPALIVE_EXPIRY = float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY", "30"))
+
+async_anthropic_client = AsyncAnthropic(
+    api_key=os.getenv("ANTHROPIC_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=ANTHROPIC_MAX_CONNECTIONS,
+            max_keepalive_connections=ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=ANTHROPIC_KEEPALIVE_EXPIRY
+        )
+    )
+)
+
+# Images sent to the model are downscaled to fit IMAGE_MAX_DIMENSION (long edge) and
+# IMAGE_MAX_PIXELS, the largest the model uses without resizing; smaller uploads up to
+# IMAGE_MAX_BYTES are sent unchanged. IMAGE_WORKERS threads do the decoding and encoding.
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1568"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "1150000"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(3 * 1024 * 1024)))
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Seconds an image analysis is reused for an identical upload (0 disables) and how many are kept in memory
+IMAGE_ANALYSIS_CACHE_TTL = float(os.getenv("IMAGE_ANALYSIS_CACHE_TTL", "86400"))
+IMAGE_ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_ANALYSIS_CACHE_MAX_ENTRIES", "256"))
+
+# Uploads: largest accepted file, size of the chunks written to disk and how much of a
+# text file is returned as preview
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_PREVIEW_BYTES = int(os.getenv("UPLOAD_PREVIEW_BYTES", str(64 * 1024)))
+
+# Project downloads: default zip compression level (0 stores, 9 is smallest) and read size per file chunk
+DOWNLOAD_COMPRESSION_LEVEL = int(os.getenv("DOWNLOAD_COMPRESSION_LEVEL", "6"))
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("DOWNLOAD_CHUNK_BYTES", str(256 * 1024)))
+
+# Folder listings: most entries a single (recursive) listing collects before it is cut short
+LIST_FILES_MAX_ENTRIES = int(os.getenv("LIST_FILES_MAX_ENTRIES", "10000"))
+
+# File reads: most bytes one read returns (larger files are read in ranges), size from which
+# files are memory-mapped, chunk size of raw downloads and how many line indexes are cached
+READ_FILE_MAX_BYTES = int(os.getenv("READ_FILE_MAX_BYTES", str(256 * 1024)))
+READ_FILE_MMAP_THRESHOLD = int(os.getenv("READ_FILE_MMAP_THRESHOLD", str(1024 * 1024)))
+READ_FILE_CHUNK_BYTES = int(os.getenv("READ_FILE_CHUNK_BYTES", str(256 * 1024)))
+READ_FILE_LINE_INDEX_ENTRIES = int(os.getenv("READ_FILE_LINE_INDEX_ENTRIES", "64"))
+
+# Connection pool shared by the search providers, kept alive between searches
+SEARCH_MAX_CONNECTIONS = int(os.getenv("SEARCH_MAX_CONNECTIONS", "20"))
+
+search_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=SEARCH_MAX_CONNECTIONS,
+        max_keepalive_connections=SEARCH_MAX_CONNECTIONS,
+        keepalive_expiry=ANTHROPIC_KEEPALIVE_EXPIRY
+    ),
+    headers={"User-Agent": "ClaudePlus/1.0"}
+)
+
 PROJECTS_DIR = os.path.abspath("projects")
 if not os.path.exists(PROJECTS_DIR):
     os.makedirs(PROJECTS_DIR)
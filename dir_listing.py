@@ -0,0 +1,101 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import logging
+from fnmatch import fnmatchcase
+from typing import List, NamedTuple, Optional, Tuple
+from config import LIST_FILES_MAX_ENTRIES
+from project_index import UNTRACKED_NAMES
+
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = ("name", "size", "modified", "type")
+
+
+class ListingEntry(NamedTuple):
+    path: str                # relative to the listed folder, '/' separators
+    is_dir: bool
+    size: Optional[int]      # None for folders
+    mtime: float
+
+    @property
+    def name(self) -> str:
+        return self.path.rpartition("/")[2]
+
+
+def scan_listing(folder: str, recursive: bool = False, max_depth: Optional[int] = None,
+                 pattern: Optional[str] = None, kind: Optional[str] = None,
+                 max_entries: int = LIST_FILES_MAX_ENTRIES) -> Tuple[List[ListingEntry], bool]:
+    """
+    Entries of folder from one os.scandir per folder. DirEntry answers is_dir()
+    from the directory read itself and caches its stat(), so each entry costs
+    at most one stat call. pattern is a case-insensitive glob on the name and
+    kind is "file" or "dir". Recursive listings go max_depth folders deep
+    (unlimited when None) and do not follow symlinked folders. Returns the
+    entries and whether max_entries cut the listing short.
+    """
+    entries: List[ListingEntry] = []
+    pattern = pattern.lower() if pattern else None
+    stack = [("", folder, 0)]
+    while stack:
+        prefix, full, depth = stack.pop()
+        try:
+            iterator = os.scandir(full)
+        except OSError as e:
+            if not prefix:
+                raise
+            logger.debug(f"Could not list {full}: {str(e)}")
+            continue
+        with iterator:
+            for item in iterator:
+                if item.name in UNTRACKED_NAMES:
+                    continue
+                try:
+                    is_dir = item.is_dir()
+                    st = item.stat()
+                except OSError:
+                    # Broken symlink: describe the link itself
+                    try:
+                        is_dir, st = False, item.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                path = prefix + item.name
+                if (kind is None or kind == ("dir" if is_dir else "file")) and \
+                        (pattern is None or fnmatchcase(item.name.lower(), pattern)):
+                    if len(entries) >= max_entries:
+                        return entries, True
+                    entries.append(ListingEntry(path, is_dir, None if is_dir else st.st_size, st.st_mtime))
+                if recursive and is_dir and not item.is_symlink() and (max_depth is None or depth + 1 < max_depth):
+                    stack.append((path + "/", item.path, depth + 1))
+    return entries, False
+
+
+def sort_listing(entries: List[ListingEntry], sort: str = "name", descending: bool = False,
+                 dirs_first: bool = True) -> List[ListingEntry]:
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Invalid sort field '{sort}', expected one of {', '.join(SORT_FIELDS)}")
+    if sort == "name":
+        key = lambda e: (e.path.lower(), e.path)
+    elif sort == "size":
+        key = lambda e: (e.size or 0, e.path.lower())
+    elif sort == "modified":
+        key = lambda e: (e.mtime, e.path.lower())
+    else:
+        key = lambda e: (os.path.splitext(e.name)[1].lower(), e.path.lower())
+    result = sorted(entries, key=key, reverse=descending)
+    if dirs_first:
+        # sorted() is stable, so the order within folders and files is kept
+        result.sort(key=lambda e: not e.is_dir)
+    return result
@@ -0,0 +1,170 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import re
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchConflict(Exception):
+    """
+    An edit does not match the current content of the file. Nothing is written.
+    """
+
+
+class Hunk(NamedTuple):
+    old_start: int          # 1-based line in the original file, from the hunk header
+    lines: List[str]        # diff lines without their ' ', '-' or '+' prefix kept in ops
+    ops: str                # one of ' ', '-', '+' per line
+
+
+class ChangedRange(NamedTuple):
+    start_line: int         # 1-based line of the change in the new content
+    removed: int
+    added: int
+
+    def __str__(self):
+        return f"line {self.start_line}: -{self.removed} +{self.added}"
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """
+    Hunks of a unified diff for a single file. File headers (---, +++, diff,
+    index) are skipped. Raises ValueError when there are no hunks.
+    """
+    hunks: List[Hunk] = []
+    for line in diff.splitlines():
+        match = _HUNK_HEADER.match(line)
+        if match:
+            hunks.append(Hunk(int(match.group(1)), [], ""))
+            continue
+        if not hunks or line.startswith("\\"):
+            # Headers before the first hunk, "\ No newline at end of file"
+            continue
+        prefix = line[:1]
+        if prefix not in ("-", "+", " "):
+            # Context line whose leading space was stripped by an editor
+            prefix, line = " ", " " + line
+        hunks[-1].lines.append(line[1:])
+        hunks[-1] = hunks[-1]._replace(ops=hunks[-1].ops + prefix)
+    if not hunks:
+        raise ValueError("The patch has no hunks (@@ -a,b +c,d @@ headers)")
+    return hunks
+
+
+def _newline(text: str) -> str:
+    return "\r\n" if "\r\n" in text else "\n"
+
+
+def _find_block(lines: List[str], block: List[str], expected: int, start: int) -> Optional[int]:
+    """
+    Position at or after start where block matches lines (ignoring line
+    endings), nearest to expected. None when it does not match anywhere.
+    """
+    if not block:
+        return min(max(expected, start), len(lines))
+    stripped = [line.rstrip("\r\n") for line in block]
+    best = None
+    for position in range(start, len(lines) - len(block) + 1):
+        if all(lines[position + i].rstrip("\r\n") == stripped[i] for i in range(len(block))):
+            if best is None or abs(position - expected) < abs(best - expected):
+                best = position
+            elif position > expected:
+                break
+    return best
+
+
+def apply_unified_diff(text: str, diff: str) -> Tuple[str, List[ChangedRange]]:
+    """
+    Apply the hunks of diff to text in order. Each hunk is placed where its
+    context and removed lines match, nearest to the line in its header, so
+    patches made against a slightly shifted file still apply. Raises
+    PatchConflict when a hunk matches nowhere.
+    """
+    newline = _newline(text)
+    lines = text.splitlines(keepends=True)
+    result: List[str] = []
+    changes: List[ChangedRange] = []
+    position = 0
+    drift = 0
+    for number, hunk in enumerate(parse_unified_diff(diff), 1):
+        old_block = [line for line, op in zip(hunk.lines, hunk.ops) if op != "+"]
+        # A pure insertion's header names the line it goes after
+        old_start = hunk.old_start if not old_block else max(hunk.old_start - 1, 0)
+        expected = old_start + drift
+        found = _find_block(lines, old_block, expected, position)
+        if found is None:
+            preview = "\n".join(old_block[:3])
+            raise PatchConflict(f"Hunk {number} (at line {hunk.old_start}) does not match the file:\n{preview}")
+        result.extend(lines[position:found])
+        drift = found - old_start
+        new_start = len(result) + 1
+        removed = added = 0
+        index = found
+        for line, op in zip(hunk.lines, hunk.ops):
+            if result and not result[-1].endswith("\n"):
+                # The old last line gets lines after it
+                result[-1] += newline
+            if op == " ":
+                result.append(lines[index])
+                index += 1
+            elif op == "-":
+                index += 1
+                removed += 1
+            else:
+                result.append(line + newline)
+                added += 1
+        position = index
+        changes.append(ChangedRange(new_start, removed, added))
+    result.extend(lines[position:])
+    if result and text and not text.endswith("\n"):
+        # Keep a missing newline at the end of the file missing
+        result[-1] = result[-1].rstrip("\r\n")
+    return "".join(result), changes
+
+
+def apply_replacements(text: str, edits: List[dict]) -> Tuple[str, List[ChangedRange]]:
+    """
+    Apply search/replace edits ({"old": ..., "new": ..., "replace_all": bool})
+    one after another. old has to occur exactly once unless replace_all is
+    set. Raises PatchConflict when it is missing or ambiguous.
+    """
+    newline = _newline(text)
+    changes: List[ChangedRange] = []
+    for number, edit in enumerate(edits, 1):
+        old, new = edit.get("old", ""), edit.get("new", "")
+        if not old:
+            raise ValueError(f"Edit {number} has no 'old' text")
+        if newline == "\r\n":
+            old = old.replace("\r\n", "\n").replace("\n", "\r\n")
+            new = new.replace("\r\n", "\n").replace("\n", "\r\n")
+        count = text.count(old)
+        if count == 0:
+            raise PatchConflict(f"Edit {number}: the text to replace was not found:\n{old[:200]}")
+        if count > 1 and not edit.get("replace_all"):
+            raise PatchConflict(f"Edit {number}: the text to replace occurs {count} times, "
+                                f"include more surrounding lines or set replace_all")
+        old_lines, new_lines = old.count("\n") + 1, new.count("\n") + 1 if new else 0
+        start = 0
+        while (found := text.find(old, start)) != -1:
+            changes.append(ChangedRange(text.count("\n", 0, found) + 1, old_lines, new_lines))
+            text = text[:found] + new + text[found + len(old):]
+            start = found + len(new)
+            if not edit.get("replace_all"):
+                break
+    return text, changes
@@ -0,0 +1,153 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import mmap
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Iterator, NamedTuple, Optional, Tuple
+from config import READ_FILE_MAX_BYTES, READ_FILE_MMAP_THRESHOLD, READ_FILE_CHUNK_BYTES, READ_FILE_LINE_INDEX_ENTRIES
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FileSlice(NamedTuple):
+    data: bytes
+    start: int                  # byte offset of data in the file
+    end: int                    # byte offset just after data
+    size: int                   # size of the whole file
+    start_line: Optional[int]   # 1-based lines covered by data, set for line reads
+    end_line: Optional[int]
+    total_lines: Optional[int]
+    truncated: bool             # less than requested was returned because of max_bytes
+
+    @property
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+# path -> ((mtime_ns, size), offsets of line starts), least recently used first
+_line_indexes: "OrderedDict[str, Tuple[Tuple[int, int], array]]" = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+def _read_bytes(path: str, start: int, end: int, size: int) -> bytes:
+    if end <= start:
+        return b""
+    with open(path, "rb") as f:
+        if size < READ_FILE_MMAP_THRESHOLD:
+            f.seek(start)
+            return f.read(end - start)
+        # Large files are mapped so only the pages of the range are read in
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end]
+
+
+def _build_line_index(path: str, size: int) -> array:
+    offsets = array("Q", [0] if size else [])
+    if not size:
+        return offsets
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = mm.find(b"\n")
+        while position != -1 and position + 1 < size:
+            offsets.append(position + 1)
+            position = mm.find(b"\n", position + 1)
+    return offsets
+
+
+def line_index(path: str, st: Optional[os.stat_result] = None) -> array:
+    """
+    Byte offsets at which the lines of path start. Built once per version of
+    the file (mtime and size) and cached, so seeking to a line is a lookup.
+    """
+    st = st or os.stat(path)
+    version = (st.st_mtime_ns, st.st_size)
+    with _line_indexes_lock:
+        cached = _line_indexes.get(path)
+        if cached is not None and cached[0] == version:
+            _line_indexes.move_to_end(path)
+            metrics.increment("line_index_hits")
+            return cached[1]
+    offsets = _build_line_index(path, st.st_size)
+    metrics.increment("line_index_builds")
+    with _line_indexes_lock:
+        _line_indexes[path] = (version, offsets)
+        _line_indexes.move_to_end(path)
+        while len(_line_indexes) > READ_FILE_LINE_INDEX_ENTRIES:
+            _line_indexes.popitem(last=False)
+    return offsets
+
+
+def read_slice(path: str, offset: int = 0, limit: Optional[int] = None, start_line: Optional[int] = None,
+               end_line: Optional[int] = None, max_bytes: int = READ_FILE_MAX_BYTES) -> FileSlice:
+    """
+    Part of a file, either limit bytes from offset or the 1-based inclusive
+    line range start_line..end_line (to the end of the file when end_line is
+    None). At most max_bytes are returned; line reads are cut at the last
+    complete line that fits, unless not even one line fits.
+    """
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative")
+    st = os.stat(path)
+    size = st.st_size
+
+    if start_line is None and end_line is None:
+        start = min(offset, size)
+        wanted_end = size if limit is None else min(size, start + limit)
+        end = min(wanted_end, start + max_bytes)
+        return FileSlice(_read_bytes(path, start, end, size), start, end, size, None, None, None, end < wanted_end)
+
+    start_line = start_line or 1
+    if start_line < 1 or (end_line is not None and end_line < start_line):
+        raise ValueError("start_line must be at least 1 and not after end_line")
+    offsets = line_index(path, st)
+    total_lines = len(offsets)
+    if start_line > total_lines:
+        return FileSlice(b"", size, size, size, start_line, start_line - 1, total_lines, False)
+    last_line = total_lines if end_line is None else min(end_line, total_lines)
+    start = offsets[start_line - 1]
+    wanted_end = offsets[last_line] if last_line < total_lines else size
+    end = wanted_end
+    if end - start > max_bytes:
+        # Lines starting at or before start + max_bytes; the last of them is cut off
+        fitting = bisect_right(offsets, start + max_bytes) - 1
+        if fitting >= start_line:
+            last_line, end = fitting, offsets[fitting]
+        else:
+            # Only the start of start_line fits
+            last_line, end = start_line, start + max_bytes
+    return FileSlice(_read_bytes(path, start, end, size), start, end, size, start_line, last_line, total_lines,
+                     end < wanted_end)
+
+
+def iter_file(path: str, offset: int = 0, limit: Optional[int] = None,
+              chunk_size: int = READ_FILE_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    The bytes of a file from offset, limit bytes long (to the end when None),
+    in chunks of chunk_size.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
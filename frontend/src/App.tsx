@@ -19,7 +19,8 @@ import theme from './theme';
 import './App.css';
 import FileListing from './FileListing'; 
 import Console from './components/Console';
-import { FileItem } from './types';
+import { FileItem, SearchResult } from './types';
+import { sessionId } from './session';
 
 //const API_URL = '/api';
 const API_URL = 'http://127.0.0.1:8000';
@@ -147,7 +148,7 @@ function App() {
             setMessages(prev => [...prev, { role: 'user', content: input }]);
             setInput('');
             console.log("Starting automode");
-            const eventSource = new EventSource(`${API_URL}/automode?message=${encodeURIComponent(input)}`);
+            const eventSource = new EventSource(`${API_URL}/automode?message=${encodeURIComponent(input)}&session_id=${encodeURIComponent(sessionId)}`);
             eventSource.onmessage = (event) => {
                 console.log("Received SSE event:", event);
                 const data = JSON.parse(event.data);
@@ -195,9 +196,13 @@ function App() {
       setMessages((prev) => [...prev, { role: 'user', content: `Searching for: ${searchQuery}`, isHtml: false }]);
       try {
         const response = await axios.post(`${API_URL}/search`, { query: searchQuery });
+        const results: SearchResult[] = response.data.results;
+        const content = results.length
+          ? results.map((result) => `**[${result.title}](${result.url})**\n\n${result.snippet}`).join('\n\n---\n\n')
+          : 'No results found.';
         setMessages((prev) => [
           ...prev,
-          { role: 'assistant', content: response.data.results, isHtml: true }
+          { role: 'assistant', content }
         ]);
       } catch (error) {
         console.error('Error performing search:', error);
@@ -280,6 +285,11 @@ function App() {
         ? `/${fileName}` 
         : `${currentDirectory}/${fileName}`;
       const response = await axios.get(`${API_URL}/read_file`, { params: { path: filePath } });
+      if (response.data.truncated) {
+        // Saving a partial read would cut the file short, so large files open as raw downloads
+        window.open(`${API_URL}/read_file?raw=true&path=${encodeURIComponent(filePath)}&session_id=${encodeURIComponent(sessionId)}`, '_blank');
+        return;
+      }
       setSelectedFile(fileName);
       setFileContent(response.data.content);
       setOriginalContent(response.data.content);
@@ -0,0 +1,22 @@
+import axios from 'axios';
+
+// One backend session per browser tab: chat history, console directory and automode
+// runs are kept per session, so tabs no longer overwrite each other.
+const STORAGE_KEY = 'claude-plus-session-id';
+
+const createSessionId = (): string =>
+  typeof crypto !== 'undefined' && 'randomUUID' in crypto
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+
+export const sessionId: string = (() => {
+  const existing = sessionStorage.getItem(STORAGE_KEY);
+  if (existing) {
+    return existing;
+  }
+  const id = createSessionId();
+  sessionStorage.setItem(STORAGE_KEY, id);
+  return id;
+})();
+
+axios.defaults.headers.common['X-Session-ID'] = sessionId;
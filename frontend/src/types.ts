@@ -4,3 +4,11 @@ export interface FileItem {
   size?: string | number;
   modifiedDate?: string;
 }
+
+export interface SearchResult {
+  title: string;
+  url: string;
+  snippet: string;
+  score?: number | null;
+  provider: string;
+}
@@ -0,0 +1,314 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from collections import deque
+from typing import NamedTuple, List, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FileChange(NamedTuple):
+    action: str  # "created" or "deleted"
+    path: str    # path relative to the watched root, using '/' separators
+    is_dir: bool
+
+
+def scan_tree(root: str) -> Tuple[set, set]:
+    """
+    Walk the whole tree under root and return (folders, files) as relative paths.
+    """
+    folders, files = set(), set()
+    for current, dirs, filenames in os.walk(root):
+        for dir_name in dirs:
+            folders.add(os.path.relpath(os.path.join(current, dir_name), root).replace(os.sep, '/'))
+        for file_name in filenames:
+            files.add(os.path.relpath(os.path.join(current, file_name), root).replace(os.sep, '/'))
+    return folders, files
+
+
+class BaseWatcher:
+    """
+    Collects filesystem deltas on a background thread. The event loop drains them
+    with drain(), which also reports whether a full rescan is required.
+    """
+
+    name = "base"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self._changes = deque()
+        self._rescan = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Started {self.name} watcher on {self.root}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        logger.info(f"Stopped {self.name} watcher on {self.root}")
+
+    def drain(self) -> Tuple[List[FileChange], bool]:
+        changes = []
+        while True:
+            try:
+                changes.append(self._changes.popleft())
+            except IndexError:
+                break
+        rescan = self._rescan.is_set()
+        if rescan:
+            self._rescan.clear()
+        return changes, rescan
+
+    def request_rescan(self):
+        self._rescan.set()
+
+    def _emit(self, action: str, path: str, is_dir: bool):
+        self._changes.append(FileChange(action, path, is_dir))
+
+    def _rel(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class PollingWatcher(BaseWatcher):
+    """
+    Portable fallback: rescans the tree every interval on its own thread and emits
+    the difference, so request handlers never walk the tree themselves.
+    """
+
+    name = "polling"
+
+    def __init__(self, root: str, interval: float = 2.0):
+        super().__init__(root)
+        self.interval = interval
+        self._snapshot = scan_tree(self.root)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                folders, files = scan_tree(self.root)
+            except Exception as e:
+                logger.warning(f"Polling watcher scan failed: {str(e)}")
+                self.request_rescan()
+                continue
+            old_folders, old_files = self._snapshot
+            for path in folders - old_folders:
+                self._emit("created", path, True)
+            for path in files - old_files:
+                self._emit("created", path, False)
+            for path in old_files - files:
+                self._emit("deleted", path, False)
+            for path in old_folders - folders:
+                self._emit("deleted", path, True)
+            self._snapshot = (folders, files)
+
+
+# inotify constants from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    libc_name = ctypes.util.find_library("c") or "libc.so.6"
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        libc.inotify_init1  # noqa: B018 - raises AttributeError when unsupported
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class InotifyWatcher(BaseWatcher):
+    """
+    Linux watcher using one inotify watch per directory. New directories are
+    watched and scanned as they appear; a queue overflow or exhausted watch
+    limit asks the consumer for a full rescan.
+    """
+
+    name = "inotify"
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this platform")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wd_to_path = {}
+        self._path_to_wd = {}
+        self.degraded = False
+        if self._add_watch(self.root) is None:
+            os.close(self._fd)
+            raise OSError(f"Unable to watch {self.root}")
+        self._watch_tree(self.root, emit=False)
+
+    def stop(self):
+        super().stop()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def drain(self) -> Tuple[List[FileChange], bool]:
+        changes, rescan = super().drain()
+        # Once the watch limit has been hit some directories are invisible to us,
+        # so every sync has to fall back to a rescan.
+        return changes, rescan or self.degraded
+
+    def _add_watch(self, path: str) -> Optional[int]:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                if not self.degraded:
+                    logger.warning("inotify watch limit reached; project state will fall back to full rescans")
+                self.degraded = True
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                logger.warning(f"inotify_add_watch failed for {path}: {os.strerror(err)}")
+            return None
+        rel = "" if path == self.root else self._rel(path)
+        self._wd_to_path[wd] = rel
+        self._path_to_wd[rel] = wd
+        return wd
+
+    def _watch_tree(self, path: str, emit: bool):
+        """
+        Watch every directory below path. When emit is set, report the existing
+        contents as created, since they may have appeared before the watch did.
+        """
+        for current, dirs, files in os.walk(path):
+            for dir_name in dirs:
+                full = os.path.join(current, dir_name)
+                self._add_watch(full)
+                if emit:
+                    self._emit("created", self._rel(full), True)
+            if emit:
+                for file_name in files:
+                    self._emit("created", self._rel(os.path.join(current, file_name)), False)
+
+    def _unwatch_tree(self, rel: str):
+        prefix = rel + "/"
+        for path in [p for p in self._path_to_wd if p == rel or p.startswith(prefix)]:
+            wd = self._path_to_wd.pop(path)
+            self._wd_to_path.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                readable, _, _ = select.select([self._fd], [], [], 0.5)
+            except (OSError, ValueError):
+                break
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logger.error(f"inotify read failed: {str(e)}")
+                self.request_rescan()
+                break
+            self._handle_events(data)
+
+    def _handle_events(self, data: bytes):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflow; requesting full project state rescan")
+                self._watch_tree(self.root, emit=False)
+                self.request_rescan()
+                continue
+            if mask & IN_IGNORED:
+                path = self._wd_to_path.pop(wd, None)
+                if path is not None and self._path_to_wd.get(path) == wd:
+                    del self._path_to_wd[path]
+                continue
+
+            parent = self._wd_to_path.get(wd)
+            if parent is None or not name:
+                continue
+            rel = f"{parent}/{name}" if parent else name
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._emit("created", rel, is_dir)
+                if is_dir:
+                    full = os.path.join(self.root, rel)
+                    self._add_watch(full)
+                    self._watch_tree(full, emit=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                if is_dir:
+                    self._unwatch_tree(rel)
+                self._emit("deleted", rel, is_dir)
+
+
+def create_watcher(root: str, mode: str = "auto", poll_interval: float = 2.0) -> Optional[BaseWatcher]:
+    """
+    Build a watcher for root. mode is one of "auto", "inotify", "poll" or "off";
+    "auto" prefers inotify and falls back to polling.
+    """
+    if mode == "off":
+        return None
+    if mode in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(root)
+        except OSError as e:
+            if mode == "inotify":
+                logger.error(f"inotify watcher unavailable: {str(e)}")
+                return None
+            logger.info(f"inotify watcher unavailable ({str(e)}), using polling watcher")
+    return PollingWatcher(root, interval=poll_interval)
@@ -0,0 +1,238 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import logging
+from typing import List, Optional
+from config import (
+    CLAUDE_MODEL, HISTORY_MAX_TOKENS, HISTORY_KEEP_RECENT_TOKENS, HISTORY_TOOL_OUTPUT_CHARS,
+    HISTORY_SUMMARY_MAX_TOKENS, HISTORY_SUMMARIZER, async_anthropic_client
+)
+from project_map import estimate_tokens
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "[Summary of the earlier part of this conversation]"
+
+
+def message_tokens(message: dict) -> int:
+    content = message["content"]
+    if isinstance(content, str):
+        return estimate_tokens(content) + 4
+    return estimate_tokens(json.dumps(content, default=str)) + 4
+
+
+def is_turn_start(message: dict) -> bool:
+    """
+    A new turn starts with a user message that is not just tool results.
+    """
+    if message["role"] != "user":
+        return False
+    content = message["content"]
+    if isinstance(content, str):
+        return True
+    return not any(block.get("type") == "tool_result" for block in content)
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}\n... [truncated {len(text) - limit} characters]"
+
+
+def _message_text(message: dict) -> str:
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def _tool_calls(message: dict) -> List[str]:
+    content = message["content"]
+    if isinstance(content, str):
+        return []
+    calls = []
+    for block in content:
+        if block.get("type") == "tool_use":
+            tool_input = block.get("input") or {}
+            target = tool_input.get("path") or tool_input.get("query") or ""
+            calls.append(f"{block.get('name')}({target})")
+    return calls
+
+
+async def extractive_summary(previous: str, dropped: List[dict]) -> str:
+    """
+    Summarise dropped turns without a model call: the start of each user
+    request and assistant reply, plus the tools that were used.
+    """
+    lines = [previous] if previous else []
+    for message in dropped:
+        text = " ".join(_message_text(message).split())
+        if message["role"] == "user" and is_turn_start(message) and text:
+            lines.append(f"- User: {_truncate(text, 300)}")
+        elif message["role"] == "assistant":
+            if text:
+                lines.append(f"  Assistant: {_truncate(text, 300)}")
+            calls = _tool_calls(message)
+            if calls:
+                lines.append(f"  Tools used: {', '.join(calls)}")
+    return "\n".join(lines)
+
+
+async def model_summary(previous: str, dropped: List[dict]) -> str:
+    """
+    Ask the model to fold the dropped turns into the running summary.
+    """
+    transcript = await extractive_summary("", dropped)
+    response = await async_anthropic_client.messages.create(
+        model=CLAUDE_MODEL,
+        max_tokens=min(HISTORY_SUMMARY_MAX_TOKENS, 1024),
+        system="You maintain a concise running summary of a software development chat. "
+               "Keep decisions, file paths, open tasks and errors. Reply with the updated summary only.",
+        messages=[{
+            "role": "user",
+            "content": f"Current summary:\n{previous or '(none)'}\n\nNew turns to fold in:\n{transcript}"
+        }]
+    )
+    return "".join(block.text for block in response.content if block.type == 'text')
+
+
+SUMMARIZERS = {"extractive": extractive_summary, "model": model_summary}
+
+
+class ConversationHistory(list):
+    """
+    Message list that keeps its token footprint bounded. Older turns get their
+    tool inputs and outputs truncated, and once the history exceeds max_tokens
+    the oldest turns are folded into a rolling summary kept as the first
+    message. The newest keep_recent_tokens worth of turns are never modified.
+    """
+
+    def __init__(
+        self,
+        messages=(),
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        keep_recent_tokens: int = HISTORY_KEEP_RECENT_TOKENS,
+        tool_output_chars: int = HISTORY_TOOL_OUTPUT_CHARS,
+        summarizer: Optional[str] = None
+    ):
+        super().__init__(messages)
+        self.max_tokens = max_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.tool_output_chars = tool_output_chars
+        self.summarize = SUMMARIZERS.get(summarizer or HISTORY_SUMMARIZER, extractive_summary)
+        self.summary = ""
+        self.compactions = 0
+        self._token_cache = {}
+
+    def clear(self):
+        super().clear()
+        self.summary = ""
+        self._token_cache.clear()
+
+    def tokens_of(self, message: dict) -> int:
+        cached = self._token_cache.get(id(message))
+        if cached is not None and cached[0] is message:
+            return cached[1]
+        tokens = message_tokens(message)
+        self._token_cache[id(message)] = (message, tokens)
+        return tokens
+
+    def token_footprint(self) -> int:
+        return sum(self.tokens_of(message) for message in self)
+
+    def stats(self) -> dict:
+        return {
+            "messages": len(self),
+            "tokens": self.token_footprint(),
+            "summary_tokens": estimate_tokens(self.summary),
+            "compactions": self.compactions
+        }
+
+    def _recent_start(self) -> int:
+        """
+        Index of the first message of the verbatim window: whole turns from the
+        end while they fit keep_recent_tokens, and always the current turn.
+        """
+        used = 0
+        start = len(self)
+        for index in range(len(self) - 1, -1, -1):
+            used += self.tokens_of(self[index])
+            if is_turn_start(self[index]):
+                if used > self.keep_recent_tokens and start < len(self):
+                    break
+                start = index
+        return start
+
+    def _shrink(self, message: dict) -> dict:
+        content = message["content"]
+        if isinstance(content, str):
+            return message
+        limit = self.tool_output_chars
+        changed = False
+        blocks = []
+        for block in content:
+            if block.get("type") == "tool_result" and isinstance(block.get("content"), str) and len(block["content"]) > limit:
+                block = {**block, "content": _truncate(block["content"], limit)}
+                changed = True
+            elif block.get("type") == "tool_use":
+                tool_input = block.get("input") or {}
+                if any(isinstance(v, str) and len(v) > limit for v in tool_input.values()):
+                    tool_input = {k: _truncate(v, limit) if isinstance(v, str) else v for k, v in tool_input.items()}
+                    block = {**block, "input": tool_input}
+                    changed = True
+            blocks.append(block)
+        return {**message, "content": blocks} if changed else message
+
+    async def compact(self) -> bool:
+        """
+        Bring the history under max_tokens. Returns True when anything changed.
+        """
+        if self.token_footprint() <= self.max_tokens:
+            return False
+
+        has_summary = bool(self.summary)
+        first = 1 if has_summary else 0
+        recent_start = self._recent_start()
+
+        # 1. Truncate large tool inputs and outputs outside the recent window
+        for index in range(first, recent_start):
+            self[index] = self._shrink(self[index])
+
+        # 2. Fold the oldest turns into the summary until under budget
+        target = self.max_tokens * 3 // 4
+        cut = first
+        remaining = self.token_footprint()
+        while remaining > target and cut < recent_start:
+            next_cut = cut + 1
+            while next_cut < recent_start and not is_turn_start(self[next_cut]):
+                next_cut += 1
+            remaining -= sum(self.tokens_of(message) for message in self[cut:next_cut])
+            cut = next_cut
+
+        if cut > first:
+            dropped = list(self[first:cut])
+            self.summary = await self.summarize(self.summary, dropped)
+            while estimate_tokens(self.summary) > HISTORY_SUMMARY_MAX_TOKENS and "\n" in self.summary:
+                self.summary = self.summary.split("\n", 1)[1]
+            del self[0:cut]
+            self.insert(0, {"role": "user", "content": f"{SUMMARY_HEADER}\n{self.summary}"})
+            logger.info(f"Folded {len(dropped)} messages into the conversation summary")
+
+        self._token_cache = {id(m): (m, t) for m, t in ((m, self.tokens_of(m)) for m in self)}
+        self.compactions += 1
+        metrics.increment("history_compactions")
+        logger.info(f"Conversation history compacted: {self.stats()}")
+        return True
@@ -0,0 +1,125 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+from PIL import Image, ImageOps
+from config import IMAGE_MAX_DIMENSION, IMAGE_MAX_PIXELS, IMAGE_MAX_BYTES, IMAGE_JPEG_QUALITY, IMAGE_WORKERS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Formats the API accepts, by Pillow format name
+MEDIA_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+# Decoding, resizing and encoding run here instead of on the event loop. Pillow
+# releases the GIL for most of that work, so threads are enough.
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    media_type: str
+    width: int
+    height: int
+    original_bytes: int
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def target_size(width: int, height: int, max_dimension: int = IMAGE_MAX_DIMENSION,
+                max_pixels: int = IMAGE_MAX_PIXELS) -> tuple:
+    """
+    Largest size with the same aspect ratio whose long edge and pixel count fit
+    the limits. Larger images are downscaled by the API anyway, so sending more
+    only costs bandwidth and latency.
+    """
+    scale = min(1.0, max_dimension / max(width, height), (max_pixels / (width * height)) ** 0.5)
+    # The epsilon keeps an exact fit (e.g. 3000 * 1568 / 3000) from rounding down
+    return max(1, int(width * scale + 1e-9)), max(1, int(height * scale + 1e-9))
+
+
+def _output_format(source_format: Optional[str], content_type: Optional[str], img: Image.Image) -> str:
+    declared = (content_type or "").lower()
+    if source_format == "WEBP" or declared == "image/webp":
+        return "WEBP"
+    # PNG keeps screenshots, diagrams and transparency sharp; GIF is converted to a still PNG
+    if source_format in ("PNG", "GIF") or declared in ("image/png", "image/gif") or img.mode in ("RGBA", "LA", "P"):
+        return "PNG"
+    return "JPEG"
+
+
+def prepare_image(data: bytes, content_type: Optional[str] = None) -> PreparedImage:
+    """
+    Make an upload ready to send to the model: downscale it to the model's
+    effective resolution and encode it as JPEG, PNG or WebP depending on the
+    source. Images that already fit are passed through without re-encoding.
+    Raises ValueError when data is not a readable image.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        width, height = img.size
+        source_format = img.format
+    except Exception as e:
+        raise ValueError(f"Unsupported image: {str(e)}") from e
+
+    size = target_size(width, height)
+    if size == (width, height) and source_format in MEDIA_TYPES and source_format != "GIF" and len(data) <= IMAGE_MAX_BYTES:
+        metrics.increment("images_passed_through")
+        return PreparedImage(data, MEDIA_TYPES[source_format], width, height, len(data))
+
+    if source_format == "JPEG":
+        # Lets the JPEG decoder skip detail that would be thrown away by the resize
+        img.draft("RGB", size)
+    img = ImageOps.exif_transpose(img)
+    size = target_size(*img.size)
+    output_format = _output_format(source_format, content_type, img)
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    if output_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif output_format != "JPEG" and img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGBA")
+
+    output = io.BytesIO()
+    if output_format == "JPEG":
+        img.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    elif output_format == "WEBP":
+        img.save(output, format="WEBP", quality=IMAGE_JPEG_QUALITY, method=4)
+    else:
+        img.save(output, format="PNG", optimize=False, compress_level=6)
+    metrics.increment("images_reencoded")
+    return PreparedImage(output.getvalue(), MEDIA_TYPES[output_format], img.width, img.height, len(data))
+
+
+async def prepare_image_async(data: bytes, content_type: Optional[str] = None) -> PreparedImage:
+    start = time.perf_counter()
+    prepared = await asyncio.get_running_loop().run_in_executor(_executor, prepare_image, data, content_type)
+    metrics.observe("image_prepare_seconds", time.perf_counter() - start)
+    logger.debug(
+        f"Prepared image {prepared.width}x{prepared.height} {prepared.media_type}: "
+        f"{prepared.original_bytes} -> {len(prepared.data)} bytes"
+    )
+    return prepared
+
+
+async def content_hash_async(data: bytes) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executor, content_hash, data)
@@ -0,0 +1,51 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+from collections import defaultdict
+
+# Simple in-process counters and timings, exposed through the /metrics endpoint
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def increment(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float):
+    """
+    Record one measurement (e.g. a latency in seconds) under name.
+    """
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            _timings[name] = {"count": 1, "total": value, "min": value, "max": value, "last": value}
+            return
+        timing["count"] += 1
+        timing["total"] += value
+        timing["min"] = min(timing["min"], value)
+        timing["max"] = max(timing["max"], value)
+        timing["last"] = value
+
+
+def snapshot() -> dict:
+    with _lock:
+        timings = {
+            name: {**timing, "avg": timing["total"] / timing["count"]}
+            for name, timing in _timings.items()
+        }
+        return {"counters": dict(_counters), "timings": timings}
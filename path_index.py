@@ -0,0 +1,234 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Iterable, Iterator, List, Optional, Tuple
+from project_index import Entry, DIR, FILE
+
+
+class _Node:
+    __slots__ = ("children", "kind", "size", "mtime", "hash", "files", "folders", "total_size")
+
+    def __init__(self, kind: str, size: Optional[int] = None, mtime: Optional[float] = None, hash: Optional[str] = None):
+        self.children = {} if kind == DIR else None
+        self.kind = kind
+        self.size = size
+        self.mtime = mtime
+        self.hash = hash
+        # Aggregates over everything below this node (not the node itself)
+        self.files = 0
+        self.folders = 0
+        self.total_size = 0
+
+    def weight(self) -> Tuple[int, int, int]:
+        """
+        (files, folders, bytes) of this node together with its subtree.
+        """
+        if self.kind == DIR:
+            return self.files, self.folders + 1, self.total_size
+        return 1, 0, self.size or 0
+
+
+def _split(path: str) -> List[str]:
+    return [part for part in path.split("/") if part] if path else []
+
+
+class PathIndex:
+    """
+    In-memory tree of the project: one node per path component, so lookups,
+    inserts, subtree deletes and moves cost O(depth) regardless of how many
+    paths are tracked. Every folder keeps file, folder and byte counts for its
+    subtree, updated along the path on each change. Paths are relative with
+    '/' separators; "" is the root.
+    """
+
+    def __init__(self, entries: Iterable[Entry] = ()):
+        self.root = _Node(DIR)
+        for entry in entries:
+            self.put(entry)
+
+    def __repr__(self):
+        return f"PathIndex({self.root.files} files, {self.root.folders} folders, {self.root.total_size} bytes)"
+
+    def __len__(self):
+        return self.root.files + self.root.folders
+
+    def __contains__(self, path: str) -> bool:
+        return bool(path) and self._find(path) is not None
+
+    def _find(self, path: str) -> Optional[_Node]:
+        node = self.root
+        for part in _split(path):
+            if node.children is None:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def _ancestors(self, parts: List[str]) -> List[_Node]:
+        """
+        Existing nodes from the root down to the parent of parts[-1].
+        """
+        nodes = [self.root]
+        for part in parts[:-1]:
+            child = nodes[-1].children.get(part) if nodes[-1].children is not None else None
+            if child is None:
+                break
+            nodes.append(child)
+        return nodes
+
+    @staticmethod
+    def _adjust(nodes: Iterable[_Node], weight: Tuple[int, int, int], sign: int):
+        files, folders, size = weight
+        for node in nodes:
+            node.files += sign * files
+            node.folders += sign * folders
+            node.total_size += sign * size
+
+    def _detach(self, parts: List[str]) -> Optional[_Node]:
+        ancestors = self._ancestors(parts)
+        if len(ancestors) != len(parts):
+            return None
+        node = ancestors[-1].children.pop(parts[-1], None)
+        if node is not None:
+            self._adjust(ancestors, node.weight(), -1)
+        return node
+
+    def _attach(self, parts: List[str], node: _Node):
+        """
+        Place node at parts, creating missing parent folders and replacing
+        whatever was there before.
+        """
+        ancestors = [self.root]
+        for part in parts[:-1]:
+            parent = ancestors[-1]
+            child = parent.children.get(part)
+            if child is None or child.kind != DIR:
+                if child is not None:
+                    self._detach_child(ancestors, part)
+                child = _Node(DIR)
+                parent.children[part] = child
+                self._adjust(ancestors, child.weight(), 1)
+            ancestors.append(child)
+        if parts[-1] in ancestors[-1].children:
+            self._detach_child(ancestors, parts[-1])
+        ancestors[-1].children[parts[-1]] = node
+        self._adjust(ancestors, node.weight(), 1)
+
+    def _detach_child(self, ancestors: List[_Node], name: str):
+        node = ancestors[-1].children.pop(name)
+        self._adjust(ancestors, node.weight(), -1)
+
+    def put(self, entry: Entry):
+        """
+        Add or update a path. Missing parent folders are created. Updating a
+        folder keeps its contents; changing a path's kind replaces its subtree.
+        """
+        parts = _split(entry.path)
+        if not parts:
+            return
+        existing = self._find(entry.path)
+        if existing is not None and existing.kind == entry.kind:
+            # Like the SQLite index, a put without a hash keeps the known one while the file is unchanged
+            unchanged = existing.size == entry.size and existing.mtime == entry.mtime
+            existing.hash = entry.hash if entry.hash is not None or not unchanged else existing.hash
+            if entry.kind == FILE:
+                ancestors = self._ancestors(parts)
+                self._adjust(ancestors, (0, 0, (entry.size or 0) - (existing.size or 0)), 1)
+                existing.size = entry.size
+            existing.mtime = entry.mtime
+            return
+        self._attach(parts, _Node(entry.kind, entry.size, entry.mtime, entry.hash))
+
+    def delete(self, path: str) -> bool:
+        """
+        Remove a path and everything below it. Returns False when it was not tracked.
+        """
+        parts = _split(path)
+        return bool(parts) and self._detach(parts) is not None
+
+    def move(self, source: str, destination: str) -> bool:
+        """
+        Move a path with its whole subtree, replacing anything at destination.
+        """
+        source_parts, destination_parts = _split(source), _split(destination)
+        if not source_parts or not destination_parts or destination_parts[:len(source_parts)] == source_parts:
+            return False
+        node = self._detach(source_parts)
+        if node is None:
+            return False
+        self._attach(destination_parts, node)
+        return True
+
+    def clear(self):
+        self.root = _Node(DIR)
+
+    def swap(self, other: "PathIndex"):
+        """
+        Take over the contents of other; used to replace the index in place.
+        """
+        self.root = other.root
+
+    @staticmethod
+    def _entry(path: str, node: _Node) -> Entry:
+        return Entry(path, node.kind, node.size, node.mtime, node.hash)
+
+    def get(self, path: str) -> Optional[Entry]:
+        node = self._find(path) if path else None
+        return None if node is None else self._entry(path, node)
+
+    def is_file(self, path: str) -> bool:
+        node = self._find(path) if path else None
+        return node is not None and node.kind == FILE
+
+    def is_dir(self, path: str) -> bool:
+        node = self._find(path)
+        return node is not None and node.kind == DIR
+
+    def children(self, path: str = "") -> List[Entry]:
+        node = self._find(path)
+        if node is None or node.children is None:
+            return []
+        prefix = f"{path}/" if path else ""
+        return [self._entry(prefix + name, child) for name, child in sorted(node.children.items())]
+
+    def walk(self, path: str = "") -> Iterator[Entry]:
+        """
+        Every entry below path in sorted depth-first order.
+        """
+        node = self._find(path)
+        if node is None or node.children is None:
+            return
+        stack = [(f"{path}/" if path else "", iter(sorted(node.children.items())))]
+        while stack:
+            prefix, items = stack[-1]
+            for name, child in items:
+                child_path = prefix + name
+                yield self._entry(child_path, child)
+                if child.children:
+                    stack.append((child_path + "/", iter(sorted(child.children.items()))))
+                    break
+            else:
+                stack.pop()
+
+    def stats(self, path: str = "") -> Optional[dict]:
+        """
+        File and folder counts and total file size below a folder, in O(depth).
+        """
+        node = self._find(path)
+        if node is None:
+            return None
+        if node.kind == FILE:
+            return {"files": 1, "folders": 0, "size": node.size or 0}
+        return {"files": node.files, "folders": node.folders, "size": node.total_size}
@@ -0,0 +1,282 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import sqlite3
+import logging
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from config import STATE_BACKEND, STATE_DB_PATH, DURABILITY_MODE
+
+logger = logging.getLogger(__name__)
+
+FILE = "file"
+DIR = "dir"
+
+
+class Entry(NamedTuple):
+    path: str                     # relative to PROJECTS_DIR with '/' separators
+    kind: str                     # FILE or DIR
+    size: Optional[int] = None
+    mtime: Optional[float] = None
+    hash: Optional[str] = None    # SHA-256, known for files written through the file tools
+
+    @property
+    def parent(self) -> str:
+        return self.path.rpartition("/")[0]
+
+    @property
+    def name(self) -> str:
+        return self.path.rpartition("/")[2]
+
+
+# ("put", Entry) or ("delete", path); a delete removes the path and everything below it
+Operation = Tuple[str, object]
+
+# Folders the application keeps for itself, not project files: the content-addressed
+# upload storage (uploads.BLOBS_DIR_NAME)
+UNTRACKED_NAMES = {".blobs"}
+
+
+def is_tracked(path: str) -> bool:
+    return not any(part in UNTRACKED_NAMES for part in path.split("/"))
+
+
+def entry_from_stat(path: str, st: os.stat_result, is_dir: bool, hash: Optional[str] = None) -> Entry:
+    if is_dir:
+        return Entry(path, DIR, None, st.st_mtime)
+    return Entry(path, FILE, st.st_size, st.st_mtime, hash)
+
+
+def scan_entries(root: str) -> List[Entry]:
+    """
+    Walk the tree under root like fs_watcher.scan_tree (symlinked folders are
+    listed but not entered) and return an Entry with size and mtime for each path.
+    """
+    entries = []
+    stack = [("", root)]
+    while stack:
+        rel, full = stack.pop()
+        try:
+            iterator = os.scandir(full)
+        except OSError as e:
+            logger.debug(f"Could not scan {full}: {str(e)}")
+            continue
+        with iterator:
+            for item in iterator:
+                if item.name in UNTRACKED_NAMES:
+                    continue
+                path = f"{rel}/{item.name}" if rel else item.name
+                try:
+                    is_dir = item.is_dir()
+                    st = item.stat()
+                except OSError:
+                    continue
+                entries.append(entry_from_stat(path, st, is_dir))
+                if is_dir and not item.is_symlink():
+                    stack.append((path, item.path))
+    return entries
+
+
+class ProjectIndex:
+    """
+    SQLite table of every folder and file in the projects directory with its
+    parent, kind, size, mtime and (when known) content hash. Lookups are by
+    primary key, child listings use the parent index and subtree queries are a
+    range scan on the path key.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={'OFF' if DURABILITY_MODE == 'none' else 'NORMAL'}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS project_entries ("
+                "path TEXT PRIMARY KEY, parent TEXT NOT NULL, kind TEXT NOT NULL, "
+                "size INTEGER, mtime REAL, hash TEXT) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS project_entries_parent ON project_entries (parent)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _subtree_range(prefix: str) -> Tuple[str, str]:
+        # Every path below prefix sorts between "prefix/" and "prefix0" ('0' follows '/')
+        return prefix + "/", prefix + "0"
+
+    def _execute_operations(self, conn: sqlite3.Connection, operations: Iterable[Operation]):
+        for action, value in operations:
+            if action == "put":
+                entry = value
+                # A put without a hash keeps the stored one while size and mtime are unchanged
+                conn.execute(
+                    "INSERT INTO project_entries (path, parent, kind, size, mtime, hash) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET kind = excluded.kind, size = excluded.size, mtime = excluded.mtime, "
+                    "hash = CASE WHEN excluded.hash IS NOT NULL THEN excluded.hash "
+                    "WHEN size IS excluded.size AND mtime IS excluded.mtime THEN hash END",
+                    (entry.path, entry.parent, entry.kind, entry.size, entry.mtime, entry.hash)
+                )
+            else:
+                low, high = self._subtree_range(value)
+                conn.execute(
+                    "DELETE FROM project_entries WHERE path = ? OR (path >= ? AND path < ?)",
+                    (value, low, high)
+                )
+
+    def apply(self, operations: List[Operation]):
+        """
+        Apply puts and subtree deletes in order, in one transaction.
+        """
+        if not operations:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._execute_operations(conn, operations)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def replace_all(self, entries: Iterable[Entry]):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM project_entries")
+                self._execute_operations(conn, (("put", entry) for entry in entries))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM project_entries")
+
+    def get(self, path: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT path, kind, size, mtime, hash FROM project_entries WHERE path = ?", (path,)
+            ).fetchone()
+        return None if row is None else Entry(*row)
+
+    def children(self, parent: str) -> List[Entry]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT path, kind, size, mtime, hash FROM project_entries WHERE parent = ? ORDER BY path",
+                (parent,)
+            ).fetchall()
+        return [Entry(*row) for row in rows]
+
+    def subtree(self, prefix: str = "") -> List[Entry]:
+        """
+        Every entry below prefix ("" for the whole project), sorted by path.
+        """
+        with self._lock:
+            conn = self._connect()
+            if not prefix:
+                rows = conn.execute("SELECT path, kind, size, mtime, hash FROM project_entries ORDER BY path").fetchall()
+            else:
+                low, high = self._subtree_range(prefix)
+                rows = conn.execute(
+                    "SELECT path, kind, size, mtime, hash FROM project_entries WHERE path >= ? AND path < ? ORDER BY path",
+                    (low, high)
+                ).fetchall()
+        return [Entry(*row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM project_entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def reconcile(index: ProjectIndex, root: str) -> List[Operation]:
+    """
+    Operations that bring the index in line with the tree under root without
+    listing every folder: a folder is only listed again when its mtime differs
+    from the stored one (creating, deleting or renaming an entry updates the
+    folder's mtime). Unchanged folders are descended using the stored children.
+    Edits to files inside unchanged folders are picked up by the watcher or the
+    file tools, not here.
+    """
+    operations: List[Operation] = []
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        full = os.path.join(root, rel) if rel else root
+        try:
+            st = os.stat(full)
+        except OSError:
+            continue
+        stored = index.get(rel) if rel else None
+        stored_children = {entry.name: entry for entry in index.children(rel)}
+
+        if rel and stored is not None and stored.kind == DIR and stored.mtime == st.st_mtime:
+            stack.extend(entry.path for entry in stored_children.values() if entry.kind == DIR)
+            continue
+
+        seen = set()
+        try:
+            with os.scandir(full) as iterator:
+                for item in iterator:
+                    if item.name in UNTRACKED_NAMES:
+                        continue
+                    path = f"{rel}/{item.name}" if rel else item.name
+                    try:
+                        is_dir = item.is_dir()
+                        item_st = item.stat()
+                    except OSError:
+                        continue
+                    seen.add(item.name)
+                    old = stored_children.get(item.name)
+                    if old is not None and old.kind != (DIR if is_dir else FILE):
+                        operations.append(("delete", path))
+                        old = None
+                    if is_dir:
+                        if not item.is_symlink():
+                            # The folder's own row is written when it is visited
+                            stack.append(path)
+                        elif old is None:
+                            operations.append(("put", entry_from_stat(path, item_st, True)))
+                    elif old is None or old.size != item_st.st_size or old.mtime != item_st.st_mtime:
+                        operations.append(("put", entry_from_stat(path, item_st, False)))
+        except OSError as e:
+            logger.debug(f"Could not list {full}: {str(e)}")
+            continue
+
+        for name, entry in stored_children.items():
+            if name not in seen:
+                operations.append(("delete", entry.path))
+        if rel:
+            operations.append(("put", entry_from_stat(rel, st, True)))
+    return operations
+
+
+# Same database as the state backend, so every worker shares one index
+project_index = ProjectIndex(":memory:" if STATE_BACKEND == "memory" else STATE_DB_PATH)
@@ -0,0 +1,295 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import logging
+import threading
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Iterable, List, Optional, Tuple
+from config import (
+    PROJECTS_DIR, PROJECT_MAP_TOKEN_BUDGET, PROJECT_MAP_MAX_ENTRIES, PROJECT_MAP_IGNORE,
+    PROJECT_MAP_GITIGNORE_CACHE_ENTRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Directories and files that are never worth showing the model in full
+DEFAULT_IGNORE = [
+    ".git/", "node_modules/", ".venv/", "venv/", "env/", "__pycache__/", ".mypy_cache/",
+    ".pytest_cache/", ".ruff_cache/", ".tox/", ".next/", ".nuxt/", ".cache/", "dist/",
+    "build/", "target/", "coverage/", ".idea/", ".vscode/", "*.pyc", "*.pyo", ".DS_Store",
+    ".blobs/"
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about four characters per token), good enough for budgeting.
+    """
+    return (len(text) + 3) // 4
+
+
+# (pattern, anchored, dir_only, negate) as parsed from one .gitignore line
+Rule = Tuple[str, bool, bool, bool]
+
+# full path of a .gitignore -> ((mtime_ns, size), its parsed rules), least recently used first
+_gitignores: "OrderedDict[str, Tuple[Tuple[int, int], List[Rule]]]" = OrderedDict()
+_gitignores_lock = threading.Lock()
+
+
+class IgnoreRules:
+    """
+    A subset of .gitignore semantics: name patterns, anchored patterns containing
+    '/', trailing '/' for directories only and '!' negation, last match wins.
+    Rules from a nested .gitignore only apply below the folder that holds it.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), base: str = ""):
+        self.rules = []
+        self.add(patterns, base)
+
+    @staticmethod
+    def parse(patterns: Iterable[str]) -> List[Rule]:
+        rules = []
+        for line in patterns:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+            rules.append((line, anchored, dir_only, negate))
+        return rules
+
+    def add(self, patterns: Iterable[str], base: str = ""):
+        self.rules.extend((base, *rule) for rule in self.parse(patterns))
+
+    def add_gitignore(self, path: str, base: str = ""):
+        """
+        Add the rules of the .gitignore at path, if there is one. Parsed rules
+        are cached and only read again when the file's mtime or size changed.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        version = (st.st_mtime_ns, st.st_size)
+        with _gitignores_lock:
+            cached = _gitignores.get(path)
+            if cached is not None and cached[0] == version:
+                _gitignores.move_to_end(path)
+                self.rules.extend((base, *rule) for rule in cached[1])
+                return
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                parsed = self.parse(f.read().splitlines())
+        except OSError as e:
+            logger.debug(f"Could not read {path}: {str(e)}")
+            return
+        with _gitignores_lock:
+            _gitignores[path] = (version, parsed)
+            _gitignores.move_to_end(path)
+            while len(_gitignores) > PROJECT_MAP_GITIGNORE_CACHE_ENTRIES:
+                _gitignores.popitem(last=False)
+        self.rules.extend((base, *rule) for rule in parsed)
+
+    def in_ignored_folder(self, folder: str) -> bool:
+        """
+        Whether folder or one of the folders above it is ignored.
+        """
+        parts = folder.split("/")
+        return any(self.is_ignored("/".join(parts[:depth]), True) for depth in range(1, len(parts) + 1))
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        ignored = False
+        name = rel_path.rsplit("/", 1)[-1]
+        for base, pattern, anchored, dir_only, negate in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + "/"):
+                    continue
+                sub_path = rel_path[len(base) + 1:]
+            else:
+                sub_path = rel_path
+            if fnmatchcase(sub_path if anchored else name, pattern):
+                ignored = not negate
+        return ignored
+
+    @classmethod
+    def for_project(cls, files: Iterable[str], root: str = PROJECTS_DIR) -> "IgnoreRules":
+        """
+        Default ignore list, PROJECT_MAP_IGNORE and every .gitignore listed in
+        files. Like git, a .gitignore inside an ignored folder is not read.
+        """
+        rules = cls(DEFAULT_IGNORE)
+        rules.add(PROJECT_MAP_IGNORE)
+        gitignores = [p for p in files if p == ".gitignore" or p.endswith("/.gitignore")]
+        # Shallowest first, so the rules above a folder are known before its own .gitignore
+        for path in sorted(gitignores, key=lambda p: (p.count("/"), p)):
+            base = path.rsplit("/", 1)[0] if "/" in path else ""
+            if base and rules.in_ignored_folder(base):
+                continue
+            rules.add_gitignore(os.path.join(root, path), base)
+        return rules
+
+
+class _Node:
+    __slots__ = ("dirs", "files", "file_count", "dir_count", "ignored")
+
+    def __init__(self):
+        self.dirs = {}
+        self.files = []
+        self.file_count = 0
+        self.dir_count = 0
+        self.ignored = False
+
+
+def _build_tree(folders: Iterable[str], files: Iterable[str]) -> _Node:
+    root = _Node()
+
+    def node_for(path: str) -> _Node:
+        node = root
+        if path:
+            for part in path.split("/"):
+                node = node.dirs.setdefault(part, _Node())
+        return node
+
+    for folder in folders:
+        node_for(folder)
+    for path in files:
+        parent, _, name = path.rpartition("/")
+        node_for(parent).files.append(name)
+    return root
+
+
+def _annotate(node: _Node, path: str, rules: IgnoreRules):
+    """
+    Sort entries, mark ignored folders and count files and folders below each node.
+    Ignored files are dropped; ignored folders keep only their counts.
+    """
+    node.files = sorted(name for name in node.files
+                        if not rules.is_ignored(f"{path}{name}", False))
+    node.file_count = len(node.files)
+    node.dir_count = len(node.dirs)
+    for name in sorted(node.dirs):
+        child = node.dirs[name]
+        child_path = f"{path}{name}"
+        child.ignored = node.ignored or rules.is_ignored(child_path, True)
+        if child.ignored:
+            _count_all(child)
+        else:
+            _annotate(child, child_path + "/", rules)
+        node.file_count += child.file_count
+        node.dir_count += child.dir_count
+    node.dirs = dict(sorted(node.dirs.items()))
+
+
+def _count_all(node: _Node):
+    node.file_count = len(node.files)
+    node.dir_count = len(node.dirs)
+    for child in node.dirs.values():
+        _count_all(child)
+        node.file_count += child.file_count
+        node.dir_count += child.dir_count
+
+
+def _summary(node: _Node) -> str:
+    parts = [f"{node.file_count} file{'s' if node.file_count != 1 else ''}"]
+    if node.dir_count:
+        parts.append(f"{node.dir_count} folder{'s' if node.dir_count != 1 else ''}")
+    return ", ".join(parts)
+
+
+def _render(node: _Node, depth: int, max_depth: int, max_entries: int, lines: List[str]):
+    indent = "  " * depth
+    entries = 0
+    for name, child in node.dirs.items():
+        if entries >= max_entries:
+            break
+        entries += 1
+        if child.ignored:
+            lines.append(f"{indent}{name}/ [ignored, {_summary(child)}]")
+        elif depth + 1 >= max_depth and (child.dirs or child.files):
+            lines.append(f"{indent}{name}/ [{_summary(child)}]")
+        else:
+            lines.append(f"{indent}{name}/")
+            _render(child, depth + 1, max_depth, max_entries, lines)
+    for name in node.files:
+        if entries >= max_entries:
+            break
+        entries += 1
+        lines.append(f"{indent}{name}")
+    hidden = len(node.dirs) + len(node.files) - entries
+    if hidden > 0:
+        lines.append(f"{indent}... {hidden} more entries")
+
+
+def render_project_map(
+    folders: Iterable[str],
+    files: Iterable[str],
+    token_budget: int = PROJECT_MAP_TOKEN_BUDGET,
+    max_entries: int = PROJECT_MAP_MAX_ENTRIES,
+    rules: Optional[IgnoreRules] = None
+) -> str:
+    """
+    Render the project as an indented tree that fits in token_budget. Ignored
+    folders (node_modules, .venv, .gitignore entries ...) are collapsed to a
+    count, folders with more than max_entries entries are cut short, and deeper
+    levels are summarised as counts until the map fits.
+    """
+    files = list(files)
+    if rules is None:
+        rules = IgnoreRules.for_project(files)
+    tree = _build_tree(folders, files)
+    _annotate(tree, "", rules)
+
+    header = f"Project map ({_summary(tree)}, paths relative to the project root):"
+    if not tree.dirs and not tree.files:
+        return f"{header}\n(empty)"
+
+    max_depth = _depth(tree)
+    while True:
+        lines = [header]
+        _render(tree, 0, max_depth, max_entries, lines)
+        text = "\n".join(lines)
+        if estimate_tokens(text) <= token_budget or max_depth <= 1:
+            break
+        max_depth -= 1
+
+    if estimate_tokens(text) > token_budget:
+        # Even the top level is too large: keep as many lines as fit next to the marker
+        marker = f"... map truncated to fit {token_budget} tokens"
+        kept, used = [], estimate_tokens(marker)
+        for line in lines:
+            used += estimate_tokens(line + "\n")
+            if used > token_budget:
+                break
+            kept.append(line)
+        kept.append(marker)
+        text = "\n".join(kept)
+    return text
+
+
+def _depth(node: _Node) -> int:
+    if not node.dirs:
+        return 1
+    return 1 + max((_depth(child) for child in node.dirs.values() if not child.ignored), default=0)
@@ -1,88 +1,278 @@
 import os
+import time
 import logging
 import json
+import asyncio
 from pathlib import Path
-from config import PROJECTS_DIR
+from typing import List, Optional, Tuple
+from config import PROJECTS_DIR, PROJECT_STATE_WATCHER, PROJECT_STATE_POLL_INTERVAL, PROJECT_STATE_FLUSH_DELAY
+from fs_watcher import create_watcher
+from project_index import project_index, scan_entries, reconcile, entry_from_stat, is_tracked, Entry, Operation, DIR, FILE
+from path_index import PathIndex
+from state_backend import state_backend
 
 logger = logging.getLogger(__name__)
 
+# Older versions saved the state to this JSON file; it is removed by clear_state_file
 PROJECT_STATE_FILE = "project_state.json"
+# State backend key bumped after every index write so other workers can follow
+PROJECT_STATE_NAMESPACE = "project_state"
 
-# Global state to keep track of created folders and files
-project_state = {
-    "folders": set(),
-    "files": set()
-}
+# Global state to keep track of created folders and files, answering lookups,
+# child listings and subtree counts in O(depth). Other modules import this
+# object directly, so it is only ever mutated in place. The SQLite project
+# index is the persistent copy shared with other workers.
+project_state = PathIndex()
+
+# Filesystem watcher feeding incremental deltas into project_state
+_watcher = None
+
+# Write-behind persistence: index operations waiting to be flushed, in order
+_pending_ops: List[Operation] = []
+_flush_task = None
+_flush_lock = asyncio.Lock()
 
 async def clear_state_file():
-    global project_state
-    project_state = {"folders": set(), "files": set()}
-    try:
-        if os.path.exists(PROJECT_STATE_FILE):
-            os.remove(PROJECT_STATE_FILE)
-        logger.info("Project state file cleared")
-    except Exception as e:
-        logger.error(f"Error clearing project state file: {str(e)}")
+    project_state.clear()
+    async with _flush_lock:
+        _pending_ops.clear()
+        try:
+            await asyncio.to_thread(project_index.clear)
+            if os.path.exists(PROJECT_STATE_FILE):
+                os.remove(PROJECT_STATE_FILE)
+            logger.info("Project state file cleared")
+        except Exception as e:
+            logger.error(f"Error clearing project state file: {str(e)}")
     return project_state
 
+def _apply_to_memory(operations: List[Operation]):
+    for action, value in operations:
+        if action == "put":
+            project_state.put(value)
+        else:
+            project_state.delete(value)
+
+async def _record(operations: List[Operation]):
+    """
+    Apply operations to project_state now and queue them for the index.
+    """
+    operations = [(action, value) for action, value in operations
+                  if is_tracked(value.path if action == "put" else value)]
+    if operations:
+        _apply_to_memory(operations)
+        _pending_ops.extend(operations)
+        await save_state_to_file(project_state)
+
+def _stat_entry(rel_path: str, is_dir: bool, size: Optional[int] = None, hash: Optional[str] = None) -> Entry:
+    try:
+        return entry_from_stat(rel_path, os.stat(os.path.join(PROJECTS_DIR, rel_path)), is_dir, hash)
+    except OSError:
+        return Entry(rel_path, DIR if is_dir else FILE, None if is_dir else size, None, hash)
+
+def _changes_to_operations(changes) -> List[Operation]:
+    operations = []
+    for change in changes:
+        if change.action == "created":
+            operations.append(("put", _stat_entry(change.path, change.is_dir)))
+        else:
+            operations.append(("delete", change.path))
+    return operations
+
+async def _rescan_project_state():
+    """
+    Full walk of the projects directory, replacing the whole index.
+    """
+    async with _flush_lock:
+        # Operations queued while the walk runs are newer than it and are kept
+        superseded = len(_pending_ops)
+        entries = await asyncio.to_thread(scan_entries, PROJECTS_DIR)
+        await asyncio.to_thread(project_index.replace_all, entries)
+        tree = await asyncio.to_thread(PathIndex, entries)
+        del _pending_ops[:superseded]
+        project_state.swap(tree)
+        _apply_to_memory(_pending_ops)
+    await _notify_workers()
+
+async def _reconcile_project_state():
+    """
+    Update the index from the file system, listing only folders whose mtime changed.
+    """
+    await flush_project_state()
+    async with _flush_lock:
+        operations = await asyncio.to_thread(reconcile, project_index, PROJECTS_DIR)
+    await _record(operations)
+    logger.debug(f"Reconciled project state with file system ({len(operations)} changes)")
+
+async def start_project_state_watcher():
+    global _watcher
+    if _watcher is not None:
+        return _watcher
+    _watcher = create_watcher(PROJECTS_DIR, PROJECT_STATE_WATCHER, PROJECT_STATE_POLL_INTERVAL)
+    if _watcher is not None:
+        _watcher.start()
+        # Deltas queued from here on are idempotent against the catch-up below
+        await _catch_up()
+    return _watcher
+
+async def _catch_up():
+    if await asyncio.to_thread(project_index.count):
+        await _reconcile_project_state()
+    else:
+        await _rescan_project_state()
+
+async def stop_project_state_watcher():
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
+
 async def sync_project_state_with_fs():
-    global project_state
-    project_state = {"folders": set(), "files": set()}
-    
-    for root, dirs, files in os.walk(PROJECTS_DIR):
-        for dir in dirs:
-            rel_path = os.path.relpath(os.path.join(root, dir), PROJECTS_DIR).replace(os.sep, '/')
-            project_state["folders"].add(rel_path)
-        for file in files:
-            rel_path = os.path.relpath(os.path.join(root, file), PROJECTS_DIR).replace(os.sep, '/')
-            project_state["files"].add(rel_path)
-    
-    await save_state_to_file(project_state)
-    logger.debug(f"Synced project state with file system: {project_state}")
+    """
+    Bring project_state up to date with the file system. With a running watcher
+    only the queued deltas are applied. Without one, or after the watcher
+    overflowed, the stored index is reconciled: only folders whose mtime changed
+    since they were indexed are listed again.
+    """
+    if _watcher is None or not _watcher.running:
+        await _catch_up()
+        return project_state
+
+    changes, rescan = _watcher.drain()
+    if rescan:
+        await _reconcile_project_state()
+        logger.info("Project state reconciled after watcher overflow")
+    elif changes:
+        await _record(_changes_to_operations(changes))
+        logger.debug(f"Applied {len(changes)} file system changes to project state")
     return project_state
 
-async def update_project_state(path: str, is_folder: bool, is_delete: bool = False):
-    global project_state
+async def get_entry(path: str) -> Optional[Entry]:
+    """
+    Entry for a project_state path, or None when it is not tracked.
+    """
+    return project_state.get(path)
+
+async def list_children(path: str = "") -> List[Entry]:
+    """
+    Entries directly inside the folder at a project_state path ("" for the projects directory).
+    """
+    return project_state.children(path)
+
+async def project_state_view(prefix: str = ""):
+    """
+    Folders and files below prefix (a project_state path, "" for everything),
+    relative to prefix. Used to show a session only its own project root.
+    """
+    start = len(prefix) + 1 if prefix else 0
+    folders, files = set(), set()
+    for entry in project_state.walk(prefix):
+        (folders if entry.kind == DIR else files).add(entry.path[start:])
+    return folders, files
+
+def _state_rel_path(path: str) -> Optional[str]:
+    # Normalize the path and make it relative to PROJECTS_DIR
+    normalized_path = os.path.normpath(path).lstrip(os.sep).replace('\\', '/')
+    projects_dir_path = Path(PROJECTS_DIR)
+    full_path = projects_dir_path / normalized_path
+
+    # Ensure the path is within PROJECTS_DIR
     try:
-        # Normalize the path and make it relative to PROJECTS_DIR
-        normalized_path = os.path.normpath(path).lstrip(os.sep).replace('\\', '/')
-        projects_dir_path = Path(PROJECTS_DIR)
-        full_path = projects_dir_path / normalized_path
+        return full_path.relative_to(projects_dir_path).as_posix()
+    except ValueError:
+        logger.error(f"Path '{full_path}' is not within PROJECTS_DIR '{projects_dir_path}'")
+        return None
 
-        # Ensure the path is within PROJECTS_DIR
-        try:
-            rel_path = str(full_path.relative_to(projects_dir_path))
-        except ValueError:
-            logger.error(f"Path '{full_path}' is not within PROJECTS_DIR '{projects_dir_path}'")
+async def update_project_state(path: str, is_folder: bool, is_delete: bool = False,
+                               size: Optional[int] = None, hash: Optional[str] = None):
+    try:
+        rel_path = _state_rel_path(path)
+        if rel_path is None:
             return
 
         logger.debug(f"Updating project state for path: {rel_path}")
 
         if is_delete:
-            project_state["folders"].discard(rel_path)
-            project_state["files"].discard(rel_path)
+            # Removing a folder removes everything that was below it
+            await _record([("delete", rel_path)])
             logger.debug(f"Removed {'folder' if is_folder else 'file'} from project state: {rel_path}")
         else:
-            if is_folder:
-                project_state["folders"].add(rel_path)
-                logger.debug(f"Added folder to project state: {rel_path}")
-            else:
-                project_state["files"].add(rel_path)
-                logger.debug(f"Added file to project state: {rel_path}")
+            await _record([("put", _stat_entry(rel_path, is_folder, size, hash))])
+            logger.debug(f"Added {'folder' if is_folder else 'file'} to project state: {rel_path}")
+    except Exception as e:
+        logger.error(f"Error updating project state: {str(e)}", exc_info=True)
 
-        await save_state_to_file(project_state)
-        logger.debug(f"Project state after update: {project_state}")
+async def update_project_state_batch(changes: List[Tuple[str, bool, Optional[int], Optional[str]]]):
+    """
+    Record created or written entries, given as (path, is_folder, size, hash),
+    with one state update and one state save for all of them.
+    """
+    try:
+        operations = []
+        for path, is_folder, size, hash in changes:
+            rel_path = _state_rel_path(path)
+            if rel_path is not None:
+                operations.append(("put", _stat_entry(rel_path, is_folder, size, hash)))
+        await _record(operations)
+        logger.debug(f"Added {len(operations)} entries to project state")
     except Exception as e:
         logger.error(f"Error updating project state: {str(e)}", exc_info=True)
 
+async def _notify_workers():
+    try:
+        await asyncio.to_thread(state_backend.put, PROJECT_STATE_NAMESPACE, PROJECT_STATE_FILE, {"updated_at": time.time()})
+    except Exception as e:
+        logger.error(f"Error notifying workers of project state change: {str(e)}", exc_info=True)
+
+async def flush_project_state():
+    """
+    Write pending index operations now, in one transaction. Called by the
+    delayed flush task, before reading the index and on shutdown.
+    """
+    if not _pending_ops:
+        if _flush_lock.locked():
+            # Wait for a flush or rescan in progress so queries see its result
+            async with _flush_lock:
+                pass
+        return
+    async with _flush_lock:
+        operations = list(_pending_ops)
+        _pending_ops.clear()
+        try:
+            await asyncio.to_thread(project_index.apply, operations)
+            logger.debug(f"Flushed {len(operations)} project state changes to the index")
+        except Exception as e:
+            logger.error(f"Error saving project state: {str(e)}", exc_info=True)
+            return
+    await _notify_workers()
+
+async def _delayed_flush():
+    await asyncio.sleep(PROJECT_STATE_FLUSH_DELAY)
+    await flush_project_state()
 
 async def save_state_to_file(state, filename=PROJECT_STATE_FILE):
-    with open(filename, 'w') as f:
-        json.dump({"folders": list(state["folders"]), "files": list(state["files"])}, f)
-    logger.debug(f"Saved project state to file: {state}")
+    """
+    Schedule the pending changes to be written to the project index. Changes
+    within PROJECT_STATE_FLUSH_DELAY seconds are coalesced into a single
+    transaction; a delay of 0 writes immediately.
+    """
+    global _flush_task
+    if PROJECT_STATE_FLUSH_DELAY <= 0:
+        await flush_project_state()
+    elif _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_delayed_flush())
     return state  # Return the state to ensure it's not modified
 
 async def load_state_from_file(filename=PROJECT_STATE_FILE):
+    """
+    Folders and files stored in the project index. When the index is still
+    empty, a project_state.json written by an older version is used instead.
+    """
+    entries = await asyncio.to_thread(project_index.subtree, "")
+    if entries:
+        return {
+            "folders": {e.path for e in entries if e.kind == DIR},
+            "files": {e.path for e in entries if e.kind == FILE}
+        }
     try:
         with open(filename, 'r') as f:
             data = json.load(f)
@@ -90,19 +280,33 @@ async def load_state_from_file(filename=PROJECT_STATE_FILE):
     except FileNotFoundError:
         return {"folders": set(), "files": set()}
 
-async def initialize_project_state():
-    global project_state
-    project_state = await load_state_from_file()
-    logger.info("Project state initialized")
+async def _reload_from_index():
+    async with _flush_lock:
+        if _pending_ops:
+            return
+        tree = await asyncio.to_thread(lambda: PathIndex(project_index.subtree("")))
+        project_state.swap(tree)
+    logger.debug("Project state reloaded after a change in another worker")
 
-async def refresh_project_state():
-    global project_state
-    project_state = {"folders": set(), "files": set()}
+def _on_state_changed(key: str):
+    """
+    Another worker wrote to the project index. Workers with a running watcher
+    follow the file system themselves; the others reload from the index.
+    """
+    if key != PROJECT_STATE_FILE or (_watcher is not None and _watcher.running):
+        return
+    asyncio.get_running_loop().create_task(_reload_from_index())
 
-    for root, dirs, files in os.walk(PROJECTS_DIR):
-        for dir_name in dirs:
-            project_state["folders"].add(os.path.relpath(os.path.join(root, dir_name), PROJECTS_DIR).replace('\\', '/'))
-        for file_name in files:
-            project_state["files"].add(os.path.relpath(os.path.join(root, file_name), PROJECTS_DIR).replace('\\', '/'))
+state_backend.subscribe(PROJECT_STATE_NAMESPACE, _on_state_changed)
 
-    await save_state_to_file(project_state)
+async def initialize_project_state():
+    entries = await asyncio.to_thread(project_index.subtree, "")
+    if not entries:
+        # Paths saved by an older version, without metadata, until the first scan
+        state = await load_state_from_file()
+        entries = [Entry(path, DIR) for path in state["folders"]] + [Entry(path, FILE) for path in state["files"]]
+    project_state.swap(await asyncio.to_thread(PathIndex, entries))
+    logger.info(f"Project state initialized: {project_state}")
+
+async def refresh_project_state():
+    await _rescan_project_state()
@@ -0,0 +1,322 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from fastapi import HTTPException, Request
+from config import (
+    PROJECTS_DIR, SESSION_MAX_COUNT, SESSION_IDLE_TIMEOUT, SESSION_MAX_TOTAL_TOKENS,
+    SESSION_MAX_AUTOMODE_MESSAGES, SESSION_PROJECT_ROOTS
+)
+from history_manager import ConversationHistory
+from project_map import estimate_tokens
+from shared_utils import current_project_root
+from state_backend import StateBackend, state_backend
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+SESSION_HEADER = "X-Session-ID"
+SESSION_COOKIE = "session_id"
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# State backend namespaces
+SESSIONS_NAMESPACE = "sessions"
+AUTOMODE_NAMESPACE = "automode_jobs"
+
+
+class Session:
+    """
+    Everything one client owns: chat history, console working directory
+    (relative to project_root), automode run state and its project root.
+    """
+
+    def __init__(self, session_id: str, project_root: str):
+        self.id = session_id
+        self.project_root = project_root
+        self.history = ConversationHistory()
+        self.cwd = "."
+        self.automode_progress = 0
+        self.automode_messages: List[dict] = []
+        # idle, running, completed, error or interrupted (the worker running it went away)
+        self.automode_status = "idle"
+        # True only in the worker process that executes the run
+        self.automode_running = False
+        self.created_at = time.time()
+        self.last_seen = self.created_at
+        # Serialises chat turns so two requests never interleave in one history
+        self.lock = asyncio.Lock()
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def to_record(self) -> dict:
+        return {
+            "cwd": self.cwd,
+            "history": list(self.history),
+            "summary": self.history.summary,
+            "compactions": self.history.compactions,
+            "created_at": self.created_at,
+            "last_seen": self.last_seen
+        }
+
+    def automode_record(self) -> dict:
+        return {
+            "status": self.automode_status,
+            "progress": self.automode_progress,
+            "messages": self.automode_messages,
+            "updated_at": time.time()
+        }
+
+    @classmethod
+    def from_records(cls, session_id: str, project_root: str, record: Optional[dict], job: Optional[dict],
+                     stale_after: float = SESSION_IDLE_TIMEOUT) -> "Session":
+        session = cls(session_id, project_root)
+        if record:
+            session.history.extend(record["history"])
+            session.history.summary = record.get("summary", "")
+            session.history.compactions = record.get("compactions", 0)
+            session.cwd = record.get("cwd", ".")
+            session.created_at = record.get("created_at", session.created_at)
+        if job:
+            session.automode_progress = job.get("progress", 0)
+            session.automode_messages = job.get("messages", [])
+            session.automode_status = job.get("status", "idle")
+            if session.automode_status == "running" and time.time() - job.get("updated_at", 0) > stale_after:
+                session.automode_status = "interrupted"
+        return session
+
+    def reset_automode(self):
+        self.automode_progress = 0
+        self.automode_messages = []
+
+    def add_automode_message(self, message: dict):
+        self.automode_messages.append(message)
+        if len(self.automode_messages) > SESSION_MAX_AUTOMODE_MESSAGES:
+            del self.automode_messages[:len(self.automode_messages) - SESSION_MAX_AUTOMODE_MESSAGES]
+
+    def memory_tokens(self) -> int:
+        automode_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in self.automode_messages)
+        return self.history.token_footprint() + automode_tokens
+
+    def is_busy(self) -> bool:
+        return self.automode_running or self.lock.locked()
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "project_root": os.path.relpath(self.project_root, PROJECTS_DIR).replace(os.sep, '/'),
+            "cwd": self.cwd,
+            "history": self.history.stats(),
+            "automode_status": self.automode_status,
+            "automode_progress": self.automode_progress,
+            "created_at": self.created_at,
+            "last_seen": self.last_seen
+        }
+
+
+class SessionStore:
+    """
+    Sessions keyed by ID, cached in memory and saved to the state backend so
+    any worker process can serve any session. Sessions idle for longer than
+    idle_timeout are dropped, and when there are more than max_sessions or their
+    histories together exceed max_total_tokens the least recently used ones
+    leave memory first (they are reloaded from the backend on the next request).
+    Sessions with a running automode or an active chat turn are never evicted.
+    A cached session changed by another worker is dropped so the next request
+    reloads it. Files in a session's project root stay on disk after eviction.
+
+    Chat turns are serialised per session within one worker only; two workers
+    handling the same session at the same time save last-writer-wins.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_COUNT,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+        max_total_tokens: int = SESSION_MAX_TOTAL_TOKENS,
+        project_roots: str = SESSION_PROJECT_ROOTS,
+        projects_dir: str = PROJECTS_DIR,
+        backend: Optional[StateBackend] = None
+    ):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_total_tokens = max_total_tokens
+        self.project_roots = project_roots
+        self.projects_dir = projects_dir
+        self.sessions: Dict[str, Session] = {}
+        self.backend = backend or state_backend
+        self.backend.subscribe(SESSIONS_NAMESPACE, self.invalidate)
+        self.backend.subscribe(AUTOMODE_NAMESPACE, self.invalidate)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, session_id: str):
+        return session_id in self.sessions
+
+    def root_for(self, session_id: str) -> str:
+        # Requests without a session ID get a folder of their own too; with the whole
+        # projects directory as root they could reach every other session's files
+        if self.project_roots == "isolated":
+            return os.path.join(self.projects_dir, "sessions", session_id)
+        return self.projects_dir
+
+    def _load(self, session_id: str, root: str):
+        os.makedirs(root, exist_ok=True)
+        return self.backend.get(SESSIONS_NAMESPACE, session_id), self.backend.get(AUTOMODE_NAMESPACE, session_id)
+
+    async def get(self, session_id: str = DEFAULT_SESSION_ID) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            root = self.root_for(session_id)
+            # The backend may wait on a lock or a busy database, so it is read off the event loop
+            record, job = await asyncio.to_thread(self._load, session_id, root)
+            # Another request may have loaded it meanwhile
+            session = self.sessions.get(session_id)
+        if session is None:
+            session = Session.from_records(session_id, root, record, job, self.idle_timeout)
+            self.sessions[session_id] = session
+            if record is None:
+                metrics.increment("sessions_created")
+                logger.info(f"Session {session_id} created with project root {root}")
+            else:
+                metrics.increment("sessions_loaded")
+                logger.debug(f"Session {session_id} loaded from the state backend")
+            self.enforce_limits(keep=session_id)
+        session.touch()
+        return session
+
+    async def save(self, session: Session):
+        await asyncio.to_thread(self.backend.put, SESSIONS_NAMESPACE, session.id, session.to_record())
+
+    async def save_automode(self, session: Session):
+        await asyncio.to_thread(self.backend.put, AUTOMODE_NAMESPACE, session.id, session.automode_record())
+
+    def invalidate(self, session_id: str):
+        """
+        Forget the cached copy of a session another worker changed.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None and not session.is_busy():
+            del self.sessions[session_id]
+            metrics.increment("sessions_invalidated")
+            logger.debug(f"Session {session_id} changed in another worker, dropped cached copy")
+
+    def remove(self, session_id: str) -> Optional[Session]:
+        """
+        Drop a session from memory. It is reloaded from the backend when used again.
+        """
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            metrics.increment("sessions_evicted")
+            logger.info(f"Session {session_id} evicted")
+        return session
+
+    async def delete(self, session_id: str):
+        self.remove(session_id)
+        await asyncio.to_thread(self.backend.delete, SESSIONS_NAMESPACE, session_id)
+        await asyncio.to_thread(self.backend.delete, AUTOMODE_NAMESPACE, session_id)
+
+    def total_tokens(self) -> int:
+        return sum(session.memory_tokens() for session in self.sessions.values())
+
+    def _purge(self, cutoff: float):
+        self.backend.purge(SESSIONS_NAMESPACE, cutoff)
+        self.backend.purge(AUTOMODE_NAMESPACE, cutoff)
+
+    async def evict_idle(self, now: Optional[float] = None) -> List[str]:
+        """
+        Drop idle sessions. The in-memory scan runs on the event loop, which
+        also adds sessions and takes their locks, so only the backend purge
+        goes to a worker thread.
+        """
+        now = time.time() if now is None else now
+        expired = [
+            session.id for session in self.sessions.values()
+            if now - session.last_seen > self.idle_timeout and not session.is_busy()
+        ]
+        for session_id in expired:
+            self.remove(session_id)
+        # Sessions nobody changed for idle_timeout are dropped from the backend too
+        await asyncio.to_thread(self._purge, now - self.idle_timeout)
+        return expired
+
+    def enforce_limits(self, keep: Optional[str] = None) -> List[str]:
+        """
+        Evict least recently used sessions until the count and token caps hold.
+        """
+        evicted = []
+        candidates = sorted(
+            (s for s in self.sessions.values() if s.id != keep and not s.is_busy()),
+            key=lambda s: s.last_seen
+        )
+        total = self.total_tokens()
+        for session in candidates:
+            if len(self.sessions) <= self.max_sessions and total <= self.max_total_tokens:
+                break
+            total -= session.memory_tokens()
+            self.remove(session.id)
+            evicted.append(session.id)
+        if len(self.sessions) > self.max_sessions or total > self.max_total_tokens:
+            logger.warning(f"Session limits exceeded by active sessions: {len(self.sessions)} sessions, {total} tokens")
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "tokens": self.total_tokens(),
+            "automode_running": sum(1 for s in self.sessions.values() if s.automode_running),
+            "worker": self.backend.origin
+        }
+
+
+session_store = SessionStore()
+
+
+def session_id_from_request(request: Request) -> str:
+    session_id = (
+        request.headers.get(SESSION_HEADER)
+        or request.cookies.get(SESSION_COOKIE)
+        or request.query_params.get("session_id")
+        or DEFAULT_SESSION_ID
+    )
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session ID")
+    return session_id
+
+
+async def get_session(request: Request) -> Session:
+    """
+    FastAPI dependency: the caller's session, with its project root made the
+    root for file operations in this request.
+    """
+    session = await session_store.get(session_id_from_request(request))
+    current_project_root.set(session.project_root)
+    return session
+
+
+async def evict_sessions_periodically(interval: float = 60):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await session_store.evict_idle()
+            session_store.enforce_limits()
+        except Exception as e:
+            logger.error(f"Error evicting sessions: {str(e)}", exc_info=True)
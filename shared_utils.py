@@ -13,21 +13,36 @@
 # You should have received a copy of the GNU General Public License
 # along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
 import os
-import json
 import asyncio
 # import re
 import logging
 import platform
 import base64
-# from typing import Dict, Any
-import requests
+import hashlib
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+import httpx
 from pathlib import Path
-from PIL import Image
-import io
+from contextvars import ContextVar
 from fastapi import HTTPException
-from config import PROJECTS_DIR, SEARCH_RESULTS_LIMIT, SEARCH_PROVIDER, SEARXNG_URL, tavily_client
-from project_state import project_state, save_state_to_file, update_project_state
-from urllib.parse import urlparse
+from pydantic import BaseModel
+from config import (
+    PROJECTS_DIR, SEARCH_RESULTS_LIMIT, SEARCH_PROVIDER, SEARXNG_URL, DURABILITY_MODE,
+    SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_PERSIST, TAVILY_API_KEY, TAVILY_API_URL,
+    SEARXNG_TIMEOUT, TAVILY_TIMEOUT, SEARCH_HEDGED, SEARCH_HEDGE_DELAY, search_http_client,
+    SEARCH_RESULTS_TOKEN_BUDGET, SEARCH_SNIPPET_CHARS
+)
+from project_state import update_project_state, update_project_state_batch
+from dir_listing import scan_listing, sort_listing, ListingEntry
+from file_reader import read_slice, FileSlice
+from file_edits import apply_unified_diff, apply_replacements, PatchConflict
+from project_map import estimate_tokens
+from image_pipeline import prepare_image_async
+from state_backend import StateBackend, state_backend
+import metrics
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 from datetime import datetime
 
 
@@ -47,10 +62,12 @@ Available tools:
 1. create_folder(path): Create a new folder
 2. create_file(path, content=""): Create a new file with optional content
 3. write_to_file(path, content): Write content to an existing file
-4. read_file(path): Read the contents of a file
-5. list_files(path): List all files and directories in the specified path
-6. search(query): Perform a web search using {SEARCH_PROVIDER}
-7. delete_file(path): Delete a file or folder
+4. edit_file(path, edits or patch): Change part of an existing file with search/replace edits or a unified diff
+5. batch_write(folders, files): Create several folders and files in one call
+6. read_file(path): Read the contents of a file
+7. list_files(path): List all files and directories in the specified path
+8. search(query): Perform a web search using {SEARCH_PROVIDER}
+9. delete_file(path): Delete a file or folder
 
 CRITICAL INSTRUCTIONS:
 1. ALWAYS complete the ENTIRE task in ONE response.
@@ -87,10 +104,12 @@ IMPORTANT NEVER stop after just creating a folder or a single file. ALWAYS compl
    create_file("project_name/file1.ext", "content")
    create_file("project_name/subdirectory1/file2.ext", "content")
    ... (create all required files)
+   Steps 1 to 3 can be done in one batch_write call with all folders and files.
 
 4. Write content to each file as needed:
    write_to_file("project_name/file1.ext", "updated content")
    ... (write to all files that need content)
+   To change part of an existing file, use edit_file instead of rewriting the whole file.
 
 5. Provide a summary of the created project structure and functionality.
 6. Add "Task complete" at the end of your response to indicate the task has been completed.
@@ -100,7 +119,7 @@ Remember: NEVER stop after just creating a folder or a single file. ALWAYS compl
 IMPORTANT: When performing file operations:
 1. Always use the appropriate tool to perform the action.
 2. After each file operation, verify the result by:
-   a. For file creation or modification, use the read_file tool to confirm the content.
+   a. For file creation or modification, check the size and SHA-256 reported in the tool result; there is no need to read the file back.
    b. Use the list_files tool to confirm the file's presence in the directory.
 3. If a file operation seems to fail or produce unexpected results, report this to the user immediately.
 4. Keep track of the current state of the project directory and files you've created or modified.
@@ -120,8 +139,29 @@ Additional Guidelines:
 Always tailor your responses to the user's specific needs and context, focusing on providing accurate, helpful, and detailed assistance in software development and project management.
 """
 
+# Root directory for file operations of the current request. Sessions with their
+# own workspace set this to a folder inside PROJECTS_DIR.
+current_project_root: ContextVar[str] = ContextVar("current_project_root", default=PROJECTS_DIR)
+
+def get_project_root() -> str:
+    return current_project_root.get()
+
+def to_state_path(full_path) -> str:
+    """
+    Path as tracked in project_state: relative to PROJECTS_DIR with '/' separators,
+    "" for PROJECTS_DIR itself.
+    """
+    rel_path = Path(full_path).resolve().relative_to(Path(PROJECTS_DIR).resolve()).as_posix()
+    return "" if rel_path == "." else rel_path
+
+def state_path_for(path: str) -> str:
+    """
+    project_state path for a path given relative to the current project root.
+    """
+    return to_state_path(get_safe_path(path))
+
 def get_safe_path(path: str) -> Path:
-    abs_projects_dir = Path(PROJECTS_DIR).resolve()
+    abs_projects_dir = Path(get_project_root()).resolve()
     normalized_path = Path(path.lstrip('/')).as_posix()
     full_path = (abs_projects_dir / normalized_path).resolve()
     if not full_path.is_relative_to(abs_projects_dir):
@@ -129,14 +169,81 @@ def get_safe_path(path: str) -> Path:
     return full_path
 
 
-async def sync_filesystem():
+def fsync_directory(path) -> None:
+    """
+    Persist directory entries (creates, renames, deletes) of path. No-op where
+    directories cannot be opened, e.g. on Windows.
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
     try:
-        if hasattr(os, 'sync'):
-            os.sync()
-        elif platform.system() == 'Windows':
-            import ctypes
-            ctypes.windll.kernel32.FlushFileBuffers(ctypes.c_void_p(-1))
-        logger.info("File system synced")
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_host() -> None:
+    """
+    Flush all file system buffers of the host. Blocks until the disks confirm,
+    so it is run in a worker thread.
+    """
+    if hasattr(os, 'sync'):
+        os.sync()
+    elif platform.system() == 'Windows':
+        import ctypes
+        ctypes.windll.kernel32.FlushFileBuffers(ctypes.c_void_p(-1))
+
+# Current umask, applied to files created through atomic_write_text (mkstemp uses 0600)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+WRITE_CHUNK_CHARS = 1024 * 1024
+
+def atomic_write_text(full_path, content: str):
+    """
+    Write content to a temp file next to full_path, hashing it while it is
+    written, fsync it according to DURABILITY_MODE and rename it into place.
+    Returns (size_in_bytes, sha256_hexdigest).
+    """
+    full_path = Path(full_path)
+    try:
+        mode = full_path.stat().st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{full_path.name}.", suffix=".tmp", dir=full_path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for start in range(0, len(content), WRITE_CHUNK_CHARS):
+                chunk = content[start:start + WRITE_CHUNK_CHARS].encode('utf-8')
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            if DURABILITY_MODE in ("fsync-file", "fsync-file+dir"):
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size, digest.hexdigest()
+
+async def sync_filesystem(*changed_dirs):
+    """
+    Apply the configured DURABILITY_MODE after a file operation. File contents are
+    already fsynced by atomic_write_text, so only the parent directories of
+    changed entries (fsync-file+dir) or the whole host (global) remain.
+    """
+    try:
+        if DURABILITY_MODE == "fsync-file+dir":
+            for directory in set(changed_dirs):
+                await asyncio.to_thread(fsync_directory, directory)
+        elif DURABILITY_MODE == "global":
+            await asyncio.to_thread(sync_host)
+            logger.info("File system synced")
     except Exception as e:
         logger.error(f"Error syncing file system: {str(e)}", exc_info=True)
 
@@ -156,44 +263,289 @@ async def retry_file_operation(operation, *args, max_attempts=5, delay=0.5, **kw
             await asyncio.sleep(delay)
             
 async def encode_image_to_base64(image_data):
+    """
+    Base64 of an image (file path or bytes) prepared for the model by
+    image_pipeline; the media type may be JPEG, PNG or WebP.
+    """
     try:
         logger.debug(f"Encoding image, data type: {type(image_data)}")
-        
-        # Open the image
         if isinstance(image_data, str):  # If it's a file path
-            logger.debug("Image data is a file path")
-            img = Image.open(image_data)
-        else:  # If it's binary data
-            logger.debug("Image data is binary")
-            img = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if it's not already (handles RGBA, CMYK, etc.)
-        if img.mode not in ('RGB', 'L'):
-            img = img.convert('RGB')
-        
-        # Save as JPEG
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='JPEG', quality=85)
-        encoded = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-        
+            image_data = await asyncio.to_thread(Path(image_data).read_bytes)
+        prepared = await prepare_image_async(image_data)
+        encoded = base64.b64encode(prepared.data).decode('utf-8')
         logger.debug(f"Image encoded successfully, length: {len(encoded)}")
         return encoded
     except Exception as e:
         logger.error(f"Error encoding image: {str(e)}", exc_info=True)
         return f"Error encoding image: {str(e)}"
 
-async def perform_search(query: str) -> str:
+class SearchError(Exception):
+    """
+    A search provider could not be reached or returned an unusable response.
+    """
+
+
+class SearchResult(BaseModel):
+    title: str
+    url: str
+    snippet: str = ""
+    score: Optional[float] = None
+    provider: str
+
+
+# Query parameters that only track where a click came from: utm_* by prefix, the rest by exact
+# name so that e.g. refId or referrer, which can select a page, are kept
+_TRACKING_PREFIXES = ("utm_",)
+_TRACKING_PARAMS = {"fbclid", "gclid", "ref", "ref_src"}
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in _TRACKING_PARAMS or name.startswith(_TRACKING_PREFIXES)
+
+def normalize_url(url: str) -> str:
+    """
+    Key under which two links to the same page compare equal: scheme, "www.",
+    fragment, trailing slash and tracking parameters are ignored.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if not _is_tracking_param(k)])
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+def dedupe_results(results: List[SearchResult]) -> List[SearchResult]:
+    """
+    Drop results whose URL was already seen, keeping the first (highest ranked) one.
+    """
+    seen = set()
+    unique = []
+    for result in results:
+        key = normalize_url(result.url)
+        if key not in seen:
+            seen.add(key)
+            unique.append(result)
+    return unique
+
+def _clean_text(text: Optional[str]) -> str:
+    return " ".join((text or "").split())
+
+def _shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:max(limit - 3, 0)].rstrip() + "..."
+
+def render_search_results(results: List[SearchResult], token_budget: int = SEARCH_RESULTS_TOKEN_BUDGET,
+                          snippet_chars: int = SEARCH_SNIPPET_CHARS) -> str:
     """
-    Perform a search using the configured search provider.
+    Compact plain-text listing of results for the model: title, URL and a
+    shortened snippet per result, stopping once token_budget is reached.
     """
-    if SEARCH_PROVIDER == "SEARXNG":
-        return await searxng_search(query)
-    elif SEARCH_PROVIDER == "TAVILY":
-        return await tavily_search(query)
+    if not results:
+        return "No results found."
+    lines = []
+    used = 0
+    for index, result in enumerate(results, 1):
+        block = f"{index}. {result.title}\n{result.url}"
+        if result.snippet:
+            block += f"\n{_shorten(result.snippet, snippet_chars)}"
+        tokens = estimate_tokens(block)
+        if lines and used + tokens > token_budget:
+            lines.append(f"({len(results) - index + 1} more results omitted)")
+            break
+        lines.append(block)
+        used += tokens
+    return "\n\n".join(lines)
+
+
+class SearchCache:
+    """
+    Search results keyed by provider, result limit and normalised query.
+    Values must be JSON serialisable. Entries expire after ttl seconds and the
+    least recently used ones are dropped beyond max_entries. With a backend,
+    results are also written to it (the SQLite state backend keeps them on disk
+    and shares them between workers). Concurrent lookups of the same key share
+    one provider request. Failed lookups raise and are never cached. Hits,
+    misses, coalesced lookups and evictions are counted in metrics under
+    metrics_prefix, so caches reused for other data keep their own counters.
+    """
+
+    NAMESPACE = "search_results"
+    METRICS_PREFIX = "search_cache"
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+                 backend: Optional[StateBackend] = None, namespace: str = NAMESPACE,
+                 metrics_prefix: str = METRICS_PREFIX):
+        self.ttl = ttl
+        self.namespace = namespace
+        self.metrics_prefix = metrics_prefix
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._last_purge = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(query: str, provider: str, limit: int) -> str:
+        normalized = " ".join(query.lower().split())
+        return f"{provider}:{limit}:{normalized}"
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.increment(f"{self.metrics_prefix}_evictions")
+
+    async def _lookup(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+        if self.backend is not None:
+            stored = await asyncio.to_thread(self.backend.get, self.namespace, key)
+            if stored and stored["expires_at"] > now:
+                self._remember(key, stored["expires_at"], stored["value"])
+                return stored["value"]
+        return None
+
+    async def _store(self, key: str, value: Any):
+        now = time.time()
+        self._remember(key, now + self.ttl, value)
+        if self.backend is None:
+            return
+        try:
+            await asyncio.to_thread(self.backend.put, self.namespace, key, {"expires_at": now + self.ttl, "value": value})
+            if now - self._last_purge > self.ttl:
+                self._last_purge = now
+                await asyncio.to_thread(self.backend.purge, self.namespace, now - self.ttl)
+        except Exception as e:
+            logger.error(f"Error persisting search cache entry: {str(e)}", exc_info=True)
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await fetch()
+            await self._store(key, result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if self.ttl <= 0:
+            return await fetch()
+        cached = await self._lookup(key)
+        if cached is not None:
+            metrics.increment(f"{self.metrics_prefix}_hits")
+            return cached
+        task = self._in_flight.get(key)
+        if task is not None:
+            metrics.increment(f"{self.metrics_prefix}_coalesced")
+        else:
+            metrics.increment(f"{self.metrics_prefix}_misses")
+            task = asyncio.create_task(self._fetch_and_store(key, fetch))
+            self._in_flight[key] = task
+        # Shielded so a cancelled caller does not cancel the request others are waiting on
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "in_flight": len(self._in_flight), "persistent": self.backend is not None}
+
+
+search_cache = SearchCache(backend=state_backend if SEARCH_CACHE_PERSIST else None)
+
+def configured_search_providers() -> List[str]:
+    """
+    Providers that can be queried, the configured SEARCH_PROVIDER first.
+    """
+    available = [name for name, configured in (("SEARXNG", SEARXNG_URL), ("TAVILY", TAVILY_API_KEY)) if configured]
+    return sorted(available, key=lambda name: name != SEARCH_PROVIDER)
+
+async def hedged_search(query: str, providers: List[str], delay: float = SEARCH_HEDGE_DELAY) -> List[SearchResult]:
+    """
+    Query providers in order, starting the next one when the running ones take
+    longer than delay seconds, fail or find nothing. The first non-empty result
+    list wins and the other requests are cancelled. Once a provider has
+    answered, even with nothing, later failures are only logged; when every
+    provider failed the last error is raised.
+    """
+    waiting = list(providers)
+    pending = set()
+    names = {}
+    error = None
+    answered = False
+
+    def launch():
+        name = waiting.pop(0)
+        task = asyncio.create_task(SEARCH_FUNCTIONS[name](query))
+        names[task] = name
+        pending.add(task)
+
+    launch()
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=delay if waiting else None,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    results = task.result()
+                except SearchError as e:
+                    if answered:
+                        logger.warning(f"{names[task]} search failed after another provider answered: {str(e)}")
+                    else:
+                        error = e
+                    continue
+                answered = True
+                if results:
+                    metrics.increment(f"search_hedge_wins_{names[task].lower()}")
+                    return results
+            if waiting:
+                launch()
+        if not answered and error is not None:
+            raise error
+        return []
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def search_results(query: str) -> List[SearchResult]:
+    """
+    Results from the configured search provider, or every configured provider
+    with SEARCH_HEDGED, deduplicated by URL. Repeated queries are served from
+    search_cache. Raises SearchError when the provider fails.
+    """
+    if SEARCH_HEDGED and len(configured_search_providers()) > 1:
+        providers = configured_search_providers()
+        provider = "HEDGED"
+        search = lambda: hedged_search(query, providers)
+    elif SEARCH_PROVIDER in SEARCH_FUNCTIONS:
+        provider = SEARCH_PROVIDER
+        search = lambda: SEARCH_FUNCTIONS[SEARCH_PROVIDER](query)
     else:
-        return f"Error: Unknown search provider '{SEARCH_PROVIDER}'"
+        raise SearchError(f"Unknown search provider '{SEARCH_PROVIDER}'")
+
+    async def fetch():
+        return [result.model_dump() for result in dedupe_results(await search())]
 
-async def searxng_search(query: str) -> str:
+    key = SearchCache.key(query, provider, SEARCH_RESULTS_LIMIT)
+    return [SearchResult(**result) for result in await search_cache.get_or_fetch(key, fetch)]
+
+async def perform_search(query: str) -> str:
+    """
+    Perform a web search and render the results compactly for the model.
+    """
+    try:
+        return render_search_results(await search_results(query))
+    except SearchError as e:
+        return f"Error performing search: {str(e)}"
+
+async def searxng_search(query: str) -> List[SearchResult]:
     """
     Perform a search using the local SearXNG instance.
     """
@@ -201,98 +553,79 @@ async def searxng_search(query: str) -> str:
         "q": query,
         "format": "json"
     }
-    headers = {
-        "User-Agent": "ClaudePlus/1.0"
-    }
+    start = time.perf_counter()
     try:
-        # Use asyncio to run the requests.get in a separate thread
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None, 
-            lambda: requests.get(SEARXNG_URL, params=params, headers=headers, timeout=20)
-        )
+        response = await search_http_client.get(SEARXNG_URL, params=params, timeout=SEARXNG_TIMEOUT)
         response.raise_for_status()
-        results = response.json()
-        
-        # Process and format the results
-        formatted_results = []
-        for result in results.get('results', [])[:SEARCH_RESULTS_LIMIT]:
-            formatted_results.append(f"**{result['title']}**\n[Link]({result['url']})\n*{result.get('content', 'No snippet available')}*\n")
-        
-        return "\n\n".join(formatted_results) if formatted_results else "No results found."
-    except requests.RequestException as e:
-        return f"Error performing SearXNG search: {str(e)}"
+        results = response.json().get('results', [])
+    except (httpx.HTTPError, ValueError) as e:
+        metrics.increment("search_errors_searxng")
+        raise SearchError(f"SearXNG search failed: {str(e)}") from e
+    finally:
+        metrics.observe("search_searxng_seconds", time.perf_counter() - start)
+
+    return [
+        SearchResult(
+            title=_clean_text(result.get('title')) or urlparse(result['url']).netloc,
+            url=result['url'],
+            snippet=_clean_text(result.get('content')),
+            score=result.get('score'),
+            provider="searxng"
+        )
+        for result in results[:SEARCH_RESULTS_LIMIT] if result.get('url')
+    ]
 
-async def tavily_search(query: str) -> str:
+async def tavily_search(query: str) -> List[SearchResult]:
     """
-    Perform a search using Tavily.
+    Perform a search using the Tavily search API.
     """
+    payload = {
+        "query": query,
+        "search_depth": "advanced",
+        "max_results": SEARCH_RESULTS_LIMIT
+    }
+    start = time.perf_counter()
     try:
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: tavily_client.get_search_context(query, search_depth="advanced", max_results=5)
+        response = await search_http_client.post(
+            f"{TAVILY_API_URL}/search", json=payload,
+            headers={"Authorization": f"Bearer {TAVILY_API_KEY}"}, timeout=TAVILY_TIMEOUT
         )
-        logger.debug(f"Tavily raw response: {response}")
-        if isinstance(response, str):
-            try:
-                results = json.loads(response)
-            except json.JSONDecodeError:
-                results = [response]
-        elif isinstance(response, (list, dict)):
-            results = response if isinstance(response, list) else [response]
-        else:
-            results = [response]
-        
-        # If results are individual characters, join them
-        if all(isinstance(r, str) and len(r) == 1 for r in results):
-            joined_text = ''.join(results)
-            try:
-                parsed_json = json.loads(joined_text)
-                if isinstance(parsed_json, list):
-                    results = parsed_json
-                else:
-                    results = [parsed_json]
-            except json.JSONDecodeError:
-                results = [joined_text]
-        
-        formatted_results = []
-        for result in results:
-            if isinstance(result, (int, float)):
-                formatted_results.append(f"<div class='search-result'><p>Numeric result: {result}</p></div>")
-            elif isinstance(result, str):
-                try:
-                    result_dict = json.loads(result)
-                    url = result_dict.get('url', 'No URL')
-                    content = result_dict.get('content', 'No content')
-                    title = result_dict.get('title', urlparse(url).netloc or "No title")
-                    formatted_results.append(f"<div class='search-result'><h3><a href='{url}' target='_blank'>{title}</a></h3><p>{content}</p></div>")
-                except json.JSONDecodeError:
-                    formatted_results.append(f"<div class='search-result'><p>Text result: {result}</p></div>")
-            elif isinstance(result, dict):
-                url = result.get('url', 'No URL')
-                content = result.get('content', 'No content')
-                title = result.get('title', urlparse(url).netloc or "No title")
-                formatted_results.append(f"<div class='search-result'><h3><a href='{url}' target='_blank'>{title}</a></h3><p>{content}</p></div>")
-            else:
-                formatted_results.append(f"<div class='search-result'><p>Unexpected result type: {type(result)}</p></div>")
-        
-        return "\n".join(formatted_results) if formatted_results else "<div class='search-result'><p>No results found.</p></div>"
-    except Exception as e:
+        response.raise_for_status()
+        results = response.json().get("results", [])
+        logger.debug(f"Tavily returned {len(results)} results")
+    except (httpx.HTTPError, ValueError) as e:
+        metrics.increment("search_errors_tavily")
         logger.error(f"Error performing Tavily search: {str(e)}", exc_info=True)
-        return f"Error performing Tavily search: {str(e)}"
+        raise SearchError(f"Tavily search failed: {str(e)}") from e
+    finally:
+        metrics.observe("search_tavily_seconds", time.perf_counter() - start)
+
+    return [
+        SearchResult(
+            title=_clean_text(result.get('title')) or urlparse(result['url']).netloc,
+            url=result['url'],
+            snippet=_clean_text(result.get('content')),
+            score=result.get('score'),
+            provider="tavily"
+        )
+        for result in results[:SEARCH_RESULTS_LIMIT] if result.get('url')
+    ]
+
+SEARCH_FUNCTIONS: Dict[str, Callable[[str], Awaitable[List[SearchResult]]]] = {
+    "SEARXNG": searxng_search,
+    "TAVILY": tavily_search
+}
 
 async def create_folder(path: str) -> str:
     try:
         logger.debug(f"Creating folder at path: {path}")
         full_path = get_safe_path(path)
         full_path.mkdir(parents=True, exist_ok=True)
-        await sync_filesystem()
+        await sync_filesystem(full_path.parent)
         if not full_path.exists():
             raise FileNotFoundError(f"Failed to create folder: {full_path}")
         
-        rel_path = str(full_path.relative_to(PROJECTS_DIR)).replace(os.sep, '/')
-        await update_project_state(rel_path, is_folder=True)
+        await update_project_state(to_state_path(full_path), is_folder=True)
         
         logger.info(f"Folder created and verified: {full_path}")
         return f"Folder created: {full_path}"
@@ -304,39 +637,116 @@ async def create_file(path: str, content: str = "") -> str:
     try:
         logger.debug(f"Attempting to create file at path: {path}")
         
-        # Normalize the path and make it relative to PROJECTS_DIR
-        normalized_path = os.path.normpath(path).lstrip(os.sep).replace('\\', '/')
-        full_path = Path(PROJECTS_DIR) / normalized_path
-        
-        logger.debug(f"Normalized path: {normalized_path}")
+        # Resolve the path inside the current project root
+        full_path = get_safe_path(path)
         logger.debug(f"Full path: {full_path}")
 
         # Ensure the directory exists
         full_path.parent.mkdir(parents=True, exist_ok=True)
 
-        # Write content using asyncio.to_thread
-        await asyncio.to_thread(lambda: full_path.write_text(content, encoding='utf-8'))
+        # Write atomically in a worker thread; the hash is computed while writing
+        file_size, sha256 = await asyncio.to_thread(atomic_write_text, full_path, content)
+        logger.info(f"File created: {full_path} (Size: {file_size} bytes, SHA-256: {sha256})")
 
-        # Verify file exists and content is correct
-        if not full_path.exists():
-            raise FileNotFoundError(f"Failed to create file: {full_path}")
+        await sync_filesystem(full_path.parent)
+        await update_project_state(to_state_path(full_path), is_folder=False, size=file_size, hash=sha256)
 
-        # Read content using asyncio.to_thread to verify
-        written_content = await asyncio.to_thread(lambda: full_path.read_text(encoding='utf-8'))
+        return f"File created: {full_path} (Size: {file_size} bytes, SHA-256: {sha256})"
+    except Exception as e:
+        logger.error(f"Error creating file: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error creating file: {str(e)}")
 
-        if written_content != content:
-            raise ValueError(f"File content verification failed for {full_path}")
+class BatchResult(NamedTuple):
+    path: str
+    status: str               # created, written, exists or error
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    error: Optional[str] = None
 
-        file_size = full_path.stat().st_size
-        logger.info(f"File created and verified: {full_path} (Size: {file_size} bytes)")
 
-        await sync_filesystem()
-        await update_project_state(str(full_path.relative_to(PROJECTS_DIR)), is_folder=False)
+def _batch_write_sync(folders: List[str], files: List[dict], overwrite: bool):
+    """
+    Create folders and write files in one pass. Returns the per-entry results,
+    the (full path, is_folder, size, hash) changes for the project state and
+    the folders whose entries changed.
+    """
+    results: List[BatchResult] = []
+    changes: List[Tuple[Path, bool, Optional[int], Optional[str]]] = []
+    changed_dirs = set()
+
+    def make_dirs(full_path: Path):
+        missing = []
+        while not full_path.exists():
+            missing.append(full_path)
+            full_path = full_path.parent
+        for folder in reversed(missing):
+            folder.mkdir(exist_ok=True)
+            changes.append((folder, True, None, None))
+            changed_dirs.add(folder.parent)
+        return bool(missing)
+
+    # Parents before children, so every folder is recorded once
+    for path in sorted(folders, key=lambda p: p.count("/")):
+        try:
+            created = make_dirs(get_safe_path(path))
+            results.append(BatchResult(path, "created" if created else "exists"))
+        except Exception as e:
+            results.append(BatchResult(path, "error", error=str(e)))
+
+    for item in files:
+        path = item.get("path", "")
+        try:
+            full_path = get_safe_path(path)
+            exists = full_path.exists()
+            if exists and not item.get("overwrite", overwrite):
+                results.append(BatchResult(path, "exists"))
+                continue
+            make_dirs(full_path.parent)
+            file_size, sha256 = atomic_write_text(full_path, item.get("content", ""))
+            changes.append((full_path, False, file_size, sha256))
+            changed_dirs.add(full_path.parent)
+            results.append(BatchResult(path, "written" if exists else "created", file_size, sha256))
+        except Exception as e:
+            results.append(BatchResult(path, "error", error=str(e)))
+    return results, changes, changed_dirs
+
+
+async def batch_write(folders: Optional[List[str]] = None, files: Optional[List[dict]] = None,
+                      overwrite: bool = False) -> List[BatchResult]:
+    """
+    Create several folders and files ({"path", "content", "overwrite"}) in one
+    call, with a single project state update and a single durability flush.
+    Existing files are kept unless overwrite is set. An entry that fails does
+    not stop the others; its result has status "error".
+    """
+    folders, files = folders or [], files or []
+    if not folders and not files:
+        raise ValueError("Nothing to write: folders and files are both empty")
+    results, changes, changed_dirs = await asyncio.to_thread(_batch_write_sync, folders, files, overwrite)
+    await sync_filesystem(*changed_dirs)
+    await update_project_state_batch([(to_state_path(full_path), is_folder, size, sha256)
+                                      for full_path, is_folder, size, sha256 in changes])
+    metrics.increment("batch_writes")
+    metrics.increment("batch_write_entries", len(results))
+    failed = sum(1 for result in results if result.status == "error")
+    logger.info(f"Batch write: {len(results) - failed} entries done, {failed} failed")
+    return results
+
+
+def format_batch_results(results: List[BatchResult]) -> str:
+    """
+    One line per entry, for the tool result.
+    """
+    lines = []
+    for result in results:
+        if result.status == "error":
+            lines.append(f"error {result.path}: {result.error}")
+        elif result.size is not None:
+            lines.append(f"{result.status} {result.path} ({result.size} bytes, SHA-256: {result.sha256})")
+        else:
+            lines.append(f"{result.status} {result.path}")
+    return "\n".join(lines)
 
-        return f"File created: {full_path} (Size: {file_size} bytes)"
-    except Exception as e:
-        logger.error(f"Error creating file: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error creating file: {str(e)}")
 
 async def write_to_file(path: str, content: str) -> str:
     try:
@@ -346,82 +756,174 @@ async def write_to_file(path: str, content: str) -> str:
         # Ensure the directory exists
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
         
-        # Write content using asyncio.to_thread
-        await asyncio.to_thread(lambda: open(full_path, 'w', encoding='utf-8').write(content))
-        
-        # Verify file exists and content is correct
-        if not os.path.exists(full_path):
-            raise FileNotFoundError(f"Failed to create file: {full_path}")
-        
-        # Read content using asyncio.to_thread
-        written_content = await asyncio.to_thread(lambda: open(full_path, 'r', encoding='utf-8').read())
+        # Write atomically in a worker thread; the hash is computed while writing
+        file_size, sha256 = await asyncio.to_thread(atomic_write_text, full_path, content)
+        logger.info(f"Content written to file: {full_path} (Size: {file_size} bytes, SHA-256: {sha256})")
         
-        if written_content != content:
-            raise ValueError(f"File content verification failed for {full_path}")
+        await sync_filesystem(full_path.parent)
+        await update_project_state(to_state_path(full_path), is_folder=False, size=file_size, hash=sha256)
         
-        file_size = os.path.getsize(full_path)
-        logger.info(f"Content written to file and verified: {full_path} (Size: {file_size} bytes)")
-        
-        await sync_filesystem()
-        await update_project_state(path, is_folder=False)
-        
-        return f"Content written to file: {full_path} (Size: {file_size} bytes)"
+        return f"Content written to file: {full_path} (Size: {file_size} bytes, SHA-256: {sha256})"
     except Exception as e:
         logger.error(f"Error writing to file: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error writing to file: {str(e)}")
 
-async def read_file(path: str) -> str:
+def _edit_file_sync(full_path: Path, edits: Optional[List[dict]], patch: Optional[str],
+                    expected_sha256: Optional[str]):
+    # Stat the open file before reading it, so a write that lands in between makes the
+    # check below fail instead of matching the new file
+    with open(full_path, "rb") as f:
+        before = os.fstat(f.fileno())
+        data = f.read()
+    old_sha256 = hashlib.sha256(data).hexdigest()
+    if expected_sha256 and expected_sha256 != old_sha256:
+        raise PatchConflict(f"The file changed since it was read (SHA-256 is {old_sha256}), read it again")
     try:
-        full_path = get_safe_path(path)
-        if not full_path.is_file():
-            raise FileNotFoundError(f"File not found: {full_path}")
-        content = full_path.read_text()
-        logger.info(f"File read successfully: {full_path}")
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise ValueError(f"Not a UTF-8 text file: {full_path}")
+    new_text, changes = text, []
+    if patch:
+        new_text, changes = apply_unified_diff(new_text, patch)
+    if edits:
+        new_text, replaced = apply_replacements(new_text, edits)
+        changes += replaced
+    if new_text == text:
+        return len(data), old_sha256, changes
+    after = os.stat(full_path)
+    if (after.st_ino, after.st_mtime_ns, after.st_size) != (before.st_ino, before.st_mtime_ns, before.st_size):
+        raise PatchConflict("The file was modified while the edit was applied, read it again")
+    file_size, sha256 = atomic_write_text(full_path, new_text)
+    return file_size, sha256, changes
+
+
+async def edit_file(path: str, edits: Optional[List[dict]] = None, patch: Optional[str] = None,
+                    expected_sha256: Optional[str] = None) -> str:
+    """
+    Change part of an existing file with search/replace edits and/or a unified
+    diff. All edits are applied in memory first and the file is written
+    atomically only when every one of them matched, so a conflict leaves it
+    untouched. Raises PatchConflict for edits that do not match.
+    """
+    if not edits and not patch:
+        raise ValueError("Either edits or patch is required")
+    full_path = get_safe_path(path)
+    if not full_path.is_file():
+        raise FileNotFoundError(f"File not found: {full_path}")
+    try:
+        file_size, sha256, changes = await asyncio.to_thread(_edit_file_sync, full_path, edits, patch, expected_sha256)
+    except PatchConflict:
+        metrics.increment("file_edit_conflicts")
+        raise
+    metrics.increment("file_edits")
+    logger.info(f"File edited: {full_path} ({len(changes)} changes, Size: {file_size} bytes, SHA-256: {sha256})")
+
+    await sync_filesystem(full_path.parent)
+    await update_project_state(to_state_path(full_path), is_folder=False, size=file_size, hash=sha256)
+    if not changes:
+        return f"No changes to {full_path}, the edits leave its content as it is"
+    summary = "\n".join(str(change) for change in changes)
+    return f"File edited: {full_path} (Size: {file_size} bytes, SHA-256: {sha256})\nChanged:\n{summary}"
+
+
+async def read_file_slice(path: str, offset: int = 0, limit: Optional[int] = None,
+                          start_line: Optional[int] = None, end_line: Optional[int] = None) -> FileSlice:
+    """
+    A byte or line range of a file, see file_reader.read_slice. Raises
+    ValueError for invalid ranges or paths outside the project and
+    FileNotFoundError for missing files.
+    """
+    full_path = get_safe_path(path)
+    if not full_path.is_file():
+        raise FileNotFoundError(f"File not found: {full_path}")
+    file_slice = await asyncio.to_thread(read_slice, str(full_path), offset, limit, start_line, end_line)
+    metrics.increment("file_reads")
+    metrics.increment("file_read_bytes", len(file_slice.data))
+    logger.info(f"File read successfully: {full_path} (bytes {file_slice.start}-{file_slice.end} of {file_slice.size})")
+    return file_slice
+
+
+async def read_file(path: str, offset: int = 0, limit: Optional[int] = None,
+                    start_line: Optional[int] = None, end_line: Optional[int] = None) -> str:
+    try:
+        file_slice = await read_file_slice(path, offset, limit, start_line, end_line)
+        content = file_slice.text
+        if file_slice.start_line is not None and (file_slice.start_line > 1 or file_slice.truncated
+                                                  or file_slice.end_line < file_slice.total_lines):
+            content += f"\n[Lines {file_slice.start_line}-{file_slice.end_line} of {file_slice.total_lines}]"
+        elif file_slice.start_line is None and (file_slice.start > 0 or file_slice.end < file_slice.size):
+            content += f"\n[Bytes {file_slice.start}-{file_slice.end} of {file_slice.size}]"
+        if file_slice.truncated:
+            content += " Output was limited, read further with offset/limit or start_line/end_line."
         return content
     except Exception as e:
         logger.error(f"Error reading file: {str(e)}", exc_info=True)
         return f"Error reading file: {str(e)}"
 
 
-async def list_files(path: str = ".") -> list:
+def format_listing_entry(entry: ListingEntry) -> dict:
+    return {
+        "name": entry.path,
+        "isDirectory": entry.is_dir,
+        "size": entry.size if entry.size is not None else "-",
+        "modifiedDate": datetime.fromtimestamp(entry.mtime).strftime('%m-%d %H:%M') if entry.mtime else "-"
+    }
+
+
+async def list_directory(path: str = ".", sort: str = "name", descending: bool = False, dirs_first: bool = True,
+                         pattern: Optional[str] = None, kind: Optional[str] = None, offset: int = 0,
+                         limit: Optional[int] = None, recursive: bool = False,
+                         max_depth: Optional[int] = None) -> dict:
+    """
+    One page of a folder listing read straight from disk, sorted and filtered
+    before it is sliced. Raises ValueError for invalid arguments or paths
+    outside the project and FileNotFoundError for missing folders.
+    """
+    if kind not in (None, "file", "dir"):
+        raise ValueError(f"Invalid type '{kind}', expected 'file' or 'dir'")
+    if offset < 0 or (limit is not None and limit < 0) or (max_depth is not None and max_depth < 1):
+        raise ValueError("offset, limit and max_depth must not be negative, max_depth must be at least 1")
+    full_path = get_safe_path(path)
+    if not full_path.is_dir():
+        raise FileNotFoundError(f"Directory not found: {full_path}")
+
+    def scan():
+        entries, truncated = scan_listing(str(full_path), recursive, max_depth, pattern, kind)
+        return sort_listing(entries, sort, descending, dirs_first), truncated
+
+    entries, truncated = await asyncio.to_thread(scan)
+    metrics.increment("file_listings")
+    page = entries[offset:] if limit is None else entries[offset:offset + limit]
+    logger.info(f"Listed {len(page)} of {len(entries)} entries in {full_path}")
+    return {"entries": page, "total": len(entries), "truncated": truncated}
+
+
+async def list_files(path: str = ".", **options) -> list:
+    """
+    Entries of a folder as name, isDirectory, size and modifiedDate. options
+    are those of list_directory; recursive listings name entries by their
+    path below the folder.
+    """
     try:
-        full_path = get_safe_path(path)
-        files = []
-        for item in full_path.iterdir():
-            rel_path = str(item.relative_to(PROJECTS_DIR)).replace(os.sep, '/')
-            file_info = {
-                "name": item.name,
-                "isDirectory": item.is_dir(),
-                "size": item.stat().st_size if item.is_file() else "-",
-                "modifiedDate": datetime.fromtimestamp(item.stat().st_mtime).strftime('%m-%d %H:%M')
-            }
-            files.append(file_info)
-            
-            # Update project_state without overwriting
-            if item.is_dir():
-                project_state["folders"].add(rel_path)
-            else:
-                project_state["files"].add(rel_path)
-        
-        logger.info(f"Listed files in {full_path}")
-        logger.debug(f"Current project state: {project_state}")
-        return files
+        listing = await list_directory(path, **options)
+        return [format_listing_entry(entry) for entry in listing["entries"]]
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
-    
+
 async def delete_file(path: str) -> str:
     try:
         full_path = get_safe_path(path)
+        is_folder = full_path.is_dir()
         if full_path.is_file():
             full_path.unlink()
-        elif full_path.is_dir():
+        elif is_folder:
             full_path.rmdir()
         else:
             raise FileNotFoundError(f"File or directory not found: {full_path}")
         logger.info(f"Deleted: {full_path}")
-        await sync_filesystem()
-        await update_project_state(path, is_folder=full_path.is_dir(), is_delete=True)
+        await sync_filesystem(full_path.parent)
+        await update_project_state(to_state_path(full_path), is_folder=is_folder, is_delete=True)
         return f"Deleted: {full_path}"
     except Exception as e:
         logger.error(f"Error deleting file: {str(e)}", exc_info=True)
@@ -0,0 +1,265 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import STATE_BACKEND, STATE_DB_PATH, STATE_POLL_INTERVAL, DURABILITY_MODE
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# How long change records are kept for other processes to pick up
+CHANGE_RETENTION = 300
+
+
+class StateBackend:
+    """
+    Namespaced key/value store for state shared between worker processes
+    (sessions, project state, automode jobs). Values are JSON documents.
+    Callbacks registered with subscribe() are called on the event loop when
+    another process changes a key in that namespace, while watch() runs.
+    """
+
+    def __init__(self):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {}
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def put(self, namespace: str, key: str, value: Any):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        raise NotImplementedError
+
+    def purge(self, namespace: str, older_than: float) -> List[str]:
+        """
+        Delete keys in namespace last written before the older_than timestamp.
+        """
+        raise NotImplementedError
+
+    def poll_changes(self) -> List[Tuple[str, str]]:
+        """
+        (namespace, key) pairs changed by other processes since the last poll.
+        """
+        return []
+
+    def close(self):
+        pass
+
+    def subscribe(self, namespace: str, callback: Callable[[str], None]):
+        self._subscribers.setdefault(namespace, []).append(callback)
+
+    def notify(self, namespace: str, key: str):
+        for callback in self._subscribers.get(namespace, []):
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"Error handling state change {namespace}/{key}: {str(e)}", exc_info=True)
+
+    async def watch(self, interval: float = STATE_POLL_INTERVAL):
+        """
+        Deliver changes made by other processes to the subscribers until cancelled.
+        """
+        while True:
+            try:
+                changes = await asyncio.to_thread(self.poll_changes)
+                for namespace, key in changes:
+                    self.notify(namespace, key)
+                if changes:
+                    metrics.increment("state_backend_notifications", len(changes))
+            except Exception as e:
+                logger.error(f"Error polling state backend: {str(e)}", exc_info=True)
+            await asyncio.sleep(interval)
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Process local backend, for a single worker or tests. Nothing survives a restart.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._data: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+        return None if entry is None else json.loads(entry[0])
+
+    def put(self, namespace, key, value):
+        with self._lock:
+            self._data[(namespace, key)] = (json.dumps(value, default=str), time.time())
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def items(self, namespace):
+        with self._lock:
+            entries = [(k, v[0]) for (ns, k), v in self._data.items() if ns == namespace]
+        return [(k, json.loads(v)) for k, v in sorted(entries)]
+
+    def purge(self, namespace, older_than):
+        with self._lock:
+            expired = [k for (ns, k), v in self._data.items() if ns == namespace and v[1] < older_than]
+            for key in expired:
+                del self._data[(namespace, key)]
+        return expired
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    SQLite database in WAL mode, so readers in any process never block the
+    writer. Every write also appends to a changes table; other processes notice
+    new commits through PRAGMA data_version (no I/O when nothing changed) and
+    then read the change records written since their last poll.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        super().__init__()
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._last_seq = 0
+        self._last_prune = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={'OFF' if DURABILITY_MODE == 'none' else 'NORMAL'}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS changes ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "origin TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Only changes committed after this process started are delivered
+            self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            self._conn = conn
+            logger.info(f"State backend opened at {self.path}")
+        return self._conn
+
+    def _write(self, statements: List[Tuple[str, tuple]], namespace: str, keys: List[str]):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+                conn.executemany(
+                    "INSERT INTO changes (namespace, key, origin, created_at) VALUES (?, ?, ?, ?)",
+                    [(namespace, key, self.origin, now) for key in keys]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, namespace, key, value):
+        value = json.dumps(value, default=str)
+        self._write([(
+            "INSERT INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (namespace, key, value, time.time())
+        )], namespace, [key])
+
+    def delete(self, namespace, key):
+        self._write([("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))], namespace, [key])
+
+    def items(self, namespace):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, value FROM kv WHERE namespace = ? ORDER BY key", (namespace,)
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge(self, namespace, older_than):
+        with self._lock:
+            expired = [row[0] for row in self._connect().execute(
+                "SELECT key FROM kv WHERE namespace = ? AND updated_at < ?", (namespace, older_than)
+            )]
+        if expired:
+            self._write(
+                [("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)) for key in expired],
+                namespace, expired
+            )
+        return expired
+
+    def poll_changes(self):
+        with self._lock:
+            conn = self._connect()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return []
+            self._data_version = version
+            rows = conn.execute(
+                "SELECT seq, namespace, key, origin FROM changes WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+            if rows:
+                self._last_seq = rows[-1][0]
+            now = time.time()
+            if now - self._last_prune > 60:
+                self._last_prune = now
+                conn.execute("DELETE FROM changes WHERE created_at < ?", (now - CHANGE_RETENTION,))
+        # Several writes to one key since the last poll are delivered once
+        changes = dict.fromkeys((namespace, key) for _, namespace, key, origin in rows if origin != self.origin)
+        return list(changes)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_state_backend(kind: str = STATE_BACKEND, path: str = STATE_DB_PATH) -> StateBackend:
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SQLiteStateBackend(path)
+    raise ValueError(f"Unknown state backend '{kind}', expected sqlite or memory")
+
+
+# Shared by sessions, project state and automode jobs
+state_backend = create_state_backend()
@@ -0,0 +1,159 @@
+import sys
+import os
+import copy
+import asyncio
+from types import SimpleNamespace
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import agent_loop
+from agent_loop import run_agent_loop
+
+
+def _usage(input_tokens=10, output_tokens=5):
+    return SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                           cache_read_input_tokens=0, cache_creation_input_tokens=0)
+
+
+def _text(text):
+    return SimpleNamespace(type="text", text=text)
+
+
+def _tool_use(tool_id, name="read_file", tool_input=None):
+    return SimpleNamespace(type="tool_use", id=tool_id, name=name, input=tool_input or {"path": "a.txt"})
+
+
+def _response(stop_reason, *content, usage=None):
+    return SimpleNamespace(stop_reason=stop_reason, content=list(content), usage=usage or _usage())
+
+
+class FakeClient:
+    """
+    Stands in for async_anthropic_client and returns the given responses in order.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.messages = self
+
+    async def create(self, **params):
+        self.requests.append(params)
+        return self.responses.pop(0)
+
+
+def _run(monkeypatch, client, messages, **options):
+    async def fake_execute_tools(calls):
+        return [{"success": True, "result": f"ran {name}"} for name, _ in calls]
+
+    monkeypatch.setattr(agent_loop, "async_anthropic_client", client)
+    monkeypatch.setattr(agent_loop, "execute_tools", fake_execute_tools)
+
+    async def collect():
+        return [event async for event in run_agent_loop("system", messages, **options)]
+
+    return asyncio.run(collect())
+
+
+def _assert_tool_uses_answered(messages):
+    for index, message in enumerate(messages):
+        if message["role"] != "assistant" or isinstance(message["content"], str):
+            continue
+        ids = [block["id"] for block in message["content"] if block["type"] == "tool_use"]
+        if ids:
+            answered = [block["tool_use_id"] for block in messages[index + 1]["content"]]
+            assert answered == ids
+
+
+def test_tool_results_are_sent_back_until_end_turn(monkeypatch):
+    client = FakeClient(
+        _response("tool_use", _text("Reading"), _tool_use("t1")),
+        _response("end_turn", _text("Done")),
+    )
+    messages = [{"role": "user", "content": "read a.txt"}]
+    events = _run(monkeypatch, client, messages)
+
+    assert [event["type"] for event in events] == ["tool_start", "tool_result", "step", "step", "stop"]
+    assert events[-1]["reason"] == "end_turn" and events[-1]["steps"] == 2
+    assert [message["role"] for message in messages] == ["user", "assistant", "user", "assistant"]
+    assert messages[2]["content"][0] == {"type": "tool_result", "tool_use_id": "t1", "content": "ran read_file", "is_error": False}
+    # The second request carries the tool result
+    assert client.requests[1]["messages"][-1]["content"][0]["tool_use_id"] == "t1"
+    _assert_tool_uses_answered(messages)
+
+
+def test_cut_off_tool_use_is_not_stored(monkeypatch):
+    client = FakeClient(_response("max_tokens", _text("Let me"), _tool_use("t1")))
+    messages = [{"role": "user", "content": "read a.txt"}]
+    events = _run(monkeypatch, client, messages)
+
+    assert events[-1]["reason"] == "max_tokens"
+    assert "tool_start" not in [event["type"] for event in events]
+    assert messages[-1] == {"role": "assistant", "content": [{"type": "text", "text": "Let me"}]}
+
+    client = FakeClient(_response("stop_sequence", _tool_use("t2")))
+    _run(monkeypatch, client, messages)
+    assert messages[-1]["content"] == [{"type": "text", "text": "[Response stopped: stop_sequence]"}]
+    _assert_tool_uses_answered(messages)
+
+
+def test_max_steps_and_token_budget_stop_the_loop(monkeypatch):
+    client = FakeClient(*[_response("tool_use", _tool_use(f"t{i}")) for i in range(3)])
+    messages = [{"role": "user", "content": "loop"}]
+    events = _run(monkeypatch, client, messages, max_steps=2)
+    assert events[-1]["reason"] == "max_steps" and events[-1]["steps"] == 2
+    assert len(client.responses) == 1
+    _assert_tool_uses_answered(messages)
+
+    client = FakeClient(*[_response("tool_use", _tool_use(f"t{i}"), usage=_usage(600, 100)) for i in range(3)])
+    messages = [{"role": "user", "content": "loop"}]
+    events = _run(monkeypatch, client, messages, token_budget=1000)
+    assert events[-1]["reason"] == "token_budget" and events[-1]["steps"] == 2
+    assert events[-1]["usage"]["input_tokens"] == 1200
+    _assert_tool_uses_answered(messages)
+
+
+def _cache_markers(request):
+    blocks = list(request["tools"]) + (request["system"] if isinstance(request["system"], list) else [])
+    for message in request["messages"]:
+        if isinstance(message["content"], list):
+            blocks.extend(message["content"])
+    return sum(1 for block in blocks if "cache_control" in block)
+
+
+def test_build_request_cache_breakpoints(monkeypatch):
+    monkeypatch.setattr(agent_loop, "PROMPT_CACHING", True)
+    messages = [
+        {"role": "user", "content": "first question"},
+        {"role": "assistant", "content": [{"type": "text", "text": "answer"}]},
+        {"role": "user", "content": "second question"},
+    ]
+    stored = copy.deepcopy(messages)
+    request = agent_loop.build_request("system", messages, "project snapshot", max_tokens=100)
+
+    # The API accepts at most 4 breakpoints: tools, system, snapshot, newest message
+    assert _cache_markers(request) <= 4
+    assert [block["text"] for block in request["system"]] == ["system", "project snapshot"]
+    assert request["messages"][-1]["content"] == [
+        {"type": "text", "text": "second question", "cache_control": agent_loop.CACHE_CONTROL}]
+    assert request["messages"][:2] == messages[:2]
+    assert request["max_tokens"] == 100
+    assert messages == stored
+
+    # Block content is copied, not marked in place
+    messages.append({"role": "assistant", "content": [{"type": "text", "text": "more"}]})
+    stored = copy.deepcopy(messages)
+    request = agent_loop.build_request("system", messages)
+    assert _cache_markers(request) <= 3
+    assert request["messages"][-1]["content"][-1]["cache_control"] == agent_loop.CACHE_CONTROL
+    assert messages == stored
+
+
+def test_build_request_without_prompt_caching(monkeypatch):
+    monkeypatch.setattr(agent_loop, "PROMPT_CACHING", False)
+    messages = [{"role": "user", "content": "question"}]
+    request = agent_loop.build_request("system", messages, "project snapshot")
+    assert request["system"] == "system\n\nproject snapshot"
+    assert request["messages"] is messages
+    assert _cache_markers(request) == 0
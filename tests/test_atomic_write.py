@@ -0,0 +1,58 @@
+import sys
+import os
+import hashlib
+
+import pytest
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shared_utils
+from shared_utils import atomic_write_text
+
+
+def test_size_hash_and_mode(tmp_path, monkeypatch):
+    path = tmp_path / "script.sh"
+    path.write_text("old")
+    os.chmod(path, 0o750)
+    # Several write chunks, with multi-byte characters
+    monkeypatch.setattr(shared_utils, "WRITE_CHUNK_CHARS", 4)
+    content = "#!/bin/sh\necho héllo wörld\n"
+
+    size, sha256 = atomic_write_text(path, content)
+    assert path.read_text(encoding="utf-8") == content
+    assert size == len(content.encode("utf-8"))
+    assert sha256 == hashlib.sha256(content.encode("utf-8")).hexdigest()
+    assert os.stat(path).st_mode & 0o7777 == 0o750
+    assert os.listdir(tmp_path) == ["script.sh"]
+
+
+def test_failed_write_leaves_old_file_and_no_temp_file(tmp_path, monkeypatch):
+    path = tmp_path / "data.txt"
+    path.write_text("original")
+    monkeypatch.setattr(shared_utils, "WRITE_CHUNK_CHARS", 4)
+
+    class Exploding(str):
+        # Fails while the third chunk is taken, after some bytes were written
+        calls = 0
+
+        def __getitem__(self, index):
+            Exploding.calls += 1
+            if Exploding.calls == 3:
+                raise OSError("disk full")
+            return str.__getitem__(self, index)
+
+    with pytest.raises(OSError, match="disk full"):
+        atomic_write_text(path, Exploding("new content that is long"))
+    assert path.read_text() == "original"
+    assert os.listdir(tmp_path) == ["data.txt"]
+
+    def failing_replace(src, dst):
+        raise OSError("rename failed")
+
+    # The rename fails: the complete temp file is removed too
+    monkeypatch.setattr(shared_utils.os, "replace", failing_replace)
+    with pytest.raises(OSError, match="rename failed"):
+        atomic_write_text(path, "new")
+    assert path.read_text() == "original"
+    assert os.listdir(tmp_path) == ["data.txt"]
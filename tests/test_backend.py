@@ -1,6 +1,7 @@
 import pytest
 import sys
 import os
+from types import SimpleNamespace
 
 # Add the project root directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -33,5 +34,148 @@ def test_import_config():
     except ImportError:
         pytest.fail("Failed to import config module")
 
+def test_import_metrics():
+    try:
+        import metrics
+        assert True, "Import of metrics successful"
+    except ImportError:
+        pytest.fail("Failed to import metrics module")
+
+def test_import_agent_loop():
+    try:
+        import agent_loop
+        assert True, "Import of agent_loop successful"
+    except ImportError:
+        pytest.fail("Failed to import agent_loop module")
+
+def test_import_sessions():
+    try:
+        import sessions
+        assert True, "Import of sessions successful"
+    except ImportError:
+        pytest.fail("Failed to import sessions module")
+
+
+# You can add more basic tests here as needed
+
+def test_isolated_sessions_cannot_reach_each_other(monkeypatch):
+    import asyncio
+    from fastapi.testclient import TestClient
+    import backend
+    import sessions
+    from state_backend import MemoryStateBackend
+
+    store = sessions.SessionStore(project_roots="isolated", backend=MemoryStateBackend())
+    monkeypatch.setattr(sessions, "session_store", store)
+    client = TestClient(backend.app)
+    session_a = {sessions.SESSION_HEADER: "session-a"}
+
+    response = client.post("/create_file", params={"path": "secret.txt", "content": "a's data"}, headers=session_a)
+    assert response.status_code == 200
+    assert client.get("/read_file", params={"path": "secret.txt"}, headers=session_a).json()["content"] == "a's data"
+    try:
+        # Without the header nothing of session-a is visible, not even through its folder
+        assert client.get("/read_file", params={"path": "secret.txt"}).status_code == 404
+        assert client.get("/read_file", params={"path": "sessions/session-a/secret.txt"}).status_code == 404
+        assert client.get("/read_file", params={"path": "../session-a/secret.txt"}).status_code == 400
+        listing = client.get("/list_files", params={"path": "."}).json()["files"]
+        assert [entry["name"] for entry in listing] == []
+    finally:
+        import shutil
+        for session_id in ("session-a", "default"):
+            asyncio.run(store.delete(session_id))
+            shutil.rmtree(store.root_for(session_id), ignore_errors=True)
+        if not os.listdir(os.path.join(store.projects_dir, "sessions")):
+            os.rmdir(os.path.join(store.projects_dir, "sessions"))
+
+
+class _FakeStream:
+    def __init__(self, response, deltas):
+        self.response = response
+        self.deltas = deltas
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def __aiter__(self):
+        for delta in self.deltas:
+            yield SimpleNamespace(type="text", text=delta)
+
+    async def get_final_message(self):
+        return self.response
+
+
+class _FakeStreamingClient:
+    """
+    Stands in for async_anthropic_client: each messages.stream() call streams
+    the next (deltas, response) pair.
+    """
+
+    def __init__(self, *turns):
+        self.turns = list(turns)
+        self.messages = self
+
+    def stream(self, **params):
+        deltas, response = self.turns.pop(0)
+        return _FakeStream(response, deltas)
+
+
+def test_chat_stream_events_and_metrics(monkeypatch):
+    import json
+    from fastapi.testclient import TestClient
+    import agent_loop
+    import backend
+    import metrics
+    import sessions
+    from state_backend import MemoryStateBackend
+
+    usage = SimpleNamespace(input_tokens=10, output_tokens=5, cache_read_input_tokens=0, cache_creation_input_tokens=0)
+    tool_use = SimpleNamespace(type="tool_use", id="tool-1", name="read_file", input={"path": "a.txt"})
+    client = _FakeStreamingClient(
+        (["Let me ", "look."], SimpleNamespace(stop_reason="tool_use", usage=usage,
+                                              content=[SimpleNamespace(type="text", text="Let me look."), tool_use])),
+        (["Done."], SimpleNamespace(stop_reason="end_turn", usage=usage,
+                                    content=[SimpleNamespace(type="text", text="Done.")])),
+    )
+
+    async def fake_execute_tools(calls):
+        return [{"success": True, "result": "file content"} for _ in calls]
+
+    async def no_sync():
+        return {}
+
+    async def no_snapshot(session):
+        return None
+
+    store = sessions.SessionStore(project_roots="shared", backend=MemoryStateBackend())
+    monkeypatch.setattr(sessions, "session_store", store)
+    monkeypatch.setattr(backend, "session_store", store)
+    monkeypatch.setattr(backend, "sync_project_state_with_fs", no_sync)
+    monkeypatch.setattr(backend, "build_project_snapshot", no_snapshot)
+    monkeypatch.setattr(agent_loop, "async_anthropic_client", client)
+    monkeypatch.setattr(agent_loop, "execute_tools", fake_execute_tools)
+    before = metrics.snapshot()
+
+    response = TestClient(backend.app).post("/chat/stream", json={"message": "What is in a.txt?"},
+                                            headers={sessions.SESSION_HEADER: "stream-test"})
+    assert response.status_code == 200
+    events = [json.loads(line[len("data: "):]) for line in response.text.split("\n\n") if line]
+
+    assert [event["event"] for event in events] == ["text", "text", "tool_start", "tool_result", "text", "end"]
+    assert "".join(event["content"] for event in events if event["event"] == "text") == "Let me look.Done."
+    assert events[2]["id"] == events[3]["id"] == "tool-1"
+    assert events[3]["result"] == "file content"
+    end = events[-1]
+    assert end["stop_reason"] == "end_turn" and end["steps"] == 2
+    assert end["usage"]["input_tokens"] == 20
+    assert 0 <= end["ttft"] <= end["total"]
 
-# You can add more basic tests here as needed
\ No newline at end of file
+    after = metrics.snapshot()
+    for name in ("chat_stream_ttft_seconds", "chat_stream_total_seconds"):
+        count = before["timings"].get(name, {}).get("count", 0)
+        assert after["timings"][name]["count"] == count + 1
+    assert after["counters"]["chat_stream_requests"] == before["counters"].get("chat_stream_requests", 0) + 1
+    assert after["counters"].get("chat_stream_errors", 0) == before["counters"].get("chat_stream_errors", 0)
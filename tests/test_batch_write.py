@@ -0,0 +1,46 @@
+import sys
+import os
+import asyncio
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shared_utils
+from shared_utils import batch_write, current_project_root
+
+
+def test_batch_write_creates_tree_and_reports_each_entry(tmp_path, monkeypatch):
+    recorded = []
+
+    async def record(changes):
+        recorded.extend(changes)
+
+    monkeypatch.setattr(shared_utils, "update_project_state_batch", record)
+    monkeypatch.setattr(shared_utils, "PROJECTS_DIR", str(tmp_path))
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app" / "keep.txt").write_text("original")
+    token = current_project_root.set(str(tmp_path))
+    try:
+        results = asyncio.run(batch_write(
+            folders=["app/static", "app"],
+            files=[
+                {"path": "app/src/main.py", "content": "print('hi')\n"},
+                {"path": "app/keep.txt", "content": "replaced"},
+                {"path": "app/README.md", "content": "# App", "overwrite": True},
+                {"path": "../outside.txt", "content": "x"},
+            ]
+        ))
+    finally:
+        current_project_root.reset(token)
+
+    assert [(r.path, r.status) for r in results] == [
+        ("app", "exists"), ("app/static", "created"), ("app/src/main.py", "created"),
+        ("app/keep.txt", "exists"), ("app/README.md", "created"), ("../outside.txt", "error"),
+    ]
+    assert (tmp_path / "app" / "src" / "main.py").read_text() == "print('hi')\n"
+    assert (tmp_path / "app" / "keep.txt").read_text() == "original"
+    assert results[2].size == 12 and len(results[2].sha256) == 64
+    # One state update for the new folders and files
+    assert sorted((path, is_folder) for path, is_folder, _, _ in recorded) == [
+        ("app/README.md", False), ("app/src", True), ("app/src/main.py", False), ("app/static", True)
+    ]
@@ -0,0 +1,57 @@
+import sys
+import os
+import asyncio
+import threading
+
+import pytest
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shared_utils
+from shared_utils import sync_filesystem, fsync_directory
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    recorded = []
+
+    def fake_fsync_directory(path):
+        recorded.append(("dir", str(path), threading.current_thread() is threading.main_thread()))
+
+    def fake_sync():
+        recorded.append(("sync", None, threading.current_thread() is threading.main_thread()))
+
+    monkeypatch.setattr(shared_utils, "fsync_directory", fake_fsync_directory)
+    monkeypatch.setattr(os, "sync", fake_sync, raising=False)
+    return recorded
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ("none", []),
+    ("fsync-file", []),
+    ("fsync-file+dir", [("dir", "a", False), ("dir", "b", False)]),
+    ("global", [("sync", None, False)]),
+])
+def test_modes_sync_off_the_event_loop(monkeypatch, calls, mode, expected):
+    monkeypatch.setattr(shared_utils, "DURABILITY_MODE", mode)
+    asyncio.run(sync_filesystem("a", "b", "a"))
+    assert sorted(calls) == expected
+
+
+def test_fsync_directory(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+
+    def tracking_fsync(fd):
+        synced.append(os.path.samestat(os.fstat(fd), os.stat(tmp_path)))
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", tracking_fsync)
+    fsync_directory(tmp_path)
+    if hasattr(os, "O_DIRECTORY"):
+        assert synced == [True]
+        with pytest.raises(OSError):
+            fsync_directory(tmp_path / "missing")
+    else:
+        assert synced == []
@@ -0,0 +1,75 @@
+import sys
+import os
+
+import pytest
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from file_edits import apply_unified_diff, apply_replacements, PatchConflict
+
+SOURCE = "".join(f"line {i}\n" for i in range(1, 21))
+
+
+def test_unified_diff_applies_to_shifted_file():
+    patch = """--- a/app.py
++++ b/app.py
+@@ -3,3 +3,3 @@
+ line 3
+-line 4
++LINE FOUR
+ line 5
+@@ -15,2 +15,4 @@
+ line 15
++inserted a
++inserted b
+ line 16
+"""
+    # Two lines added at the top since the diff was made
+    text, changes = apply_unified_diff("new 1\nnew 2\n" + SOURCE, patch)
+    lines = text.splitlines()
+    assert lines[5] == "LINE FOUR" and "line 4" not in lines
+    assert lines[16:20] == ["line 15", "inserted a", "inserted b", "line 16"]
+    assert [(c.start_line, c.removed, c.added) for c in changes] == [(5, 1, 1), (17, 0, 2)]
+
+    with pytest.raises(PatchConflict):
+        apply_unified_diff(SOURCE, "@@ -1,2 +1,2 @@\n line 1\n-line 3\n+x\n")
+
+
+def test_replacements_need_unique_matches_and_keep_line_endings():
+    text, changes = apply_replacements(SOURCE.replace("\n", "\r\n"), [{"old": "line 7\nline 8", "new": "seven"}])
+    assert "line 6\r\nseven\r\nline 9" in text and changes[0].start_line == 7
+
+    with pytest.raises(PatchConflict, match="occurs 2 times"):
+        apply_replacements("a = 1\na = 1\n", [{"old": "a = 1", "new": "a = 2"}])
+    text, changes = apply_replacements("a = 1\na = 1\n", [{"old": "a = 1", "new": "a = 2", "replace_all": True}])
+    assert text == "a = 2\na = 2\n" and len(changes) == 2
+    with pytest.raises(PatchConflict, match="not found"):
+        apply_replacements(SOURCE, [{"old": "line 4\nline 6", "new": ""}])
+
+
+def test_edit_fails_when_the_file_changes_meanwhile(tmp_path, monkeypatch):
+    import asyncio
+    import shared_utils
+
+    path = tmp_path / "app.py"
+    path.write_text("x = 1\n")
+    original = shared_utils.apply_replacements
+
+    def replace_file_then_apply(text, edits):
+        # Another writer swaps in new content of the same size and mtime
+        stat = os.stat(path)
+        (tmp_path / "new.py").write_text("y = 2\n")
+        os.utime(tmp_path / "new.py", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path / "new.py", path)
+        return original(text, edits)
+
+    monkeypatch.setattr(shared_utils, "apply_replacements", replace_file_then_apply)
+    monkeypatch.setattr(shared_utils, "PROJECTS_DIR", str(tmp_path))
+    token = shared_utils.current_project_root.set(str(tmp_path))
+    try:
+        with pytest.raises(PatchConflict, match="modified while"):
+            asyncio.run(shared_utils.edit_file("app.py", edits=[{"old": "x = 1", "new": "x = 3"}]))
+    finally:
+        shared_utils.current_project_root.reset(token)
+    assert path.read_text() == "y = 2\n"
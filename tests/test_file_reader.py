@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import file_reader
+from file_reader import read_slice, line_index, iter_file
+
+
+def test_line_ranges_use_cached_index(tmp_path, monkeypatch):
+    path = tmp_path / "app.log"
+    path.write_bytes(b"".join(f"line {i}\n".encode() for i in range(1, 101)))
+    monkeypatch.setattr(file_reader, "READ_FILE_MMAP_THRESHOLD", 0)
+
+    part = read_slice(str(path), start_line=10, end_line=12)
+    assert part.text == "line 10\nline 11\nline 12\n"
+    assert (part.start_line, part.end_line, part.total_lines, part.truncated) == (10, 12, 100, False)
+    assert line_index(str(path)) is line_index(str(path))
+
+    # Cut at the last complete line that fits
+    part = read_slice(str(path), start_line=99, max_bytes=10)
+    assert part.text == "line 99\n" and part.end_line == 99 and part.truncated
+    assert read_slice(str(path), start_line=200).data == b""
+
+    # A line longer than max_bytes is cut, and only that line is claimed
+    part = read_slice(str(path), start_line=10, end_line=12, max_bytes=4)
+    assert part.text == "line" and (part.start_line, part.end_line, part.truncated) == (10, 10, True)
+
+    with open(path, "ab") as f:
+        f.write(b"line 101")
+    assert read_slice(str(path), start_line=101).text == "line 101"
+
+
+def test_byte_ranges_and_streaming(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(256)) * 4)
+
+    part = read_slice(str(path), offset=1000, limit=100)
+    assert part.data == bytes(range(232, 256)) and (part.start, part.end, part.truncated) == (1000, 1024, False)
+    part = read_slice(str(path), offset=10, max_bytes=16)
+    assert part.data == bytes(range(10, 26)) and part.truncated
+    assert b"".join(iter_file(str(path), 256, 300, chunk_size=64)) == (bytes(range(256)) * 2)[:300]
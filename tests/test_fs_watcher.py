@@ -0,0 +1,38 @@
+import pytest
+import sys
+import os
+import time
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fs_watcher import create_watcher, FileChange
+
+
+def _collect(watcher, timeout=3.0):
+    changes = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        batch, _ = watcher.drain()
+        changes.extend(batch)
+        time.sleep(0.1)
+    return changes
+
+
+@pytest.mark.parametrize("mode", ["inotify", "poll"])
+def test_watcher_reports_deltas(tmp_path, mode):
+    watcher = create_watcher(str(tmp_path), mode, poll_interval=0.1)
+    if watcher is None:
+        pytest.skip(f"{mode} watcher not available")
+    watcher.start()
+    try:
+        (tmp_path / "app" / "src").mkdir(parents=True)
+        (tmp_path / "app" / "src" / "main.py").write_text("print('hi')")
+        time.sleep(0.5)
+        (tmp_path / "app" / "src" / "main.py").unlink()
+        changes = _collect(watcher, timeout=1.0)
+    finally:
+        watcher.stop()
+
+    assert FileChange("created", "app/src", True) in changes
+    assert FileChange("deleted", "app/src/main.py", False) in changes
@@ -0,0 +1,41 @@
+import sys
+import os
+import asyncio
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from history_manager import ConversationHistory, SUMMARY_HEADER, is_turn_start
+
+
+def _turn(i, size):
+    return [
+        {"role": "user", "content": f"request {i}"},
+        {"role": "assistant", "content": [
+            {"type": "text", "text": f"working on {i}"},
+            {"type": "tool_use", "id": f"t{i}", "name": "create_file", "input": {"path": f"f{i}.py", "content": "x" * size}}
+        ]},
+        {"role": "user", "content": [{"type": "tool_result", "tool_use_id": f"t{i}", "content": "y" * size}]},
+        {"role": "assistant", "content": [{"type": "text", "text": f"done {i}"}]},
+    ]
+
+
+def test_compaction_keeps_recent_turns_and_pairs():
+    history = ConversationHistory(max_tokens=3000, keep_recent_tokens=1500, tool_output_chars=100)
+    for i in range(20):
+        history.extend(_turn(i, 2000))
+
+    assert asyncio.run(history.compact())
+    assert history.token_footprint() <= 3000
+    assert history[0]["content"].startswith(SUMMARY_HEADER)
+    assert "request 0" in history.summary
+    # The newest turn is kept verbatim
+    assert history[-4:] == _turn(19, 2000)
+    # The history after the summary starts on a turn boundary, so no tool_result is orphaned
+    assert is_turn_start(history[1])
+
+
+def test_small_history_is_untouched():
+    history = ConversationHistory(_turn(0, 10), max_tokens=3000)
+    assert not asyncio.run(history.compact())
+    assert history == _turn(0, 10)
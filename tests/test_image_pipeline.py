@@ -0,0 +1,48 @@
+import sys
+import os
+import io
+
+from PIL import Image
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_pipeline import prepare_image, target_size
+
+
+def _encode(img, fmt):
+    output = io.BytesIO()
+    img.save(output, format=fmt)
+    return output.getvalue()
+
+
+def test_large_images_are_downscaled_keeping_the_format():
+    assert target_size(4000, 3000) == (1238, 928)
+    assert target_size(3000, 500) == (1568, 261)
+    assert target_size(800, 600) == (800, 600)
+
+    photo = prepare_image(_encode(Image.new("RGB", (4000, 3000), "navy"), "JPEG"), "image/jpeg")
+    assert photo.media_type == "image/jpeg" and (photo.width, photo.height) == (1238, 928)
+
+    screenshot = prepare_image(_encode(Image.new("RGBA", (3200, 2000), (0, 0, 0, 0)), "PNG"), "image/png")
+    assert screenshot.media_type == "image/png" and screenshot.width == 1356
+    assert Image.open(io.BytesIO(screenshot.data)).mode == "RGBA"
+
+    webp = prepare_image(_encode(Image.new("RGB", (2000, 2000)), "WEBP"))
+    assert webp.media_type == "image/webp"
+
+
+def test_small_images_pass_through_and_bad_data_is_rejected():
+    data = _encode(Image.new("RGB", (640, 480), "white"), "PNG")
+    prepared = prepare_image(data, "image/png")
+    assert prepared.data is data and prepared.media_type == "image/png"
+
+    # Animated or not, GIF is sent as a still PNG
+    assert prepare_image(_encode(Image.new("P", (10, 10)), "GIF")).media_type == "image/png"
+
+    try:
+        prepare_image(b"not an image")
+    except ValueError as e:
+        assert "Unsupported image" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dir_listing import scan_listing, sort_listing
+
+
+def _make_tree(root):
+    os.makedirs(root / "src" / "pkg" / "deep")
+    (root / "README.md").write_text("readme")
+    (root / "b.py").write_text("x" * 300)
+    (root / "src" / "main.py").write_text("x" * 10)
+    (root / "src" / "pkg" / "mod.py").write_text("x")
+    (root / "src" / "pkg" / "deep" / "leaf.txt").write_text("x")
+    os.utime(root / "b.py", (1000, 1000))
+
+
+def test_sorting_and_filters(tmp_path):
+    _make_tree(tmp_path)
+
+    entries, truncated = scan_listing(str(tmp_path))
+    assert not truncated
+    assert [e.path for e in sort_listing(entries)] == ["src", "b.py", "README.md"]
+    assert [e.path for e in sort_listing(entries, "size", descending=True, dirs_first=False)] == ["b.py", "README.md", "src"]
+    assert [e.path for e in sort_listing(entries, "modified", dirs_first=False)][0] == "b.py"
+    assert sort_listing(entries)[0].size is None and sort_listing(entries)[1].size == 300
+
+    entries, _ = scan_listing(str(tmp_path), pattern="*.PY")
+    assert [e.path for e in entries] == ["b.py"]
+
+
+def test_recursive_depth_and_entry_cap(tmp_path):
+    _make_tree(tmp_path)
+
+    entries, _ = scan_listing(str(tmp_path), recursive=True, kind="file")
+    assert sorted(e.path for e in entries) == ["README.md", "b.py", "src/main.py", "src/pkg/deep/leaf.txt", "src/pkg/mod.py"]
+    entries, _ = scan_listing(str(tmp_path), recursive=True, max_depth=2, pattern="*.py")
+    assert sorted(e.path for e in entries) == ["b.py", "src/main.py"]
+
+    entries, truncated = scan_listing(str(tmp_path), recursive=True, max_entries=3)
+    assert len(entries) == 3 and truncated
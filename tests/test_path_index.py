@@ -0,0 +1,53 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from path_index import PathIndex
+from project_index import Entry, DIR, FILE
+
+
+def _index():
+    return PathIndex([
+        Entry("app", DIR),
+        Entry("app/src/main.py", FILE, 10, 1.0, "abc"),
+        Entry("app/README.md", FILE, 5, 1.0),
+        Entry("notes.txt", FILE, 3, 1.0),
+    ])
+
+
+def test_lookups_and_aggregates():
+    index = _index()
+
+    # Missing parent folders are created
+    assert index.is_dir("app/src")
+    assert index.get("app/src/main.py") == Entry("app/src/main.py", FILE, 10, 1.0, "abc")
+    assert "app/missing" not in index
+    assert index.stats() == {"files": 3, "folders": 2, "size": 18}
+    assert index.stats("app") == {"files": 2, "folders": 1, "size": 15}
+
+    # An update without a hash keeps it while size and mtime are unchanged
+    index.put(Entry("app/src/main.py", FILE, 10, 1.0))
+    assert index.get("app/src/main.py").hash == "abc"
+    index.put(Entry("app/src/main.py", FILE, 20, 2.0))
+    assert index.get("app/src/main.py").hash is None
+    assert index.stats("app") == {"files": 2, "folders": 1, "size": 25}
+
+
+def test_subtree_delete_move_and_order():
+    index = _index()
+
+    assert [e.name for e in index.children("app")] == ["README.md", "src"]
+    assert [e.path for e in index.walk()] == ["app", "app/README.md", "app/src", "app/src/main.py", "notes.txt"]
+
+    assert index.move("app/src", "lib")
+    assert not index.move("lib", "lib/inner")
+    assert [e.path for e in index.walk("lib")] == ["lib/main.py"]
+    assert index.stats("app") == {"files": 1, "folders": 0, "size": 5}
+
+    assert index.delete("app")
+    assert not index.delete("app")
+    assert index.get("app/README.md") is None
+    assert index.stats() == {"files": 2, "folders": 1, "size": 13}
+    assert len(index) == 3
@@ -0,0 +1,52 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from project_index import ProjectIndex, Entry, scan_entries, reconcile, DIR, FILE
+
+
+def _make_tree(root):
+    os.makedirs(root / "app" / "src")
+    (root / "app" / "src" / "main.py").write_text("print('hi')")
+    (root / "app" / "README.md").write_text("# app")
+    (root / "notes.txt").write_text("notes")
+
+
+def test_queries_and_subtree_delete(tmp_path):
+    index = ProjectIndex(":memory:")
+    index.apply([
+        ("put", Entry("app", DIR)),
+        ("put", Entry("app/src", DIR)),
+        ("put", Entry("app/src/main.py", FILE, 11, 1.0, "abc")),
+        ("put", Entry("app0.txt", FILE, 1, 1.0)),
+    ])
+
+    assert index.get("app/src/main.py") == Entry("app/src/main.py", FILE, 11, 1.0, "abc")
+    # A later put from the watcher or a scan keeps the hash while the file is unchanged
+    index.apply([("put", Entry("app/src/main.py", FILE, 11, 1.0))])
+    assert index.get("app/src/main.py").hash == "abc"
+    assert [e.path for e in index.children("app")] == ["app/src"]
+    assert [e.path for e in index.subtree("app")] == ["app/src", "app/src/main.py"]
+
+    index.apply([("delete", "app")])
+    # Deleting a folder removes its subtree but not siblings sharing the prefix
+    assert [e.path for e in index.subtree()] == ["app0.txt"]
+
+
+def test_reconcile_lists_only_changed_folders(tmp_path):
+    root = tmp_path / "projects"
+    _make_tree(root)
+    index = ProjectIndex(":memory:")
+    index.replace_all(scan_entries(str(root)))
+    assert reconcile(index, str(root)) == []
+
+    (root / "app" / "src" / "util.py").write_text("x = 1")
+    (root / "app" / "README.md").unlink()
+    index.apply(reconcile(index, str(root)))
+
+    paths = {e.path for e in index.subtree()}
+    assert paths == {"app", "app/src", "app/src/main.py", "app/src/util.py", "notes.txt"}
+    assert index.get("app/src/util.py").size == 5
+    assert reconcile(index, str(root)) == []
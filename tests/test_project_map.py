@@ -0,0 +1,69 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from project_map import render_project_map, estimate_tokens, IgnoreRules, DEFAULT_IGNORE
+
+
+def test_ignored_folders_are_collapsed():
+    folders = {"app", "app/node_modules", "app/node_modules/pkg"}
+    files = {"app/index.js", "app/node_modules/pkg/index.js", "app/node_modules/pkg/package.json"}
+    project_map = render_project_map(folders, files, rules=IgnoreRules(DEFAULT_IGNORE))
+    assert "node_modules/ [ignored, 2 files, 1 folder]" in project_map
+    assert "pkg" not in project_map
+    assert "index.js" in project_map
+
+
+def test_gitignore_rules():
+    rules = IgnoreRules(["*.log", "/build/", "!keep.log"], base="app")
+    assert rules.is_ignored("app/debug.log", False)
+    assert not rules.is_ignored("app/keep.log", False)
+    assert rules.is_ignored("app/build", True)
+    assert not rules.is_ignored("app/src/build", True)
+    assert not rules.is_ignored("other/debug.log", False)
+
+
+def test_map_fits_token_budget():
+    folders = {f"pkg{i}" for i in range(40)} | {f"pkg{i}/src" for i in range(40)}
+    files = {f"pkg{i}/src/module_{j}.py" for i in range(40) for j in range(30)}
+    project_map = render_project_map(folders, files, token_budget=200, rules=IgnoreRules())
+    assert estimate_tokens(project_map) <= 200
+    assert "pkg0/ [30 files, 1 folder]" in project_map
+
+    # Cut to single lines, the truncation marker included
+    for budget in (50, 100):
+        project_map = render_project_map(folders, files, token_budget=budget, rules=IgnoreRules())
+        assert project_map.endswith(f"map truncated to fit {budget} tokens")
+        assert estimate_tokens(project_map) <= budget
+
+
+def test_gitignore_rules_are_cached_and_skipped_in_ignored_folders(tmp_path, monkeypatch):
+    import builtins
+    (tmp_path / "app" / "node_modules" / "pkg").mkdir(parents=True)
+    (tmp_path / "app" / ".gitignore").write_text("*.log\n")
+    (tmp_path / "app" / "node_modules" / "pkg" / ".gitignore").write_text("*.py\n")
+    files = ["app/.gitignore", "app/node_modules/pkg/.gitignore", "app/main.py", "app/debug.log"]
+
+    opened = []
+    real_open = builtins.open
+
+    def recording_open(path, *args, **kwargs):
+        opened.append(str(path))
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", recording_open)
+    rules = IgnoreRules.for_project(files, str(tmp_path))
+    assert rules.is_ignored("app/debug.log", False) and not rules.is_ignored("app/main.py", False)
+    assert opened == [str(tmp_path / "app" / ".gitignore")]
+
+    # Unchanged files come from the cache; a changed one is read again
+    IgnoreRules.for_project(files, str(tmp_path))
+    assert len(opened) == 1
+    (tmp_path / "app" / ".gitignore").write_text("*.log\n*.tmp\n")
+    assert IgnoreRules.for_project(files, str(tmp_path)).is_ignored("app/x.tmp", False)
+    assert len(opened) == 2
+
+    project_map = render_project_map(["app"], ["app/main.py"], rules=IgnoreRules())
+    assert "paths relative to the project root" in project_map
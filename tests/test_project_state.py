@@ -0,0 +1,96 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import project_state
+from project_state import update_project_state, flush_project_state, clear_state_file
+from project_index import ProjectIndex
+
+
+class CountingIndex(ProjectIndex):
+    def __init__(self):
+        super().__init__(":memory:")
+        self.transactions = []
+
+    def apply(self, operations):
+        self.transactions.append(list(operations))
+        super().apply(operations)
+
+
+@pytest.fixture
+def index(monkeypatch, tmp_path):
+    index = CountingIndex()
+    notified = []
+
+    async def notify():
+        notified.append(True)
+
+    monkeypatch.setattr(project_state, "project_index", index)
+    monkeypatch.setattr(project_state, "_notify_workers", notify)
+    monkeypatch.setattr(project_state, "PROJECT_STATE_FILE", str(tmp_path / "project_state.json"))
+    monkeypatch.setattr(project_state, "_pending_ops", [])
+    monkeypatch.setattr(project_state, "_flush_task", None)
+    monkeypatch.setattr(project_state, "project_state", project_state.PathIndex())
+    index.notified = notified
+    return index
+
+
+def _run(monkeypatch, delay, coroutine):
+    monkeypatch.setattr(project_state, "PROJECT_STATE_FLUSH_DELAY", delay)
+
+    async def run():
+        # The lock has to belong to this test's event loop
+        monkeypatch.setattr(project_state, "_flush_lock", asyncio.Lock())
+        return await coroutine()
+
+    return asyncio.run(run())
+
+
+def test_changes_within_the_delay_are_written_in_one_transaction(monkeypatch, index):
+    async def scenario():
+        await update_project_state("app", is_folder=True)
+        await update_project_state("app/a.py", is_folder=False, size=1)
+        await update_project_state("app/b.py", is_folder=False, size=2)
+        await update_project_state("app/a.py", is_folder=False, is_delete=True)
+        await update_project_state("app/b.py", is_folder=False, size=3)
+        # Lookups are answered from memory before anything is written
+        assert project_state.project_state.get("app/b.py").size == 3
+        assert index.transactions == []
+        await asyncio.sleep(0.3)
+
+    _run(monkeypatch, 0.1, scenario)
+    assert len(index.transactions) == 1 and len(index.transactions[0]) == 5
+    assert index.get("app/a.py") is None and index.get("app/b.py").size == 3
+    assert project_state._pending_ops == [] and index.notified == [True]
+
+
+def test_pending_changes_are_flushed_on_shutdown(monkeypatch, index):
+    async def scenario():
+        await update_project_state("notes.txt", is_folder=False, size=5)
+        assert index.get("notes.txt") is None
+        await flush_project_state()
+        project_state._flush_task.cancel()
+
+    _run(monkeypatch, 60, scenario)
+    assert index.get("notes.txt").size == 5
+    assert len(index.transactions) == 1 and project_state._pending_ops == []
+
+
+def test_clear_discards_pending_changes(monkeypatch, index, tmp_path):
+    (tmp_path / "project_state.json").write_text("{}")
+
+    async def scenario():
+        await update_project_state("old.txt", is_folder=False, size=1)
+        await clear_state_file()
+        await flush_project_state()
+        project_state._flush_task.cancel()
+
+    _run(monkeypatch, 60, scenario)
+    assert index.get("old.txt") is None and index.transactions == []
+    assert project_state.project_state.get("old.txt") is None
+    assert not (tmp_path / "project_state.json").exists()
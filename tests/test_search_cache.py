@@ -0,0 +1,76 @@
+import sys
+import os
+import asyncio
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from shared_utils import SearchCache, SearchError
+from state_backend import MemoryStateBackend
+
+
+def test_concurrent_queries_share_one_request_and_results_persist():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [{"title": "Result"}]
+
+    async def run():
+        backend = MemoryStateBackend()
+        cache = SearchCache(ttl=60, max_entries=10, backend=backend)
+        key = SearchCache.key("  FastAPI   streaming ", "SEARXNG", 5)
+        assert key == SearchCache.key("fastapi streaming", "SEARXNG", 5)
+        results = await asyncio.gather(*(cache.get_or_fetch(key, fetch) for _ in range(5)))
+        assert results == [[{"title": "Result"}]] * 5
+        assert await cache.get_or_fetch(key, fetch) == [{"title": "Result"}]
+
+        # A new cache on the same backend (another worker, or after a restart) reuses the result
+        other = SearchCache(ttl=60, max_entries=10, backend=backend)
+        assert await other.get_or_fetch(key, fetch) == [{"title": "Result"}]
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_lru_eviction_expiry_and_errors():
+    async def run():
+        cache = SearchCache(ttl=60, max_entries=2)
+        for query in ("a", "b", "a", "c"):
+            await cache.get_or_fetch(query, lambda query=query: asyncio.sleep(0, result=query))
+        # "b" was the least recently used entry
+        assert list(cache._entries) == ["a", "c"]
+
+        cache.ttl = -1
+        assert await cache.get_or_fetch("a", lambda: asyncio.sleep(0, result="fresh")) == "fresh"
+
+        async def failing():
+            raise SearchError("provider down")
+
+        cache = SearchCache(ttl=60, max_entries=2)
+        with pytest.raises(SearchError):
+            await cache.get_or_fetch("d", failing)
+        assert len(cache) == 0
+
+    asyncio.run(run())
+
+
+def test_caches_count_under_their_own_metrics():
+    import metrics
+
+    async def run():
+        image_cache = SearchCache(ttl=60, max_entries=2, namespace="image_analysis",
+                                  metrics_prefix="image_analysis_cache")
+        for _ in range(2):
+            await image_cache.get_or_fetch("hash", lambda: asyncio.sleep(0, result="a cat"))
+
+    before = metrics.snapshot()["counters"]
+    asyncio.run(run())
+    after = metrics.snapshot()["counters"]
+    assert after["image_analysis_cache_misses"] == before.get("image_analysis_cache_misses", 0) + 1
+    assert after["image_analysis_cache_hits"] == before.get("image_analysis_cache_hits", 0) + 1
+    for name in ("search_cache_hits", "search_cache_misses"):
+        assert after.get(name, 0) == before.get(name, 0)
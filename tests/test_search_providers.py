@@ -0,0 +1,130 @@
+import sys
+import os
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shared_utils
+from shared_utils import SearchResult, SearchError, dedupe_results, render_search_results, normalize_url
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    searxng_delay = 0.0
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        time.sleep(self.searxng_delay)
+        self._reply({"results": [{"title": "SearXNG hit", "url": "https://a.example", "content": "from searxng"}]})
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self._reply({"results": [{"title": "Tavily hit", "url": "https://b.example", "content": "from tavily"}]})
+
+    def log_message(self, *args):
+        pass
+
+
+def _with_stub_server(monkeypatch, test):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(shared_utils, "SEARXNG_URL", f"{base}/search")
+    monkeypatch.setattr(shared_utils, "TAVILY_API_URL", base)
+    monkeypatch.setattr(shared_utils, "TAVILY_API_KEY", "tvly-test")
+    _StubHandler.connections = set()
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            monkeypatch.setattr(shared_utils, "search_http_client", client)
+            await test()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_providers_reuse_pooled_connection(monkeypatch):
+    _StubHandler.searxng_delay = 0.0
+
+    async def test():
+        results = await shared_utils.searxng_search("python")
+        assert results == [SearchResult(title="SearXNG hit", url="https://a.example", snippet="from searxng", provider="searxng")]
+        assert (await shared_utils.searxng_search("asyncio"))[0].title == "SearXNG hit"
+        assert (await shared_utils.tavily_search("python"))[0].provider == "tavily"
+
+    _with_stub_server(monkeypatch, test)
+    assert len(_StubHandler.connections) == 1
+
+
+def test_hedged_search_returns_first_usable_result(monkeypatch):
+    _StubHandler.searxng_delay = 0.5
+
+    async def test():
+        start = time.perf_counter()
+        results = await shared_utils.hedged_search("python", ["SEARXNG", "TAVILY"], delay=0.05)
+        assert results[0].title == "Tavily hit"
+        assert time.perf_counter() - start < 0.4
+
+    _with_stub_server(monkeypatch, test)
+
+
+def test_hedged_search_keeps_an_empty_answer_over_a_later_error(monkeypatch):
+    async def empty(query):
+        return []
+
+    async def failing(query):
+        raise SearchError("provider down")
+
+    async def test():
+        return await shared_utils.hedged_search("python", ["SEARXNG", "TAVILY"], delay=0.05)
+
+    monkeypatch.setitem(shared_utils.SEARCH_FUNCTIONS, "SEARXNG", empty)
+    monkeypatch.setitem(shared_utils.SEARCH_FUNCTIONS, "TAVILY", failing)
+    assert asyncio.run(test()) == []
+
+    # Without any answer the error is raised
+    monkeypatch.setitem(shared_utils.SEARCH_FUNCTIONS, "SEARXNG", failing)
+    with pytest.raises(SearchError, match="provider down"):
+        asyncio.run(test())
+
+
+def test_results_are_deduplicated_and_rendered_within_budget():
+    results = dedupe_results([
+        SearchResult(title="Docs", url="https://www.example.com/docs/?utm_source=x", snippet="a " * 400, provider="searxng"),
+        SearchResult(title="Docs again", url="http://example.com/docs#intro", provider="tavily"),
+        SearchResult(title="Other", url="https://example.com/other", snippet="other page", provider="tavily"),
+    ])
+    assert [result.title for result in results] == ["Docs", "Other"]
+
+    rendered = render_search_results(results, token_budget=1000, snippet_chars=50)
+    assert rendered.startswith("1. Docs\nhttps://www.example.com/docs/?utm_source=x\n")
+    assert "2. Other" in rendered and len(rendered) < 200
+    assert render_search_results(results, token_budget=10).endswith("(1 more results omitted)")
+    assert render_search_results([]) == "No results found."
+
+
+def test_only_tracking_parameters_are_ignored():
+    assert normalize_url("https://x.com/p?refId=1") != normalize_url("https://x.com/p?refId=2")
+    assert normalize_url("https://x.com/p?referrer=a") != normalize_url("https://x.com/p")
+    assert normalize_url("https://x.com/p?id=7&ref=nav&ref_src=twsrc&fbclid=1&gclid=2&UTM_Medium=m") == "//x.com/p?id=7"
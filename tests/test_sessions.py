@@ -0,0 +1,73 @@
+import sys
+import os
+import asyncio
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sessions import SessionStore
+from state_backend import MemoryStateBackend
+
+
+def test_sessions_are_separate(tmp_path):
+    store = SessionStore(project_roots="isolated", projects_dir=str(tmp_path), backend=MemoryStateBackend())
+    a = asyncio.run(store.get("a"))
+    b = asyncio.run(store.get("b"))
+    a.history.append({"role": "user", "content": "hello"})
+    a.cwd = "app"
+
+    assert asyncio.run(store.get("a")) is a
+    assert len(b.history) == 0 and b.cwd == "."
+    assert a.project_root == os.path.join(str(tmp_path), "sessions", "a")
+    assert os.path.isdir(b.project_root)
+    # Requests without a session ID are isolated as well
+    assert asyncio.run(store.get("default")).project_root == os.path.join(str(tmp_path), "sessions", "default")
+
+
+def test_idle_and_lru_eviction(tmp_path):
+    store = SessionStore(max_sessions=2, idle_timeout=60, projects_dir=str(tmp_path), backend=MemoryStateBackend())
+    old = asyncio.run(store.get("old"))
+    old.last_seen -= 120
+    running = asyncio.run(store.get("running"))
+    running.automode_running = True
+    running.last_seen -= 120
+
+    assert asyncio.run(store.evict_idle()) == ["old"]
+    asyncio.run(store.get("x"))
+    asyncio.run(store.get("y"))
+    # Over max_sessions: the least recently used idle session goes, never a running one
+    assert "running" in store and "y" in store and "x" not in store
+
+
+def test_token_cap_evicts_least_recently_used(tmp_path):
+    store = SessionStore(max_total_tokens=100, projects_dir=str(tmp_path), backend=MemoryStateBackend())
+    first = asyncio.run(store.get("first"))
+    first.history.append({"role": "user", "content": "x" * 400})
+    first.last_seen -= 10
+    asyncio.run(store.get("second"))
+
+    assert "first" not in store and "second" in store
+
+
+def test_session_is_restored_from_backend(tmp_path):
+    backend = MemoryStateBackend()
+    store = SessionStore(projects_dir=str(tmp_path), backend=backend)
+    session = asyncio.run(store.get("a"))
+    session.history.append({"role": "user", "content": "hello"})
+    session.cwd = "app"
+    asyncio.run(store.save(session))
+
+    # A second worker sharing the backend sees the same session
+    other = asyncio.run(SessionStore(projects_dir=str(tmp_path), backend=backend).get("a"))
+    assert list(other.history) == [{"role": "user", "content": "hello"}]
+    assert other.cwd == "app"
+
+
+def test_concurrent_first_requests_share_one_session(tmp_path):
+    store = SessionStore(projects_dir=str(tmp_path), backend=MemoryStateBackend())
+
+    async def run():
+        return await asyncio.gather(*(store.get("a") for _ in range(5)))
+
+    sessions = asyncio.run(run())
+    assert all(session is sessions[0] for session in sessions) and len(store) == 1
@@ -0,0 +1,41 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from state_backend import SQLiteStateBackend
+
+
+def test_sqlite_backend_round_trip_and_purge(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+    backend.put("sessions", "a", {"cwd": "app", "history": [1, 2]})
+    backend.put("sessions", "b", {"cwd": "."})
+
+    assert backend.get("sessions", "a") == {"cwd": "app", "history": [1, 2]}
+    assert [key for key, _ in backend.items("sessions")] == ["a", "b"]
+    assert backend.get("project_state", "a") is None
+
+    assert sorted(backend.purge("sessions", older_than=float("inf"))) == ["a", "b"]
+    assert backend.items("sessions") == []
+    backend.close()
+
+
+def test_changes_are_delivered_to_other_connections_only(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer = SQLiteStateBackend(path)
+    reader = SQLiteStateBackend(path)
+    writer.get("sessions", "x")
+    assert reader.poll_changes() == []
+
+    writer.put("sessions", "a", {"n": 1})
+    writer.put("sessions", "a", {"n": 2})
+    writer.delete("automode_jobs", "a")
+
+    assert reader.poll_changes() == [("sessions", "a"), ("automode_jobs", "a")]
+    assert reader.poll_changes() == []
+    # A process never hears about its own writes
+    assert writer.poll_changes() == []
+    assert reader.get("sessions", "a") == {"n": 2}
+    writer.close()
+    reader.close()
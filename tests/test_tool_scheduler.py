@@ -0,0 +1,37 @@
+import sys
+import os
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tool_scheduler import build_dependencies
+
+
+def test_folder_created_before_files_inside():
+    calls = [
+        ("create_folder", {"path": "app"}),
+        ("create_file", {"path": "app/main.py", "content": ""}),
+        ("create_file", {"path": "other.txt", "content": ""}),
+        ("search", {"query": "fastapi"}),
+    ]
+    assert build_dependencies(calls) == [[], [0], [], []]
+
+
+def test_reads_wait_for_writes_but_not_for_reads():
+    calls = [
+        ("read_file", {"path": "app/main.py"}),
+        ("write_to_file", {"path": "app/main.py", "content": "x"}),
+        ("read_file", {"path": "app/main.py"}),
+        ("list_files", {"path": "app"}),
+        ("read_file", {"path": "app/other.py"}),
+    ]
+    assert build_dependencies(calls) == [[], [0], [1], [1], []]
+
+
+def test_unknown_tool_is_a_barrier():
+    calls = [
+        ("create_file", {"path": "a.txt"}),
+        ("upload_file", {"file": "..."}),
+        ("create_file", {"path": "b.txt"}),
+    ]
+    assert build_dependencies(calls) == [[], [0], [1]]
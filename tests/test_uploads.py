@@ -0,0 +1,63 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from uploads import store_upload, prune_blobs, UploadTooLarge
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_identical_uploads_share_one_blob(tmp_path):
+    async def run():
+        first = await store_upload("notes.txt", _chunks(b"hello ", "wörld".encode()), uploads_dir=str(tmp_path))
+        second = await store_upload("../copy.txt", _chunks("hello wörld".encode()), uploads_dir=str(tmp_path))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.sha256 == second.sha256 and not first.deduplicated and second.deduplicated
+    assert second.path == os.path.join(str(tmp_path), "copy.txt")
+    assert len(os.listdir(tmp_path / ".blobs" / first.sha256[:2])) == 1
+    # Each upload is its own writable file; writing to one leaves the other and the blob alone
+    assert not os.path.samefile(first.path, second.path)
+    with open(second.path, "a") as f:
+        f.write("!")
+    assert open(first.path).read() == "hello wörld"
+    with open(second.path, "w") as f:
+        f.write("hello wörld")
+    assert first.preview == "hello wörld" and first.is_text and not first.truncated
+
+    os.remove(first.path)
+    assert prune_blobs(str(tmp_path)) == 0
+    os.remove(second.path)
+    assert prune_blobs(str(tmp_path)) == 1
+
+
+def test_size_limit_and_binary_preview(tmp_path):
+    async def run():
+        with pytest.raises(UploadTooLarge):
+            await store_upload("big.bin", _chunks(b"x" * 10, b"x" * 10), uploads_dir=str(tmp_path), max_bytes=15)
+        return await store_upload("image.png", _chunks(b"\x89PNG\0\0", b"data" * 10), uploads_dir=str(tmp_path), preview_bytes=8)
+
+    stored = asyncio.run(run())
+    assert not os.path.exists(tmp_path / "big.bin")
+    assert [name for name in os.listdir(tmp_path / ".blobs") if name.endswith(".tmp")] == []
+    assert stored.size == 46 and not stored.is_text and stored.preview == "" and stored.truncated
+
+
+def test_blob_storage_is_not_listed_or_indexed(tmp_path):
+    from dir_listing import scan_listing
+    from project_index import scan_entries
+
+    asyncio.run(store_upload("notes.txt", _chunks(b"notes"), uploads_dir=str(tmp_path)))
+    entries, _ = scan_listing(str(tmp_path), recursive=True)
+    assert [entry.path for entry in entries] == ["notes.txt"]
+    assert [entry.path for entry in scan_entries(str(tmp_path))] == ["notes.txt"]
+    assert os.stat(tmp_path / "notes.txt").st_mode & 0o200
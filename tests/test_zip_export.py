@@ -0,0 +1,62 @@
+import sys
+import os
+import io
+import time
+import zipfile
+
+# Add the project root directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from zip_export import iter_export_entries, stream_zip
+
+
+def _make_tree(root):
+    os.makedirs(root / "app" / "src")
+    os.makedirs(root / "app" / "node_modules" / "lib")
+    (root / "app" / ".gitignore").write_text("*.log\n")
+    (root / "app" / "src" / "main.py").write_text("print('hi')\n" * 5000)
+    (root / "app" / "debug.log").write_text("noise")
+    (root / "app" / "node_modules" / "lib" / "index.js").write_text("x")
+    (root / "logo.png").write_bytes(b"\x89PNG" + os.urandom(100))
+    (root / "other.log").write_text("kept, the .gitignore is inside app")
+
+
+def test_streamed_archive_respects_subpath_and_ignore_rules(tmp_path):
+    _make_tree(tmp_path)
+
+    chunks = list(stream_zip(iter_export_entries(str(tmp_path)), chunk_size=4096))
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["app/", "app/.gitignore", "app/src/", "app/src/main.py", "logo.png", "other.log"]
+    assert archive.read("app/src/main.py") == b"print('hi')\n" * 5000
+    assert archive.getinfo("app/src/main.py").compress_type == zipfile.ZIP_DEFLATED
+    assert archive.getinfo("logo.png").compress_type == zipfile.ZIP_STORED
+    assert len(chunks) > 2
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(iter_export_entries(str(tmp_path), "app/src"), 0))))
+    assert archive.namelist() == ["app/src/main.py"]
+    assert archive.getinfo("app/src/main.py").compress_type == zipfile.ZIP_STORED
+
+
+def test_incremental_export_lists_only_changed_files(tmp_path):
+    _make_tree(tmp_path)
+    since = time.time() - 60
+    os.utime(tmp_path / "app" / "src" / "main.py", (since - 60, since - 60))
+
+    paths = [entry.path for entry in iter_export_entries(str(tmp_path), since=since)]
+    assert paths == ["app/.gitignore", "logo.png", "other.log"]
+    assert len(list(iter_export_entries(str(tmp_path), use_ignore=False))) == 10
+
+
+def test_compression_level_is_applied(tmp_path):
+    import random
+    rng = random.Random(1)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+    (tmp_path / "words.txt").write_text(" ".join(rng.choice(words) for _ in range(50000)))
+
+    sizes = {}
+    for level in (1, 9):
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(iter_export_entries(str(tmp_path)), level))))
+        assert archive.testzip() is None
+        sizes[level] = archive.getinfo("words.txt").compress_size
+    assert sizes[9] < sizes[1]
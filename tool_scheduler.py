@@ -0,0 +1,108 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import asyncio
+import logging
+from typing import List, Tuple, Optional
+from config import TOOL_CONCURRENCY
+from tools import execute_tool
+
+logger = logging.getLogger(__name__)
+
+# Tools that only look at the file system; everything else that takes a path modifies it
+READ_TOOLS = {"read_file", "list_files"}
+PATH_TOOLS = READ_TOOLS | {"create_folder", "create_file", "write_to_file", "edit_file", "delete_file"}
+INDEPENDENT_TOOLS = {"search"}
+
+
+def _normalize(path: str) -> str:
+    normalized = os.path.normpath(path or ".").replace(os.sep, '/').lstrip('/')
+    return "" if normalized == "." else normalized
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """
+    True when one path is the other or one of its ancestors ("" is the root).
+    """
+    if a == b or a == "" or b == "":
+        return True
+    return a.startswith(b + "/") or b.startswith(a + "/")
+
+
+def _access(tool_name: str, tool_input: dict) -> Optional[Tuple[str, bool]]:
+    """
+    Return (path, is_write) for file tools, or None for tools with no file access.
+    Unknown tools return ("", True) so they act as a barrier.
+    """
+    if tool_name in INDEPENDENT_TOOLS:
+        return None
+    if tool_name in PATH_TOOLS and isinstance(tool_input, dict):
+        return _normalize(tool_input.get("path", ".")), tool_name not in READ_TOOLS
+    return "", True
+
+
+def build_dependencies(tool_calls: List[Tuple[str, dict]]) -> List[List[int]]:
+    """
+    For each call, list the earlier calls it has to wait for: any earlier call
+    touching the same path, an ancestor or a descendant, unless both only read.
+    This orders folder creation before files inside it and reads after writes.
+    """
+    accesses = [_access(name, tool_input) for name, tool_input in tool_calls]
+    dependencies = []
+    for j, access in enumerate(accesses):
+        deps = []
+        if access is not None:
+            path, is_write = access
+            for i in range(j):
+                earlier = accesses[i]
+                if earlier is None:
+                    continue
+                if (is_write or earlier[1]) and _overlaps(path, earlier[0]):
+                    deps.append(i)
+        dependencies.append(deps)
+    return dependencies
+
+
+async def execute_tools(tool_calls: List[Tuple[str, dict]], max_concurrency: int = TOOL_CONCURRENCY) -> List[dict]:
+    """
+    Execute (tool_name, tool_input) pairs with execute_tool, running independent
+    calls concurrently on at most max_concurrency slots. Results come back in the
+    order of tool_calls.
+    """
+    if len(tool_calls) <= 1 or max_concurrency <= 1:
+        return [await execute_tool(name, tool_input) for name, tool_input in tool_calls]
+
+    dependencies = build_dependencies(tool_calls)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks: List[asyncio.Task] = []
+
+    async def run(index: int, waits_for: List[asyncio.Task]) -> dict:
+        if waits_for:
+            # execute_tool reports failures in its result, so dependencies never raise
+            await asyncio.gather(*waits_for, return_exceptions=True)
+        name, tool_input = tool_calls[index]
+        async with semaphore:
+            return await execute_tool(name, tool_input)
+
+    for index, deps in enumerate(dependencies):
+        tasks.append(asyncio.create_task(run(index, [tasks[i] for i in deps])))
+
+    logger.debug(f"Scheduled {len(tool_calls)} tools, {sum(1 for d in dependencies if not d)} without dependencies")
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
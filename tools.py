@@ -1,11 +1,12 @@
 import os
 import logging
 from shared_utils import ( 
-    create_file, read_file, write_to_file, create_folder, delete_file, perform_search,
-    list_files, sync_filesystem, retry_file_operation
+    create_file, read_file, write_to_file, edit_file, batch_write, format_batch_results, create_folder, delete_file, perform_search,
+    list_files, retry_file_operation, state_path_for, get_safe_path
 )
-from project_state import save_state_to_file, project_state, sync_project_state_with_fs
-from config import SEARCH_PROVIDER, PROJECTS_DIR
+from project_state import get_entry, update_project_state, sync_project_state_with_fs
+from project_index import DIR, FILE
+from config import SEARCH_PROVIDER
 
 
 logger = logging.getLogger(__name__)
@@ -47,13 +48,76 @@ tools = [
             "required": ["path", "content"]
         }
     },
+    {
+        "name": "batch_write",
+        "description": (
+            "Create several folders and files in one call, e.g. to scaffold a project. Missing parent "
+            "folders are created. Existing files are kept unless overwrite is set. Returns one status line "
+            "per entry; an entry that fails does not stop the others."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "folders": {"type": "array", "items": {"type": "string"}, "description": "Paths of folders to create"},
+                "files": {
+                    "type": "array",
+                    "description": "Files to create",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "path": {"type": "string", "description": "The path of the file"},
+                            "content": {"type": "string", "description": "The content of the file"},
+                            "overwrite": {"type": "boolean", "description": "Replace the file if it exists"}
+                        },
+                        "required": ["path"]
+                    }
+                },
+                "overwrite": {"type": "boolean", "description": "Replace existing files (default false)"}
+            }
+        }
+    },
+    {
+        "name": "edit_file",
+        "description": (
+            "Change part of an existing file without sending its full content. Give either search/replace "
+            "edits, where each 'old' text must occur exactly once in the file (include enough surrounding "
+            "lines), or a unified diff in 'patch'. All changes are applied together or, if any of them "
+            "does not match the file, none are."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "The path of the file to edit"},
+                "edits": {
+                    "type": "array",
+                    "description": "Search/replace edits, applied in order",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "old": {"type": "string", "description": "Exact text to replace"},
+                            "new": {"type": "string", "description": "Replacement text"},
+                            "replace_all": {"type": "boolean", "description": "Replace every occurrence of old"}
+                        },
+                        "required": ["old", "new"]
+                    }
+                },
+                "patch": {"type": "string", "description": "Unified diff of the file with @@ hunk headers"},
+                "expected_sha256": {"type": "string", "description": "SHA-256 the file must still have, as reported when it was written"}
+            },
+            "required": ["path"]
+        }
+    },
     {
         "name": "read_file",
-        "description": "Read the contents of a file at the specified path.",
+        "description": "Read the contents of a file at the specified path. Large files are returned in parts; use start_line/end_line or offset/limit to read a specific range.",
         "input_schema": {
             "type": "object",
             "properties": {
-                "path": {"type": "string", "description": "The path of the file to read"}
+                "path": {"type": "string", "description": "The path of the file to read"},
+                "start_line": {"type": "integer", "description": "First line to read, 1-based"},
+                "end_line": {"type": "integer", "description": "Last line to read, inclusive"},
+                "offset": {"type": "integer", "description": "Byte offset to start reading at"},
+                "limit": {"type": "integer", "description": "Number of bytes to read"}
             },
             "required": ["path"]
         }
@@ -64,7 +128,10 @@ tools = [
         "input_schema": {
             "type": "object",
             "properties": {
-                "path": {"type": "string", "description": "The path of the folder to list"}
+                "path": {"type": "string", "description": "The path of the folder to list"},
+                "recursive": {"type": "boolean", "description": "Also list the contents of subfolders"},
+                "max_depth": {"type": "integer", "description": "How many folder levels a recursive listing goes down"},
+                "pattern": {"type": "string", "description": "Only list entries whose name matches this glob, e.g. *.py"}
             },
             "required": ["path"]
         }
@@ -104,62 +171,82 @@ tools = [
     }
 ]
 
+async def _file_exists(path: str) -> bool:
+    """
+    Look the file up in the project index; a file that exists on disk but is not
+    indexed yet (e.g. created from the console) is added to it.
+    """
+    state_path = state_path_for(path)
+    entry = await get_entry(state_path)
+    if entry is not None:
+        return entry.kind == FILE
+    if get_safe_path(path).is_file():
+        await update_project_state(state_path, is_folder=False)
+        return True
+    return False
+
 async def execute_tool(tool_name, tool_input):
-    global project_state
     try:
         logger.debug(f"Executing tool: {tool_name} with input: {tool_input}")
         result = None
 
         if tool_name == "create_folder":
             full_path = os.path.normpath(tool_input["path"]).replace(os.sep, '/')
-            if full_path in project_state["folders"]:
+            entry = await get_entry(state_path_for(tool_input["path"]))
+            if entry is not None and entry.kind == DIR:
                 return {"success": True, "result": f"Folder already exists: {full_path}"}
             result = await retry_file_operation(create_folder, tool_input["path"])
-            project_state["folders"].add(full_path)
 
         elif tool_name == "create_file":
             full_path = os.path.normpath(tool_input["path"]).replace(os.sep, '/')
+            state_path = state_path_for(tool_input["path"])
             folder_path = os.path.dirname(full_path)
-            if folder_path == '':  # This means we're in the root directory
-                folder_path = '/'
-            if folder_path != '/' and folder_path not in project_state["folders"]:
-                return {"success": False, "error": f"Folder does not exist: {folder_path}"}
-            if full_path in project_state["files"]:
+            state_folder = os.path.dirname(state_path)
+            # The project root itself is not tracked as a folder
+            if state_folder != state_path_for("."):
+                folder = await get_entry(state_folder)
+                if folder is None or folder.kind != DIR:
+                    return {"success": False, "error": f"Folder does not exist: {folder_path}"}
+            entry = await get_entry(state_path)
+            if entry is not None and entry.kind == FILE:
                 return {"success": True, "result": f"File already exists: {full_path}"}
             result = await retry_file_operation(create_file, tool_input["path"], tool_input.get("content", ""))
-            project_state["files"].add(full_path)
 
         elif tool_name == "write_to_file":
             full_path = os.path.normpath(tool_input["path"]).replace(os.sep, '/')
-            if full_path not in project_state["files"]:
-                # If the file doesn't exist in our state, check if it exists on the file system
-                if os.path.isfile(os.path.join(PROJECTS_DIR, full_path)):
-                    project_state["files"].add(full_path)
-                else:
-                    return {"success": False, "error": f"File does not exist: {full_path}"}
+            if not await _file_exists(tool_input["path"]):
+                return {"success": False, "error": f"File does not exist: {full_path}"}
             result = await retry_file_operation(write_to_file, tool_input["path"], tool_input["content"])
-            project_state["files"].add(full_path)
+
+        elif tool_name == "batch_write":
+            results = await batch_write(tool_input.get("folders"), tool_input.get("files"),
+                                        tool_input.get("overwrite", False))
+            result = format_batch_results(results)
+
+        elif tool_name == "edit_file":
+            full_path = os.path.normpath(tool_input["path"]).replace(os.sep, '/')
+            if not await _file_exists(tool_input["path"]):
+                return {"success": False, "error": f"File does not exist: {full_path}"}
+            # Not retried: an edit that does not match will not match on the next attempt either
+            result = await edit_file(tool_input["path"], tool_input.get("edits"), tool_input.get("patch"),
+                                     tool_input.get("expected_sha256"))
 
         elif tool_name == "read_file":
             full_path = os.path.normpath(tool_input["path"]).replace(os.sep, '/')
-            if full_path not in project_state["files"]:
-                # If the file doesn't exist in our state, check if it exists on the file system
-                if os.path.isfile(os.path.join(PROJECTS_DIR, full_path)):
-                    project_state["files"].add(full_path)
-                else:
-                    return {"success": False, "error": f"File does not exist: {full_path}"}
-            result = await retry_file_operation(read_file, tool_input["path"])
+            if not await _file_exists(tool_input["path"]):
+                return {"success": False, "error": f"File does not exist: {full_path}"}
+            options = {key: tool_input[key] for key in ("offset", "limit", "start_line", "end_line") if key in tool_input}
+            result = await retry_file_operation(read_file, tool_input["path"], **options)
 
         elif tool_name == "list_files":
-            result = await retry_file_operation(list_files, tool_input["path"])
+            options = {key: tool_input[key] for key in ("recursive", "max_depth", "pattern") if key in tool_input}
+            result = await retry_file_operation(list_files, tool_input["path"], **options)
 
         elif tool_name == "delete_file":
             full_path = os.path.normpath(tool_input["path"]).replace(os.sep, '/')
-            if full_path not in project_state["files"] and full_path not in project_state["folders"]:
+            if await get_entry(state_path_for(tool_input["path"])) is None:
                 return {"success": False, "error": f"File or folder does not exist: {full_path}"}
             result = await retry_file_operation(delete_file, tool_input["path"])
-            project_state["files"].discard(full_path)
-            project_state["folders"].discard(full_path)
 
         elif tool_name == "search":
             result = await perform_search(tool_input["query"])
@@ -167,10 +254,7 @@ async def execute_tool(tool_name, tool_input):
         else:
             return {"success": False, "error": f"Unknown tool: {tool_name}"}
         
-        await save_state_to_file(project_state)
-        await sync_filesystem()
         logger.debug(f"Tool result: {result}")
-        logger.debug(f"Project state after {tool_name}: {project_state}")
         return {"success": True, "result": result}
     except Exception as e:
         logger.error(f"Error executing tool {tool_name}: {str(e)}", exc_info=True)
@@ -0,0 +1,249 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import codecs
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import uuid
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from typing import AsyncIterator, NamedTuple, Optional
+from config import UPLOADS_DIR, UPLOAD_MAX_BYTES, UPLOAD_PREVIEW_BYTES, DURABILITY_MODE
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upload contents are stored once per SHA-256 under this folder; each file in
+# UPLOADS_DIR is its own copy (a reflink where supported). Kept out of the
+# project index and listings through project_index.UNTRACKED_NAMES
+BLOBS_DIR_NAME = ".blobs"
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StoredUpload(NamedTuple):
+    path: str             # full path of the file in UPLOADS_DIR
+    size: int
+    sha256: str
+    deduplicated: bool    # the content was already stored by an earlier upload
+    preview: str          # start of the file as text, "" for binary files
+    is_text: bool
+    truncated: bool       # preview is shorter than the file
+
+
+def safe_upload_name(filename: Optional[str]) -> str:
+    """
+    File name of an upload without any directory part. Raises ValueError for
+    names that cannot be stored.
+    """
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    if name in ("", ".", "..") or name == BLOBS_DIR_NAME:
+        raise ValueError(f"Invalid upload file name: {filename!r}")
+    return name
+
+
+class _BlobWriter:
+    """
+    Temp file in the blob folder that hashes chunks as they are written and
+    keeps the first preview_bytes for the response.
+    """
+
+    def __init__(self, blobs_dir: str, max_bytes: int, preview_bytes: int):
+        os.makedirs(blobs_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".upload.", suffix=".tmp", dir=blobs_dir)
+        self.file = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = bytearray()
+        self.max_bytes = max_bytes
+        self.preview_bytes = preview_bytes
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"Upload larger than {self.max_bytes} bytes")
+        self.digest.update(chunk)
+        if len(self.head) < self.preview_bytes:
+            self.head += chunk[:self.preview_bytes - len(self.head)]
+        self.file.write(chunk)
+
+    def finish(self):
+        if DURABILITY_MODE in ("fsync-file", "fsync-file+dir"):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _preview(head: bytes, size: int):
+    """
+    (text, is_text, truncated) for the first bytes of a file. Files with NUL
+    bytes or invalid UTF-8 are binary and get no text preview.
+    """
+    if b"\0" in head:
+        return "", False, size > 0
+    try:
+        # A multi-byte character cut off at the end of head is not an error
+        text = codecs.getincrementaldecoder("utf-8")().decode(bytes(head), final=len(head) == size)
+    except UnicodeDecodeError:
+        return "", False, size > 0
+    return text, True, len(head) < size
+
+
+# ioctl that makes a file share another file's data blocks (btrfs, XFS, ...), from linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _clone_file(source: str, target: str):
+    """
+    Copy source to target as a reflink where the file system supports one (the
+    copy shares blocks until either side is written), otherwise byte by byte.
+    """
+    if fcntl is not None:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+    shutil.copyfile(source, target)
+
+
+def _copy_into_place(blob_path: str, target: str):
+    """
+    Give target its own writable copy of blob_path, replacing an existing file
+    atomically. Writing to the upload never changes the stored blob or other
+    uploads of the same content.
+    """
+    tmp_target = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        _clone_file(blob_path, tmp_target)
+        os.chmod(tmp_target, 0o666 & ~_UMASK)
+        os.replace(tmp_target, target)
+    except BaseException:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+        raise
+
+
+def _commit_blob(writer: _BlobWriter, blobs_dir: str, target: str) -> bool:
+    """
+    Move the finished temp file to its content address (or drop it when that
+    content is already stored) and copy it to the upload name. Returns True
+    when the content was a duplicate.
+    """
+    sha256 = writer.digest.hexdigest()
+    blob_dir = os.path.join(blobs_dir, sha256[:2])
+    blob_path = os.path.join(blob_dir, sha256)
+    os.makedirs(blob_dir, exist_ok=True)
+    deduplicated = os.path.exists(blob_path)
+    if deduplicated:
+        os.remove(writer.tmp_path)
+    else:
+        # Read-only, since it is the reference copy of this content
+        os.chmod(writer.tmp_path, 0o444 & ~_UMASK)
+        os.replace(writer.tmp_path, blob_path)
+    _copy_into_place(blob_path, target)
+    return deduplicated
+
+
+async def store_upload(filename: str, chunks: AsyncIterator[bytes], uploads_dir: str = UPLOADS_DIR,
+                       max_bytes: int = UPLOAD_MAX_BYTES, preview_bytes: int = UPLOAD_PREVIEW_BYTES) -> StoredUpload:
+    """
+    Write an upload to disk chunk by chunk as it arrives, hashing it on the
+    way, and store it content-addressed so identical uploads share one stored blob.
+    Raises UploadTooLarge (nothing is kept) once more than max_bytes arrive.
+    """
+    name = safe_upload_name(filename)
+    blobs_dir = os.path.join(uploads_dir, BLOBS_DIR_NAME)
+    writer = await asyncio.to_thread(_BlobWriter, blobs_dir, max_bytes, preview_bytes)
+    try:
+        async for chunk in chunks:
+            if chunk:
+                await asyncio.to_thread(writer.write, chunk)
+        await asyncio.to_thread(writer.finish)
+        target = os.path.join(uploads_dir, name)
+        deduplicated = await asyncio.to_thread(_commit_blob, writer, blobs_dir, target)
+    except BaseException:
+        await asyncio.to_thread(writer.discard)
+        raise
+
+    metrics.increment("uploads")
+    metrics.increment("upload_bytes", writer.size)
+    if deduplicated:
+        metrics.increment("uploads_deduplicated")
+    preview, is_text, truncated = _preview(writer.head, writer.size)
+    logger.info(f"Stored upload {name} ({writer.size} bytes, SHA-256: {writer.digest.hexdigest()}, deduplicated: {deduplicated})")
+    return StoredUpload(target, writer.size, writer.digest.hexdigest(), deduplicated, preview, is_text, truncated)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prune_blobs(uploads_dir: str = UPLOADS_DIR) -> int:
+    """
+    Remove stored contents no file in uploads_dir still has. Only uploads with
+    the size of some blob are hashed. Run at startup, before uploads are
+    accepted. Returns how many were removed.
+    """
+    blobs_dir = os.path.join(uploads_dir, BLOBS_DIR_NAME)
+    if not os.path.isdir(blobs_dir):
+        return 0
+    blobs = {}
+    for prefix in os.scandir(blobs_dir):
+        if not prefix.is_dir():
+            continue
+        for blob in os.scandir(prefix.path):
+            try:
+                blobs[blob.name] = (blob.path, blob.stat().st_size)
+            except OSError:
+                continue
+    sizes = {size for _, size in blobs.values()}
+    referenced = set()
+    for item in os.scandir(uploads_dir):
+        try:
+            if item.is_file(follow_symlinks=False) and item.stat().st_size in sizes:
+                referenced.add(_file_sha256(item.path))
+        except OSError as e:
+            logger.debug(f"Could not hash {item.path}: {str(e)}")
+    removed = 0
+    for sha256, (path, _) in blobs.items():
+        if sha256 in referenced:
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.debug(f"Could not prune {path}: {str(e)}")
+    return removed
@@ -0,0 +1,188 @@
+# This file is part of Claude Plus.
+#
+# Claude Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Claude Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Claude Plus.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import os
+import time
+import logging
+import zipfile
+from typing import Iterator, NamedTuple, Optional
+from config import DOWNLOAD_CHUNK_BYTES
+from project_map import IgnoreRules
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Already compressed formats are stored as they are instead of being deflated again
+STORED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".jar", ".whl",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".mov", ".webm", ".pdf", ".woff", ".woff2"
+}
+
+
+class ExportEntry(NamedTuple):
+    path: str          # archive name, relative to the export root with '/' separators
+    full_path: str
+    is_dir: bool
+    stat: os.stat_result
+
+
+def _load_gitignore(rules: IgnoreRules, root: str, folder: str):
+    path = os.path.join(root, folder, ".gitignore") if folder else os.path.join(root, ".gitignore")
+    rules.add_gitignore(path, folder)
+
+
+def iter_export_entries(root: str, subpath: str = "", since: Optional[float] = None,
+                        use_ignore: bool = True) -> Iterator[ExportEntry]:
+    """
+    Folders and files below root/subpath in sorted depth-first order, read
+    lazily with scandir. Paths are relative to root so a partial export keeps
+    its place in the tree. With use_ignore, the project map's ignore rules and
+    every .gitignore on the way apply. With since, only files modified after
+    that timestamp are listed and folders are left out.
+    """
+    rules = IgnoreRules.for_project([], root) if use_ignore else None
+    parts = [part for part in subpath.split("/") if part]
+    if rules is not None:
+        # .gitignore files above subpath still apply to it
+        for depth in range(len(parts)):
+            _load_gitignore(rules, root, "/".join(parts[:depth]))
+    start = "/".join(parts)
+
+    def listing(folder: str):
+        full_folder = os.path.join(root, folder) if folder else root
+        if rules is not None:
+            _load_gitignore(rules, root, folder)
+        try:
+            with os.scandir(full_folder) as iterator:
+                return iter(sorted(iterator, key=lambda item: item.name))
+        except OSError as e:
+            logger.debug(f"Could not list {full_folder}: {str(e)}")
+            return iter(())
+
+    stack = [(start, listing(start))]
+    while stack:
+        folder, items = stack[-1]
+        for item in items:
+            path = f"{folder}/{item.name}" if folder else item.name
+            try:
+                is_dir = item.is_dir(follow_symlinks=False)
+                st = item.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if rules is not None and rules.is_ignored(path, is_dir):
+                continue
+            if is_dir:
+                if since is None:
+                    yield ExportEntry(path, item.path, True, st)
+                stack.append((path, listing(path)))
+                break
+            if item.is_file(follow_symlinks=False) and (since is None or st.st_mtime > since):
+                yield ExportEntry(path, item.path, False, st)
+        else:
+            stack.pop()
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    Write-only, non-seekable target for ZipFile that collects the bytes
+    written since the last drain(). Because it cannot seek, ZipFile writes
+    sizes and CRCs in data descriptors after each file.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_info(entry: ExportEntry) -> zipfile.ZipInfo:
+    """
+    Like ZipInfo.from_file, but from the stat taken while listing.
+    """
+    date_time = time.localtime(max(entry.stat.st_mtime, 315532800))[:6]  # zip dates start in 1980
+    info = zipfile.ZipInfo(entry.path + "/" if entry.is_dir else entry.path, date_time)
+    info.external_attr = (entry.stat.st_mode & 0xFFFF) << 16
+    if entry.is_dir:
+        info.external_attr |= 0x10  # MS-DOS directory flag
+    else:
+        info.file_size = entry.stat.st_size
+    return info
+
+
+def _set_compress_level(info: zipfile.ZipInfo, level: int):
+    """
+    Deflate level of an entry written from a ZipInfo. ZipFile only applies its
+    own compresslevel to entries it creates from a name, and ZipInfo exposes the
+    level publicly as compress_level since Python 3.13.
+    """
+    if hasattr(zipfile.ZipInfo, "compress_level"):
+        info.compress_level = level
+    else:
+        # Python 3.10-3.12 keep it in the attribute ZipFile.writestr(compresslevel=...) sets
+        info._compresslevel = level
+
+
+def stream_zip(entries: Iterator[ExportEntry], compress_level: int = 6,
+               chunk_size: int = DOWNLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Zip archive of entries, produced piece by piece while files are read.
+    Memory use is bounded by chunk_size and nothing is written to disk.
+    Level 0 stores files uncompressed.
+    """
+    sink = _StreamSink()
+    files = 0
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compress_level or None) as archive:
+        for entry in entries:
+            info = _zip_info(entry)
+            if entry.is_dir:
+                archive.writestr(info, b"")
+                continue
+            if compress_level == 0 or os.path.splitext(entry.path)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+                _set_compress_level(info, compress_level)
+            try:
+                source = open(entry.full_path, "rb")
+            except OSError as e:
+                # Removed or unreadable since it was listed
+                logger.debug(f"Skipping {entry.full_path} in export: {str(e)}")
+                continue
+            with source, archive.open(info, "w") as target:
+                while chunk := source.read(chunk_size):
+                    target.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            files += 1
+    metrics.increment("download_exports")
+    metrics.increment("download_export_files", files)
+    # Data descriptors of the last file and the central directory
+    yield sink.drain()